@@ -0,0 +1,318 @@
+"""
+Benchmarks for building packages and launching them.
+
+Builds each of the end to end test packages and examples, and records how long
+the build took (in total, and for each phase), how large the package is, how
+many files are in it, and how long it takes to launch, both on a cold start
+(extracting into an empty launch cache) and on a warm start (from the cache).
+
+Usage:
+    python benchmarks/benchmark.py run -o results.json [--only just_python]
+    python benchmarks/benchmark.py compare baseline.json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from typing import Any
+
+import packaged
+from packaged.compression import DECOMPRESS_COMMANDS, DEFAULT_COMPRESSION
+from packaged.delta import read_package_info
+from packaged.trace import Tracer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_PACKAGES = os.path.join(ROOT, "tests", "end_to_end", "test_packages")
+EXAMPLES = os.path.join(ROOT, "example")
+
+RESULTS_VERSION = 1
+# Metrics compared between runs, all of which are better when lower. The time
+# taken by each build phase is compared as well.
+METRICS = ("build_time", "size", "files", "cold_start", "warm_start")
+DEFAULT_THRESHOLD = 10  # percent
+# Timings that changed by less than this many seconds are within the noise
+MIN_TIME_CHANGE = 0.05
+
+
+@dataclass
+class Benchmark:
+    """
+    A package to build. GUI apps are started with a command that only imports
+    them, so that they exit right away.
+    """
+
+    name: str
+    source_directory: str
+    build_command: str
+    startup_command: str
+    python_version: str = packaged.DEFAULT_PYTHON_VERSION
+
+
+BENCHMARKS = [
+    Benchmark(
+        "just_python",
+        os.path.join(TEST_PACKAGES, "just_python"),
+        "",
+        "python foo.py",
+    ),
+    Benchmark(
+        "numpy_pandas",
+        os.path.join(TEST_PACKAGES, "numpy_pandas"),
+        "pip install numpy pandas",
+        "python somefile.py",
+    ),
+    Benchmark(
+        "configtest",
+        os.path.join(TEST_PACKAGES, "configtest"),
+        "pip install .",
+        "python -m configtest",
+    ),
+    Benchmark(
+        "mandelbrot",
+        os.path.join(EXAMPLES, "mandelbrot"),
+        "pip install -r requirements.txt",
+        "python -c 'import matplotlib.pyplot, numba'",
+        python_version="3.10",
+    ),
+    Benchmark(
+        "minesweeper",
+        os.path.join(EXAMPLES, "minesweeper"),
+        "pip install .",
+        "python -c 'import pygame'",
+        python_version="3.11",
+    ),
+]
+
+
+def count_files(package_path: str) -> int:
+    """Counts the members of the package's payload."""
+    info = read_package_info(package_path)
+    with open(package_path, "rb") as package:
+        package.seek(info.header_size)
+        decompressor = subprocess.Popen(
+            DECOMPRESS_COMMANDS[info.compression],
+            stdin=package,
+            stdout=subprocess.PIPE,
+        )
+        assert decompressor.stdout is not None
+        with tarfile.open(fileobj=decompressor.stdout, mode="r|") as tar:
+            files = sum(1 for member in tar if not member.isdir())
+        decompressor.wait()
+
+    return files
+
+
+def time_launch(package_path: str, cache_directory: str) -> float:
+    """Runs the package once, and returns how long it took."""
+    start = time.perf_counter()
+    subprocess.run(
+        [package_path, "--nox11", "--quiet"],
+        env={**os.environ, "PACKAGED_CACHE_DIR": cache_directory},
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def run_benchmark(
+    benchmark: Benchmark,
+    output_directory: str,
+    repeat: int,
+    options: dict[str, Any],
+) -> dict[str, Any]:
+    """Builds and launches the benchmark's package, returning its metrics."""
+    package_path = os.path.join(output_directory, f"{benchmark.name}.bin")
+    tracer = Tracer()
+    start = time.perf_counter()
+    packaged.create_package(
+        benchmark.source_directory,
+        package_path,
+        benchmark.build_command,
+        benchmark.startup_command,
+        benchmark.python_version,
+        quiet=True,
+        # The launch cache is what makes warm starts skip extracting
+        launch_cache=True,
+        trace=tracer,
+        **options,
+    )
+    build_time = time.perf_counter() - start
+
+    phases: dict[str, float] = {}
+    for span in tracer.spans:
+        phases[span.name] = phases.get(span.name, 0.0) + span.duration
+
+    cold_starts = []
+    warm_starts = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_directory:
+            cold_starts.append(time_launch(package_path, cache_directory))
+            warm_starts.append(time_launch(package_path, cache_directory))
+
+    return {
+        "build_time": build_time,
+        "phases": phases,
+        "size": os.path.getsize(package_path),
+        "files": count_files(package_path),
+        "cold_start": statistics.median(cold_starts),
+        "warm_start": statistics.median(warm_starts),
+    }
+
+
+def run(
+    output_path: str,
+    names: list[str] | None,
+    repeat: int,
+    options: dict[str, Any],
+) -> int:
+    """Runs the benchmarks, and writes the results to a JSON file."""
+    results: dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": [platform.system(), platform.machine()],
+        "options": options,
+        "benchmarks": {},
+    }
+    failed = False
+    with tempfile.TemporaryDirectory() as output_directory:
+        for benchmark in BENCHMARKS:
+            if names and benchmark.name not in names:
+                continue
+
+            print(f"Running {benchmark.name}...", file=sys.stderr)
+            try:
+                metrics = run_benchmark(benchmark, output_directory, repeat, options)
+            except Exception as exc:
+                print(f"  failed: {exc!r}", file=sys.stderr)
+                failed = True
+                continue
+
+            results["benchmarks"][benchmark.name] = metrics
+            print(
+                f"  built in {metrics['build_time']:.1f}s,"
+                f" {metrics['size']} bytes in {metrics['files']} files,"
+                f" cold start {metrics['cold_start'] * 1000:.0f}ms,"
+                f" warm start {metrics['warm_start'] * 1000:.0f}ms",
+                file=sys.stderr,
+            )
+
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    return 1 if failed else 0
+
+
+def compare_results(
+    baseline: dict[str, Any],
+    results: dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> list[tuple[str, str, float, float, bool]]:
+    """
+    Compares every metric of the benchmarks in both runs. Returns rows of the
+    benchmark, metric, baseline and new values, and whether it regressed by
+    more than `threshold` percent.
+    """
+    rows = []
+    for name, metrics in results["benchmarks"].items():
+        baseline_metrics = baseline["benchmarks"].get(name)
+        if baseline_metrics is None:
+            continue
+
+        pairs = [
+            (metric, baseline_metrics.get(metric), metrics.get(metric))
+            for metric in METRICS
+        ]
+        baseline_phases = baseline_metrics.get("phases", {})
+        for phase, duration in metrics.get("phases", {}).items():
+            pairs.append((f"phase:{phase}", baseline_phases.get(phase), duration))
+
+        for metric, old, new in pairs:
+            if old is None or new is None:
+                continue
+
+            change = (new - old) / old * 100 if old else 0.0
+            is_time = metric not in ("size", "files")
+            regressed = change > threshold and (
+                not is_time or new - old >= MIN_TIME_CHANGE
+            )
+            rows.append((name, metric, old, new, regressed))
+
+    return rows
+
+
+def compare(baseline_path: str, results_path: str, threshold: float) -> int:
+    """Prints the comparison of two runs, returning 1 if anything regressed."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(results_path) as results_file:
+        results = json.load(results_file)
+
+    rows = compare_results(baseline, results, threshold)
+    print(f"{'Benchmark':<14}  {'Metric':<24}  {'Before':>12}  {'After':>12}  Change")
+    for name, metric, old, new, regressed in rows:
+        change = (new - old) / old * 100 if old else 0.0
+        flag = "  REGRESSION" if regressed else ""
+        print(
+            f"{name:<14}  {metric:<24}  {old:>12.4g}  {new:>12.4g}"
+            f"  {change:+6.1f}%{flag}"
+        )
+
+    return 1 if any(regressed for *_, regressed in rows) else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for building packages and launching them."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("-o", "--output", default="benchmark-results.json")
+    run_parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=[benchmark.name for benchmark in BENCHMARKS],
+        help="Benchmarks to run, defaults to all of them",
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=5, help="Launches to take the median of"
+    )
+    run_parser.add_argument(
+        "--build-cache",
+        action="store_true",
+        help="Reuse earlier builds, to measure everything but the build command",
+    )
+    run_parser.add_argument("--compression", default=DEFAULT_COMPRESSION)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two runs, and flag regressions"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Change in percent that counts as a regression",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        options = {"build_cache": args.build_cache, "compression": args.compression}
+        return run(args.output, args.only, args.repeat, options)
+
+    return compare(args.baseline, args.results, args.threshold)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,17 @@
 
 from __future__ import annotations
 
+import asyncio
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from functools import partial
 import os.path
 import shutil
 import subprocess
 import sys
-import tempfile
-from typing import cast, TYPE_CHECKING
+import threading
+from typing import Any, Callable, cast, TYPE_CHECKING
 from unittest import mock
 
 import yen.github
@@ -15,13 +20,81 @@ from yaspin import yaspin
 
 from pycify import replace_py_with_pyc
 
+from packaged.archive import Payload, write_package
+from packaged.build_log import (
+    DEFAULT_LOG_BACKUPS,
+    BuildCancelled,
+    BuildLog,
+    CancelToken,
+    ProgressEvent,
+    run_command,
+)
+from packaged.build_cache import (
+    DEFAULT_BUILD_CACHE_SIZE,
+    build_cache_key,
+    build_lock,
+    hash_file,
+    hash_tree,
+    invalidate_build,
+    layer_cache_key,
+    package_changes,
+    restore_build,
+    restore_layer,
+    save_build,
+    save_layer,
+    snapshot_package,
+)
+from packaged.bytecode import compile_bytecode
+from packaged.compression import (
+    DEFAULT_COMPRESSION,
+    DEFAULT_COMPRESSION_GOAL,
+    CompressorNotAvailable,
+    choose_compression,
+    makeself_options as compression_options,
+)
+from packaged.dedupe import dedupe_tree
+from packaged.launch_trace import startup_script
+from packaged.prune import (
+    ALWAYS_USED_PATTERNS,
+    UNUSED_PRUNE_ROOTS,
+    PruneProfileNotFound,
+    profile_patterns,
+    prune_tree,
+    prune_unused as prune_unused_files,
+)
+from packaged.relocate import relocate_tree
+from packaged.staging import (
+    create_staging_directory,
+    is_unmodified_by_builds,
+    populate_tree,
+)
+from packaged.stdlib_zip import zip_modules
+from packaged.strip import StripNotAvailable, strip_command, strip_tree
+from packaged.trace import Tracer
+from packaged.usage import record_usage
+from packaged.utils import format_size
+from packaged.wheelhouse import install_from_wheelhouse, wheelhouse_environment
+
 if TYPE_CHECKING:
     from yaspin.core import Yaspin
 
-MAKESELF_PATH = os.path.join(os.path.dirname(__file__), "makeself.sh")
 DEFAULT_PYTHON_VERSION = "3.12"
 PACKAGED_PYTHON_FOLDER_NAME = ".packaged_python"
 
+# The package verifies its payload with one of these checksums when it starts.
+# It's computed while the payload is being extracted, so it is read only once.
+CHECKSUM_OPTIONS = {
+    "sha256": ["--sha256", "--nomd5", "--nocrc"],
+    "md5": ["--nocrc"],
+    "crc": ["--nomd5"],
+    "none": ["--nomd5", "--nocrc"],
+}
+DEFAULT_CHECKSUM = "md5"
+
+# Builds running at the same time wait for each other's downloads of a version
+_python_locks: dict[str, threading.Lock] = {}
+_python_locks_lock = threading.Lock()
+
 
 class SourceDirectoryNotFound(Exception):
     """Raised when provided directory to package does not exist."""
@@ -43,6 +116,22 @@ class OutputPathExists(Exception):
     """Raised when the output path already exists."""
 
 
+@dataclass
+class BuildResult:
+    """
+    The package that a build made: its absolute path, its size in bytes, the
+    sha256 checksum of the whole file, the compression it was written with,
+    and the time in seconds that the build took, in total and in each phase.
+    """
+
+    output_path: str
+    size: int
+    checksum: str
+    compression: str
+    duration: float
+    timings: dict[str, float] = field(default_factory=dict)
+
+
 def create_package(
     source_directory: str | None,
     output_path: str,
@@ -52,171 +141,840 @@ def create_package(
     quiet: bool = False,
     pyc: bool = False,
     ignore_file_patterns: list[str] | None = None,
-) -> None:
-    """Create the makeself executable, with the startup script in it."""
+    *,
+    launch_cache: bool = False,
+    compression: str = DEFAULT_COMPRESSION,
+    compression_level: int | None = None,
+    compression_threads: int | None = None,
+    compression_goal: str = DEFAULT_COMPRESSION_GOAL,
+    checksum: str = DEFAULT_CHECKSUM,
+    build_cache: bool = False,
+    rebuild: bool = False,
+    build_cache_size: int = DEFAULT_BUILD_CACHE_SIZE,
+    build_cache_path: str | None = None,
+    prune: list[str] | None = None,
+    prune_include: list[str] | None = None,
+    prune_exclude: list[str] | None = None,
+    prune_unused: bool = False,
+    prune_unused_commands: list[str] | None = None,
+    prune_manifest: str | None = None,
+    payload_order: bool = False,
+    payload_order_commands: list[str] | None = None,
+    payload_chunks: int = 1,
+    bytecode: bool = False,
+    bytecode_optimization: list[int] | None = None,
+    bytecode_keep_sources: bool = True,
+    zip_stdlib: bool = False,
+    zip_site_packages: bool = False,
+    trace: Tracer | None = None,
+    shared_runtime: bool = False,
+    shared_site_packages: bool = False,
+    dedupe: bool = False,
+    strip: bool = False,
+    wheelhouse: str | None = None,
+    incremental: bool = False,
+    build_log: str | None = None,
+    on_progress: Callable[[ProgressEvent], None] | None = None,
+    cancel: CancelToken | None = None,
+) -> BuildResult:
+    """
+    Create the makeself executable, with the startup script in it.
+
+    With `launch_cache`, the executable extracts itself once into a per-user
+    cache directory keyed by its checksum, and runs from there on later launches.
+
+    `compression` is one of the compressors in `packaged.compression.COMPRESSORS`,
+    or "auto" to test each available one on the package, and pick the best fit
+    for `compression_goal`.
+
+    `checksum` is the checksum that the package verifies itself with, out of
+    `CHECKSUM_OPTIONS`.
+
+    With `build_cache`, the packaged Python is stored after running the build
+    command, and reused by later builds with the same Python version, build
+    command and dependency files. `rebuild` discards the stored build first.
+    Builds, and the layers of incremental packages, are stored in the
+    `build_cache_path` directory if one is given, rather than in the user's
+    build cache.
+
+    After the build command runs, files matching the `prune` profiles (out of
+    `packaged.prune.PRUNE_PROFILES`) or the `prune_exclude` patterns are removed
+    from the package, except for ones matching the `prune_include` patterns.
+    These patterns are relative to the package directory.
+
+    With `prune_unused`, the `prune_unused_commands` (or the startup command)
+    are run in the package before that, and the files of the standard library
+    and installed packages that they didn't use are removed too, other than
+    ones matching the `prune_include` patterns. The files removed and kept are
+    written to the `prune_manifest` file as JSON, if one is given.
+
+    With `payload_order`, the `payload_order_commands` (or the startup command)
+    are run in the finished package, and the files they used are written first,
+    in the order they were used. The package starts the startup script once
+    those are extracted, and extracts the rest in the background meanwhile.
+
+    With more than one of `payload_chunks`, the payload is split into that many
+    separately compressed archives, which the package extracts in parallel.
+
+    With `bytecode`, every module in the packaged Python (the standard library
+    and installed packages) is compiled ahead of time, at the given
+    `bytecode_optimization` levels. Without `bytecode_keep_sources`, the `.py`
+    files are replaced by the compiled `.pyc` files.
+
+    With `zip_stdlib` and `zip_site_packages`, the pure Python modules of the
+    standard library and of the installed packages are compiled and moved into
+    a single zip file, so that the package has far fewer files to extract.
+
+    With a `trace`, every phase of the build is recorded in it as a timed span,
+    along with details like the number of files and bytes it handled.
+
+    With `shared_runtime`, the files of the packaged Python that the build
+    command doesn't change are written as a separate layer of the package,
+    named by the hash of its contents. Packages extract it once into a per-user
+    store, and hardlink it from there. `shared_site_packages` puts the installed
+    packages into that layer as well.
+
+    With `dedupe`, files with the same contents are hardlinked to each other
+    before the package is written, so that they're only stored once.
+
+    With `strip`, debug symbols are removed from the native executables and
+    libraries in the package, other than signed ones.
+
+    With a `wheelhouse` directory, a build command that's a single `pip install`
+    is resolved against the wheels in it, which are downloaded once if they're
+    missing, and unpacked into the packaged Python in parallel. Other build
+    commands run with pip set up to install only from the wheelhouse.
+
+    With `incremental`, the packaged Python is written as a layer of its own,
+    and stored compressed in the build cache. Later builds with the same build,
+    source tree and options reuse it without running the build command, and
+    only write the rest of the package. The layer is extracted along with the
+    rest of the package, or into the per-user store with `shared_runtime`.
+
+    The output of the build command and the compressor is streamed line by
+    line into the `build_log` file if one is given, which is rotated as it
+    grows, and only its last lines are kept in memory to show if they fail.
+    `on_progress` is called with a `ProgressEvent` for every phase of the build,
+    every line of output, and every package that pip collects and installs.
+
+    Every build is assembled in a staging directory of its own, so builds can
+    run in different threads at the same time, even of the same project. Once
+    `cancel` is cancelled, the commands that the build is running are killed,
+    everything it made is cleaned up, and it raises `BuildCancelled`.
+
+    Returns a `BuildResult` with the path, size, checksum and timings of the
+    package.
+    """
+    tracer = trace if trace is not None else Tracer()
+    thread_name = threading.current_thread().name
+    build_start = tracer.elapsed()
     if os.path.exists(output_path):
         raise OutputPathExists
 
-    if source_directory is None:
-        source_directory = tempfile.mkdtemp()
+    if compression != "auto":
+        # Fail early if the compressor is missing, rather than after the build
+        compression_options(compression, compression_level, compression_threads)
+
+    # Fail early on unknown profiles as well
+    prune_patterns = profile_patterns(prune or [], PACKAGED_PYTHON_FOLDER_NAME)
+    prune_patterns += prune_exclude or []
+
+    # And if there's nothing to strip binaries with
+    strip_arguments = strip_command() if strip else None
 
-    if not os.path.isdir(source_directory):
+    if payload_chunks < 1:
+        raise ValueError(f"Expected at least one payload chunk, got {payload_chunks}")
+
+    if source_directory is not None and not os.path.isdir(source_directory):
         raise SourceDirectoryNotFound(source_directory)
 
-    if pyc:
-        created_pyc_files = replace_py_with_pyc(
-            source_directory,
-            python_version=python_version,
-            ignore_file_patterns=ignore_file_patterns,
+    # The package is assembled in a staging directory, so that the source
+    # directory is left untouched, and builds of it can run at the same time.
+    staging_directory = create_staging_directory()
+    if source_directory is None:
+        package_directory = os.path.join(staging_directory, "package")
+        os.mkdir(package_directory)
+    else:
+        source_directory = os.path.abspath(source_directory)
+        package_directory = os.path.join(
+            staging_directory, os.path.basename(source_directory)
         )
-        if not created_pyc_files:
-            print("No .pyc files were created.", file=sys.stderr)
-        else:
-            print(f"Created {len(created_pyc_files)} .pyc files.")
 
     startup_script_name = "_packaged_startup.sh"
-    startup_script_path = os.path.join(source_directory, startup_script_name)
-
-    packaged_python_path = os.path.join(source_directory, PACKAGED_PYTHON_FOLDER_NAME)
-    if os.path.exists(packaged_python_path):
-        shutil.rmtree(packaged_python_path)
+    startup_script_path = os.path.join(package_directory, startup_script_name)
+    packaged_python_path = os.path.join(package_directory, PACKAGED_PYTHON_FOLDER_NAME)
 
+    log = BuildLog(build_log, cancel_token=cancel)
+    spinner = None
     try:
+        if source_directory is not None:
+            with tracer.span("populate source") as details:
+                details.update(
+                    asdict(populate_tree(source_directory, package_directory))
+                )
+
+        if pyc:
+            with tracer.span("pyc") as details:
+                created_pyc_files = replace_py_with_pyc(
+                    package_directory,
+                    python_version=python_version,
+                    ignore_file_patterns=ignore_file_patterns,
+                )
+                details["files"] = len(created_pyc_files)
+            if not created_pyc_files:
+                print("No .pyc files were created.", file=sys.stderr)
+            else:
+                print(f"Created {len(created_pyc_files)} .pyc files.")
+
         # Use `yen` to ensure a portable Python is present on the system
-        python_version, yen_python_bin_path = ensure_python(python_version)
+        with tracer.span("ensure python", requested_version=python_version):
+            python_version, yen_python_bin_path = ensure_python(python_version)
         yen_python_path = os.path.join(yen.PYTHON_INSTALLS_PATH, python_version)
         yen_python_bin_relpath = os.path.relpath(yen_python_bin_path, yen_python_path)
 
-        # Put a standalone python interpreter inside the package
-        shutil.copytree(yen_python_path, packaged_python_path)
+        cache_key = None
+        if build_cache:
+            cache_key = build_cache_key(
+                python_version, build_command, source_directory or package_directory
+            )
+            if rebuild:
+                invalidate_build(cache_key, build_cache_path)
+
+        # Incremental packages keep the packaged Python in a layer of its own,
+        # which is cached compressed, and reused while nothing that changes it
+        # does. Then only the rest of the package is written again.
+        layer_key = None
+        cached_layer = None
+        if incremental:
+            # Files written into the source directory by the build itself don't
+            # change the layer
+            outputs = [output_path]
+            if build_log is not None:
+                outputs.append(build_log)
+                outputs += [
+                    f"{build_log}.{index}"
+                    for index in range(1, DEFAULT_LOG_BACKUPS + 1)
+                ]
+            if prune_manifest is not None:
+                outputs.append(prune_manifest)
+            layer_key = layer_cache_key(
+                build_cache_key(
+                    python_version, build_command, source_directory or package_directory
+                ),
+                hash_tree(source_directory or package_directory, exclude=outputs),
+                {
+                    "prune": prune_patterns,
+                    "prune_include": prune_include,
+                    "prune_unused": prune_unused,
+                    "prune_unused_commands": prune_unused_commands,
+                    "payload_order": payload_order,
+                    "payload_order_commands": payload_order_commands,
+                    "bytecode": bytecode,
+                    "bytecode_optimization": bytecode_optimization,
+                    "bytecode_keep_sources": bytecode_keep_sources,
+                    "zip_stdlib": zip_stdlib,
+                    "zip_site_packages": zip_site_packages,
+                    "strip": strip,
+                    "dedupe": dedupe,
+                    "compression": compression,
+                    "compression_level": compression_level,
+                    "compression_threads": compression_threads,
+                    "compression_goal": compression_goal,
+                    "checksum": checksum,
+                },
+            )
+            if rebuild:
+                invalidate_build(layer_key, build_cache_path)
+            cached_layer = restore_layer(layer_key, build_cache_path)
 
-        # Get the `python/bin` folder path relative to source directory
+        # Get the `python/bin` folder path relative to package directory
         python_bin_folder = os.path.join(
             packaged_python_path, os.path.dirname(yen_python_bin_relpath)
         )
-        python_bin_folder_relpath = os.path.relpath(python_bin_folder, source_directory)
+        python_bin_folder_relpath = os.path.relpath(
+            python_bin_folder, package_directory
+        )
 
-        # Run the build command in the source directory, while making sure
+        # Run the build command in the package directory, while making sure
         # that `python` and related binaries point to the installed python
-        if quiet:
-            spinner = cast("Yaspin", mock.Mock())
-        else:
-            spinner = yaspin(text="Running the build command...")
+        spinner = _ProgressSpinner(
+            (
+                cast("Yaspin", mock.Mock())
+                if quiet
+                else yaspin(text="Running the build command...")
+            ),
+            on_progress,
+            log.cancel_token,
+        )
+        log.on_event = spinner.on_event
 
         spinner.start()
-        try:
-            subprocess.run(
-                [build_command],
-                shell=True,
-                env={
-                    "PATH": os.pathsep.join(
-                        [python_bin_folder, os.environ.get("PATH", "")]
+        spinner.text = "Running the build command..."
+
+        if cached_layer is not None:
+            spinner.write("Reusing the packaged Python from an earlier build.")
+        else:
+            # Builds with the same cache key run one at a time, so that only the
+            # first one runs the build command, and the rest restore its result
+            with (
+                build_lock(cache_key, build_cache_path)
+                if cache_key is not None
+                else nullcontext()
+            ):
+                restored = False
+                if cache_key is not None:
+                    with tracer.span("restore build") as details:
+                        restored = restore_build(
+                            cache_key,
+                            packaged_python_path,
+                            package_directory,
+                            build_cache_path,
+                        )
+                        details["restored"] = restored
+
+                if restored:
+                    spinner.write("Restored the build from cache.")
+                else:
+                    # Put a standalone python interpreter inside the package. Files that
+                    # the build won't change are hardlinked from yen's copy of it.
+                    with tracer.span("populate python") as details:
+                        populate_stats = populate_tree(
+                            yen_python_path,
+                            packaged_python_path,
+                            can_hardlink=is_unmodified_by_builds,
+                        )
+                        details.update(asdict(populate_stats))
+
+                    # The build command can write anywhere in the package, and
+                    # what it changes outside the packaged Python is cached too
+                    package_before = None
+                    if cache_key is not None:
+                        package_before = snapshot_package(
+                            package_directory, PACKAGED_PYTHON_FOLDER_NAME
+                        )
+
+                    with tracer.span("build command", command=build_command) as details:
+                        try:
+                            wheelhouse_report = None
+                            if wheelhouse is not None:
+                                wheelhouse_report = install_from_wheelhouse(
+                                    os.path.join(
+                                        packaged_python_path, yen_python_bin_relpath
+                                    ),
+                                    build_command,
+                                    wheelhouse,
+                                    package_directory,
+                                    log=log,
+                                )
+                            if wheelhouse_report is None:
+                                run_command(
+                                    [build_command],
+                                    log,
+                                    shell=True,
+                                    env={
+                                        "PATH": os.pathsep.join(
+                                            [
+                                                python_bin_folder,
+                                                os.environ.get("PATH", ""),
+                                            ]
+                                        ),
+                                        **(
+                                            wheelhouse_environment(wheelhouse)
+                                            if wheelhouse is not None
+                                            else {}
+                                        ),
+                                    },
+                                    cwd=package_directory,
+                                )
+                            else:
+                                details.update(asdict(wheelhouse_report))
+                        except subprocess.CalledProcessError as exc:
+                            spinner.stop()
+                            _print_failure("Build Failed", exc, log)
+                            raise
+
+                    if wheelhouse_report is not None:
+                        spinner.write(
+                            f"Installed {wheelhouse_report.installed} wheels from the"
+                            f" wheelhouse ({wheelhouse_report.built} built from source,"
+                            f" {wheelhouse_report.downloaded} downloaded into it)."
+                        )
+
+                    if cache_key is not None:
+                        assert package_before is not None
+                        spinner.text = "Saving the build to cache..."
+                        with tracer.span("save build"):
+                            changed, removed = package_changes(
+                                package_before,
+                                snapshot_package(
+                                    package_directory, PACKAGED_PYTHON_FOLDER_NAME
+                                ),
+                            )
+                            save_build(
+                                cache_key,
+                                packaged_python_path,
+                                build_cache_size,
+                                package_directory,
+                                changed,
+                                removed,
+                                build_cache_path,
+                            )
+
+        if cached_layer is None and prune_unused:
+            spinner.text = "Recording the files your app uses..."
+            with tracer.span("record usage") as details:
+                try:
+                    used = record_usage(
+                        package_directory,
+                        prune_unused_commands or [startup_command],
+                        python_bin_folder,
+                        log,
                     )
-                },
-                cwd=source_directory,
-                check=True,
-                capture_output=True,
+                except subprocess.CalledProcessError as exc:
+                    spinner.stop()
+                    _print_failure("Recording Usage Failed", exc, log)
+                    raise
+                details["files"] = len(used)
+
+            spinner.text = "Pruning unused files..."
+            with tracer.span("prune unused") as details:
+                manifest = prune_unused_files(
+                    package_directory,
+                    [
+                        f"{PACKAGED_PYTHON_FOLDER_NAME}/{root}"
+                        for root in UNUSED_PRUNE_ROOTS
+                    ],
+                    set(used),
+                    [
+                        *(
+                            f"{PACKAGED_PYTHON_FOLDER_NAME}/{pattern}"
+                            for pattern in ALWAYS_USED_PATTERNS
+                        ),
+                        *(prune_include or []),
+                    ],
+                )
+                details["files"] = len(manifest.removed)
+                details["bytes"] = manifest.total_bytes
+            if prune_manifest is not None:
+                manifest.write(prune_manifest)
+            spinner.write(
+                f"Pruned {len(manifest.removed)} unused files"
+                f" ({format_size(manifest.total_bytes)}),"
+                f" kept {len(manifest.kept)}."
             )
-        except subprocess.CalledProcessError as exc:
-            spinner.stop()
-            print("*** Build Failed:", file=sys.stderr)
-            print("Stdout:\n" + exc.stdout.decode(errors="ignore"), file=sys.stderr)
-            print("Stderr:\n" + exc.stdout.decode(errors="ignore"), file=sys.stderr)
-            raise
+
+        if prune_patterns:
+            spinner.text = "Pruning unneeded files..."
+            with tracer.span("prune") as details:
+                report = prune_tree(package_directory, prune_patterns, prune_include)
+                details["files"] = report.total_files
+                details["bytes"] = report.total_bytes
+            spinner.write(
+                f"Pruned {report.total_files} files"
+                f" ({format_size(report.total_bytes)})."
+            )
+            for pattern, size in sorted(
+                report.bytes.items(), key=lambda item: item[1], reverse=True
+            ):
+                files = report.files[pattern]
+                spinner.write(f"  {pattern}: {files} files ({format_size(size)})")
+
+        if cached_layer is None and (zip_stdlib or zip_site_packages):
+            spinner.text = "Zipping modules..."
+            with tracer.span("zip modules") as details:
+                zip_stats = zip_modules(
+                    os.path.join(packaged_python_path, yen_python_bin_relpath),
+                    stdlib=zip_stdlib,
+                    site_packages=zip_site_packages,
+                )
+                details["modules"] = zip_stats.modules
+                details["files_before"] = zip_stats.files_before
+                details["files_after"] = zip_stats.files_after
+            spinner.write(
+                f"Zipped {zip_stats.modules} modules into"
+                f" {os.path.basename(zip_stats.zip_path)}, leaving"
+                f" {zip_stats.files_after} files instead of {zip_stats.files_before}."
+            )
+
+        if cached_layer is None and bytecode:
+            spinner.text = "Compiling bytecode..."
+            with tracer.span("bytecode") as details:
+                stats = compile_bytecode(
+                    os.path.join(packaged_python_path, yen_python_bin_relpath),
+                    [packaged_python_path],
+                    bytecode_optimization,
+                    bytecode_keep_sources,
+                )
+                details["modules"] = stats.modules
+                details["cpu_time"] = stats.cpu_time
+            if stats.errors:
+                spinner.write("Some files failed to compile:\n" + stats.errors)
+            spinner.write(
+                f"Compiled {stats.modules} modules in {stats.duration:.1f}s,"
+                f" saving up to {stats.cpu_time:.1f}s of compiling on a cold start."
+            )
+
+        if strip_arguments is not None:
+            spinner.text = "Stripping debug symbols..."
+            with tracer.span("strip") as details:
+                strip_report = strip_tree(package_directory, strip_arguments)
+                details["files"] = strip_report.total_files
+                details["bytes"] = strip_report.total_bytes
+            spinner.write(
+                f"Stripped {strip_report.total_files} binaries"
+                f" ({format_size(strip_report.total_bytes)})."
+            )
+            for group, size in sorted(
+                strip_report.bytes.items(), key=lambda item: item[1], reverse=True
+            ):
+                files = strip_report.files[group]
+                spinner.write(f"  {group}: {files} files ({format_size(size)})")
+            if strip_report.signed:
+                spinner.write(
+                    f"Left {len(strip_report.signed)} signed binaries as they are."
+                )
+            if strip_report.failed:
+                spinner.write(f"Couldn't strip {len(strip_report.failed)} binaries:")
+                for relative_path in strip_report.failed[:10]:
+                    spinner.write(f"  {relative_path}")
+                if len(strip_report.failed) > 10:
+                    spinner.write(f"  and {len(strip_report.failed) - 10} more")
 
         # The startup script is simply the startup command, prepended with a PATH
-        # change to ensure that `python` refers to the bundled python.
+        # change to ensure that `python` refers to the bundled python, and
+        # wrapped to time the app's launch when `PACKAGED_TRACE` is set.
         with open(startup_script_path, "w") as startup_file:
-            startup_file.write(f"PATH={python_bin_folder_relpath}:$PATH\n")
-            startup_file.write(startup_command)
+            startup_file.write(
+                startup_script(python_bin_folder_relpath, startup_command)
+            )
 
         os.chmod(startup_script_path, 0o777)
 
-        # Patch console scripts, replacing the shebang with /usr/bin/env
-        spinner.text = "Patching console scripts..."
-        for filename in os.listdir(python_bin_folder):
-            filepath = os.path.join(python_bin_folder, filename)
-            if not os.path.isfile(filepath):
-                continue
-
-            with open(filepath, "rb") as file:
-                first_two_bytes = file.read(2)
-                if first_two_bytes != b"#!":
-                    continue
-
-                shebang_command = file.readline()
-                first_line = file.readline()
-                second_line = file.readline()
-                rest_of_file = file.read()
-
-            # Case 1: shebang points to packaged python
-            # File looks like this:
-            # #!/path/to/.packaged_python/python/bin/python3.12
-            # ... rest of python code
-            if PACKAGED_PYTHON_FOLDER_NAME.encode() in shebang_command:
-                # rewrite this file to have a `env python` shebang
-                with open(filepath, "wb") as file:
-                    file.write(b"#!/usr/bin/env python\n")
-                    file.write(first_line)
-                    file.write(second_line)
-                    file.write(rest_of_file)
-            # Case 2: shebang is /bin/sh, but the script is an `exec`
-            # with the shebang to packaged python.
-            # File looks like this:
-            # #!/bin/sh
-            # '''exec' /path/to/.packaged_python/python/bin/python3.12 "$0" "$@"
-            # ' '''
-            # ... rest of python code
-            elif (
-                first_line.startswith(b"'''exec' ")
-                and PACKAGED_PYTHON_FOLDER_NAME.encode() in first_line
-            ):
-                # rewrite this file to have a `env python` shebang,
-                # and get rid of the first two lines as they're not needed
-                assert second_line == b"' '''\n"
-                with open(filepath, "wb") as file:
-                    file.write(b"#!/usr/bin/env python\n")
-                    file.write(rest_of_file)
-                first_line
-            else:
-                continue
+        # Installers embed the absolute path of the build into scripts and
+        # metadata, which won't exist once the package is extracted elsewhere.
+        # That's this build's staging directory, or the one that a build restored
+        # from the build cache ran in.
+        spinner.text = "Relocating build paths..."
+        with tracer.span("relocate") as details:
+            relocation = relocate_tree(
+                package_directory, os.path.dirname(staging_directory)
+            )
+            details["files"] = relocation.scanned
+            details["changed"] = len(relocation.changed)
+        if relocation.changed:
+            actions = Counter(relocation.changed.values())
+            spinner.write(
+                f"Relocated {len(relocation.changed)} files ("
+                + ", ".join(f"{action}: {count}" for action, count in actions.items())
+                + ")."
+            )
+        if relocation.unrelocated:
+            spinner.write(
+                f"{len(relocation.unrelocated)} files still contain the build path,"
+                " which won't exist when the package runs:"
+            )
+            for relative_path in relocation.unrelocated[:10]:
+                spinner.write(f"  {relative_path}")
+            if len(relocation.unrelocated) > 10:
+                spinner.write(f"  and {len(relocation.unrelocated) - 10} more")
+
+        if dedupe:
+            spinner.text = "Deduplicating files..."
+            with tracer.span("dedupe") as details:
+                dedupe_report = dedupe_tree(package_directory)
+                details["files"] = dedupe_report.files
+                details["bytes"] = dedupe_report.bytes
+            spinner.write(
+                f"Deduplicated {dedupe_report.files} files"
+                f" ({format_size(dedupe_report.bytes)})."
+            )
+            for relative_path, size in sorted(
+                dedupe_report.duplicates.items(), key=lambda item: item[1], reverse=True
+            )[:5]:
+                spinner.write(f"  {relative_path}: {format_size(size)}")
+
+        if cached_layer is not None:
+            # Every layer of the package is decompressed the same way
+            compression = cached_layer[1]["compression"]
+            compression_level = cached_layer[1]["compression_level"]
+        elif compression == "auto":
+            spinner.text = "Picking a compression method..."
+            with tracer.span("choose compression") as details:
+                trial = choose_compression(
+                    package_directory,
+                    compression_goal,
+                    compression_level,
+                    compression_threads,
+                )
+                details["compression"] = trial.compression
+                details["level"] = trial.level
+            compression, compression_level = trial.compression, trial.level
+            spinner.write(f"Using {compression} -{compression_level} compression.")
+
+        # Packages reusing a layer don't have the packaged Python to run the
+        # commands with, so they use the order recorded when it was built
+        hot_files = None
+        if payload_order and cached_layer is not None:
+            hot_files = cached_layer[1]["payload_order"]
+        elif payload_order:
+            spinner.text = "Recording the order your app uses files in..."
+            with tracer.span("record order") as details:
+                try:
+                    used = record_usage(
+                        package_directory,
+                        payload_order_commands or [startup_command],
+                        python_bin_folder,
+                        log,
+                    )
+                except subprocess.CalledProcessError as exc:
+                    spinner.stop()
+                    _print_failure("Recording Usage Failed", exc, log)
+                    raise
+                details["files"] = len(used)
+            # Named the way they are in the payload, after the startup script
+            # that runs the app, which the shell opens rather than Python
+            hot_files = [
+                os.path.join(".", path) for path in [startup_script_name, *used]
+            ]
+
+        makeself_options = compression_options(
+            compression, compression_level, compression_threads
+        )
+        makeself_options += CHECKSUM_OPTIONS[checksum]
+        if launch_cache:
+            makeself_options.append("--launch-cache")
+
+        runtime_layer = None
+        if incremental:
+            runtime_layer = _in_python_layer
+        elif shared_runtime or shared_site_packages:
+            runtime_layer = partial(
+                _in_runtime_layer, site_packages=shared_site_packages
+            )
 
-        # This uses `makeself` to build the binary
+        # The package is written in the same format as `makeself`, streaming
+        # the files straight from the package directory into the output.
         spinner.text = "Building your package..."
         try:
-            subprocess.run(
-                [
-                    MAKESELF_PATH,
-                    # Path to package
-                    source_directory,
-                    # Filename to output
+            with tracer.span("write package") as details:
+                payload = write_package(
                     output_path,
+                    [(package_directory, ".")],
+                    makeself_options,
                     # Label for the package, for now it's just the filename
-                    output_path,
-                    # The command to run when starting the package.
+                    label=output_path,
                     # `makeself` wants the startup script path to be a relative path
-                    os.path.join(".", startup_script_name),
-                ],
-                check=True,
-                capture_output=True,
-            )
+                    startup_script=os.path.join(".", startup_script_name),
+                    compression=compression,
+                    compression_level=compression_level,
+                    compression_threads=compression_threads,
+                    checksum=checksum,
+                    log=log,
+                    runtime_layer=runtime_layer,
+                    # The layer of incremental packages is only separate so
+                    # that it can be cached, and it's extracted with the rest
+                    shared_runtime=(
+                        not incremental or shared_runtime or shared_site_packages
+                    ),
+                    hot_files=hot_files,
+                    chunks=payload_chunks,
+                    cached_runtime_layer=(
+                        None
+                        if cached_layer is None
+                        else (
+                            cached_layer[0],
+                            Payload(**cached_layer[1]["payload"]),
+                        )
+                    ),
+                )
+                details["bytes"] = payload.size
+                details["uncompressed_bytes"] = payload.uncompressed_size
+                if payload.runtime_layer is not None:
+                    details["runtime_bytes"] = payload.runtime_layer.size
+                    details["runtime_hash"] = payload.runtime_layer.content_hash
+                if payload.hot_layer is not None:
+                    details["hot_bytes"] = payload.hot_layer.size
+                if payload.chunks is not None:
+                    details["chunks"] = len(payload.chunks)
+            if payload.runtime_layer is not None and not incremental:
+                spinner.write(
+                    f"Shared runtime {payload.runtime_layer.content_hash} takes"
+                    f" {format_size(payload.runtime_layer.size)} of the package."
+                )
+            if payload.hot_layer is not None:
+                spinner.write(
+                    f"Files used at startup take"
+                    f" {format_size(payload.hot_layer.size)} of the package."
+                )
+            if layer_key is not None and cached_layer is None:
+                assert payload.runtime_layer is not None
+                with tracer.span("save layer"):
+                    save_layer(
+                        layer_key,
+                        output_path,
+                        offset=os.path.getsize(output_path)
+                        - payload.size
+                        - (payload.hot_layer.size if payload.hot_layer else 0)
+                        - payload.runtime_layer.size,
+                        size=payload.runtime_layer.size,
+                        details={
+                            "payload": asdict(payload.runtime_layer),
+                            "compression": compression,
+                            "compression_level": compression_level,
+                            "payload_order": hot_files,
+                        },
+                        max_size=build_cache_size,
+                        cache_path=build_cache_path,
+                    )
+                spinner.write(
+                    f"Saved the packaged Python"
+                    f" ({format_size(payload.runtime_layer.size)}) for later builds."
+                )
+        except FileExistsError:
+            # Another build created it in the meantime
+            raise OutputPathExists
         except subprocess.CalledProcessError as exc:
             spinner.stop()
-            print("*** Makeself Failed:", file=sys.stderr)
-            print("Stdout:\n" + exc.stdout.decode(errors="ignore"), file=sys.stderr)
-            print("Stderr:\n" + exc.stdout.decode(errors="ignore"), file=sys.stderr)
+            _print_failure("Makeself Failed", exc, log)
             raise
 
+        with tracer.span("hash package"):
+            package_checksum = hash_file(output_path)
+
         spinner.stop()
         if not quiet:
             print(f"Package {output_path!r} built successfully!")
 
+    except Exception as exc:
+        # Whatever the killed commands made the build fail with
+        if log.cancel_token.cancelled and not isinstance(exc, BuildCancelled):
+            raise BuildCancelled from exc
+        raise
+
     finally:
-        # Cleanup the packaged python and startup script from source directory
-        if os.path.exists(startup_script_path):
-            os.remove(startup_script_path)
-        if os.path.exists(packaged_python_path):
-            shutil.rmtree(packaged_python_path)
+        if spinner is not None:
+            spinner.stop()
+        log.close()
+        with tracer.span("clean up"):
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+    return BuildResult(
+        output_path=os.path.abspath(output_path),
+        size=os.path.getsize(output_path),
+        checksum=package_checksum,
+        compression=compression,
+        duration=tracer.elapsed() - build_start,
+        timings=tracer.durations(thread_name, since=build_start),
+    )
+
+
+async def create_package_async(*args: Any, **kwargs: Any) -> BuildResult:
+    """
+    Runs `create_package()` with the same arguments in a thread, so that an
+    event loop can run many builds at once. Cancelling the task cancels the
+    build, and waits for it to clean up.
+    """
+    cancel = CancelToken()
+    loop = asyncio.get_running_loop()
+    build = loop.run_in_executor(
+        None, partial(create_package, *args, cancel=cancel, **kwargs)
+    )
+    try:
+        return await asyncio.shield(build)
+    except asyncio.CancelledError:
+        cancel.cancel()
+        try:
+            await build
+        except BuildCancelled:
+            pass
+        raise
+
+
+class _ProgressSpinner:
+    """
+    Shows the build's progress on the spinner, and passes it on to
+    `on_progress` as events.
+    """
+
+    def __init__(
+        self,
+        spinner: Yaspin,
+        on_progress: Callable[[ProgressEvent], None] | None,
+        cancel_token: CancelToken,
+    ) -> None:
+        self.spinner = spinner
+        self.on_progress = on_progress
+        self.cancel_token = cancel_token
+        self.phase = ""
+        self.running = False
+
+    @property
+    def text(self) -> str:
+        return self.phase
+
+    @text.setter
+    def text(self, text: str) -> None:
+        # Cancelled builds stop before their next phase
+        self.cancel_token.check()
+        self.phase = self.spinner.text = text
+        if self.on_progress is not None:
+            self.on_progress(ProgressEvent("phase", text))
+
+    def write(self, message: str) -> None:
+        self.spinner.write(message)
+        if self.on_progress is not None:
+            self.on_progress(ProgressEvent("message", message))
+
+    def start(self) -> None:
+        self.spinner.start()
+        self.running = True
+
+    def stop(self) -> None:
+        if self.running:
+            self.spinner.stop()
+            self.running = False
+
+    def on_event(self, event: ProgressEvent) -> None:
+        """Shows which package is being installed, next to the phase."""
+        if event.package is not None:
+            self.spinner.text = f"{self.phase} ({event.message})"
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+
+def _print_failure(
+    title: str, exc: subprocess.CalledProcessError, log: BuildLog
+) -> None:
+    """Prints the last of the output of a command that failed."""
+    print(f"*** {title}:", file=sys.stderr)
+    for name, output in (("Stdout", exc.stdout), ("Stderr", exc.stderr)):
+        if output:
+            print(f"{name}:\n" + output.decode(errors="ignore"), file=sys.stderr)
+    if log.path is not None:
+        print(f"The full output is in {log.path!r}.", file=sys.stderr)
+
+
+def _in_python_layer(member_name: str) -> bool:
+    """
+    Returns true for the files of the packaged Python, given their names in the
+    package's tarball.
+    """
+    return member_name.startswith(os.path.join(".", PACKAGED_PYTHON_FOLDER_NAME, ""))
+
+
+def _in_runtime_layer(member_name: str, site_packages: bool) -> bool:
+    """
+    Returns true for the files of the packaged Python that go into the shared
+    runtime layer, given their names in the package's tarball.
+    """
+    if not _in_python_layer(member_name):
+        return False
+
+    prefix = os.path.join(".", PACKAGED_PYTHON_FOLDER_NAME, "")
+    relative_path = member_name[len(prefix) :]
+    if site_packages and "site-packages" in relative_path.split(os.sep):
+        return True
+    return is_unmodified_by_builds(relative_path)
 
 
 def ensure_python(version: str) -> tuple[str, str]:
@@ -224,7 +982,11 @@ def ensure_python(version: str) -> tuple[str, str]:
     Checks that the version of Python we want to use is available on the
     system, and if not, downloads it.
     """
-    try:
-        return yen.ensure_python(version)
-    except yen.github.NotAvailable:
-        raise PythonNotAvailable(version)
+    with _python_locks_lock:
+        lock = _python_locks.setdefault(version, threading.Lock())
+
+    with lock:
+        try:
+            return yen.ensure_python(version)
+        except yen.github.NotAvailable:
+            raise PythonNotAvailable(version)
@@ -0,0 +1,627 @@
+"""Writing the package in one pass, from the files on disk into the output."""
+
+from __future__ import annotations
+
+import contextlib
+from dataclasses import dataclass
+import hashlib
+import heapq
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import threading
+import time
+from typing import IO, BinaryIO, Callable, Iterator, Sequence
+
+from packaged.build_log import BuildLog, pipe_lines
+from packaged.compression import compress_command
+
+MAKESELF_PATH = os.path.join(os.path.dirname(__file__), "makeself.sh")
+# Level that `makeself.sh` compresses with when none is given
+DEFAULT_COMPRESSION_LEVEL = 9
+# The header is first written with the largest possible sizes and checksums,
+# to reserve space for it in front of the payload. Sizes are added up with
+# `expr`, so they are kept well within 64 bits.
+PLACEHOLDER_SIZE = 10**17 - 1
+PLACEHOLDER_CRC = 2**32 - 1
+PLACEHOLDER_HASH = "0" * 64
+
+CHUNK_SIZE = 1024 * 1024
+# Payloads are split into chunks of at least this many uncompressed bytes, as
+# smaller ones take longer to start extracting than they save
+MIN_PAYLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Size of the header of each member in a tarball
+TAR_HEADER_SIZE = 512
+
+
+@dataclass
+class Payload:
+    """
+    Size and checksums of the compressed payload, and its uncompressed size.
+    For packages with a runtime layer, that layer of the package comes before
+    the payload, and has the sha256 hash of its uncompressed contents. For
+    packages ordered by use, the layer with the files used first comes after
+    it, and the payload has the rest. Payloads written in `chunks` are the
+    total of them, without checksums of their own.
+    """
+
+    size: int
+    uncompressed_size: int
+    crc: str | None = None
+    md5: str | None = None
+    sha256: str | None = None
+    runtime_layer: Payload | None = None
+    hot_layer: Payload | None = None
+    chunks: list[Payload] | None = None
+    content_hash: str | None = None
+
+
+class _CountingWriter:
+    """Passes writes through to a file, counting the bytes written."""
+
+    def __init__(self, file: IO[bytes]) -> None:
+        self.file = file
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.file.write(data)
+        self.size += len(data)
+        return len(data)
+
+
+class _HashingWriter:
+    """Passes writes through to a file, hashing the data written."""
+
+    def __init__(self, file: IO[bytes]) -> None:
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.file.write(data)
+        self.hash.update(data)
+        return len(data)
+
+
+def render_header(
+    makeself_options: list[str],
+    archive_directory: str,
+    label: str,
+    startup_script: str,
+    payload: Payload | None,
+    runtime_layer: bool = False,
+    hot_layer: bool = False,
+    chunks: int = 1,
+    shared_runtime: bool = True,
+) -> bytes:
+    """
+    Renders the self-extracting header with `makeself.sh`, for the payload.
+    Without a payload, the header is rendered with the largest possible values,
+    for a payload with the given layers and number of chunks. Unless it's a
+    `shared_runtime`, the runtime layer is extracted like the rest of the payload.
+    """
+    if payload is None:
+        layers = runtime_layer + hot_layer + chunks
+        payload_options = [
+            "--payload-size",
+            " ".join([str(PLACEHOLDER_SIZE)] * layers),
+            "--payload-usize",
+            str(PLACEHOLDER_SIZE),
+            "--payload-crc",
+            " ".join([str(PLACEHOLDER_CRC)] * layers),
+            "--payload-md5",
+            " ".join(["0" * 32] * layers),
+            "--payload-sha256",
+            " ".join(["0" * 64] * layers),
+        ]
+        if runtime_layer and shared_runtime:
+            payload_options += ["--runtime-layer", PLACEHOLDER_HASH]
+        if hot_layer:
+            payload_options.append("--cold-layer")
+        if chunks > 1:
+            payload_options += ["--payload-chunks", str(chunks)]
+    else:
+        archives = payload.chunks or [payload]
+        payload_options = []
+        if payload.chunks is not None:
+            payload_options += ["--payload-chunks", str(len(payload.chunks))]
+        if payload.hot_layer is not None:
+            archives = [payload.hot_layer, *archives]
+            payload_options.append("--cold-layer")
+        if payload.runtime_layer is not None:
+            archives = [payload.runtime_layer, *archives]
+        if payload.runtime_layer is not None and shared_runtime:
+            assert payload.runtime_layer.content_hash is not None
+            payload_options += ["--runtime-layer", payload.runtime_layer.content_hash]
+
+        uncompressed_size = sum(archive.uncompressed_size for archive in archives)
+        payload_options += [
+            "--payload-size",
+            " ".join(str(archive.size) for archive in archives),
+            "--payload-usize",
+            # `makeself.sh` measures it with `du -k`, which rounds up
+            str(-(-uncompressed_size // 1024)),
+        ]
+        for option, attribute in [
+            ("--payload-crc", "crc"),
+            ("--payload-md5", "md5"),
+            ("--payload-sha256", "sha256"),
+        ]:
+            values = [getattr(archive, attribute) for archive in archives]
+            if values[0] is not None:
+                payload_options += [option, " ".join(values)]
+
+    return subprocess.run(
+        [
+            MAKESELF_PATH,
+            "--header-only",
+            "--quiet",
+            *makeself_options,
+            *payload_options,
+            archive_directory,
+            "/dev/stdout",
+            label,
+            startup_script,
+        ],
+        check=True,
+        capture_output=True,
+    ).stdout
+
+
+def tree_members(directory: str, arcname: str) -> Iterator[tuple[str, str]]:
+    """
+    Yields the path of everything inside the directory, and the name it has in
+    the tarball under `arcname`, in the order they are added to it.
+    """
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        relative_root = os.path.relpath(root, directory)
+        for name in sorted([*dirnames, *filenames]):
+            member_name = os.path.normpath(os.path.join(arcname, relative_root, name))
+            # `makeself.sh` names members relative to `.`, like `./foo.py`
+            yield os.path.join(root, name), os.path.join(".", member_name)
+
+
+def add_tree(
+    tar: tarfile.TarFile,
+    directory: str,
+    arcname: str,
+    include: Callable[[str], bool] | None = None,
+    directories: bool = True,
+    member_filter: Callable[[tarfile.TarInfo], tarfile.TarInfo] | None = None,
+) -> None:
+    """
+    Adds everything inside the directory to the tarball, under `arcname`.
+    Symlinks are stored as symlinks, and not followed. Only the files and
+    symlinks that `include` returns true for are added, and directories are
+    left out if `directories` is false. `member_filter` can change the members'
+    details before they are added.
+    """
+    for path, member_name in tree_members(directory, arcname):
+        if os.path.isdir(path) and not os.path.islink(path):
+            if not directories:
+                continue
+        elif include is not None and not include(member_name):
+            continue
+
+        tar.add(path, member_name, recursive=False, filter=member_filter)
+
+
+def split_members(
+    members: list[tuple[str, str]], chunks: int
+) -> list[list[tuple[str, str]]]:
+    """
+    Splits the members, pairs of a path and its name in the tarball, into at
+    most `chunks` chunks of about the same size, that can be extracted in
+    parallel. Folders go into the first chunk, and hardlinks to the same file
+    into the same one, so that it's only stored once. Members keep their order
+    within each chunk.
+    """
+    folders = []
+    groups: dict[object, list[int]] = {}
+    sizes: dict[object, int] = {}
+    for index, (path, _) in enumerate(members):
+        path_stat = os.lstat(path)
+        if stat.S_ISDIR(path_stat.st_mode):
+            folders.append(index)
+            continue
+
+        key: object = index
+        if path_stat.st_nlink > 1:
+            key = (path_stat.st_dev, path_stat.st_ino)
+        groups.setdefault(key, []).append(index)
+        sizes[key] = sizes.get(key, 0) + TAR_HEADER_SIZE
+        if len(groups[key]) == 1:
+            sizes[key] += path_stat.st_size
+
+    chunks = max(1, min(chunks, sum(sizes.values()) // MIN_PAYLOAD_CHUNK_SIZE))
+    chunk_indices: list[list[int]] = [folders, *([] for _ in range(chunks - 1))]
+    # The largest files go first, each into the smallest chunk so far
+    chunk_sizes = [(0, chunk) for chunk in range(chunks)]
+    for key in sorted(groups, key=sizes.__getitem__, reverse=True):
+        size, chunk = heapq.heappop(chunk_sizes)
+        chunk_indices[chunk] += groups[key]
+        heapq.heappush(chunk_sizes, (size + sizes[key], chunk))
+
+    return [[members[index] for index in sorted(indices)] for indices in chunk_indices]
+
+
+def compress_stream(
+    output: BinaryIO,
+    write_uncompressed: Callable[[IO[bytes]], None],
+    command: list[str],
+    checksum: str,
+    log: BuildLog | None = None,
+) -> Payload:
+    """
+    Streams whatever `write_uncompressed` writes through the compressor, and
+    the compressed data through the checksum into the output. The compressor's
+    messages go into the log.
+    """
+    if log is None:
+        log = BuildLog()
+    log.clear()
+    md5 = hashlib.md5() if checksum == "md5" else None
+    sha256 = hashlib.sha256() if checksum == "sha256" else None
+    cksum = None
+    if checksum == "crc":
+        cksum = subprocess.Popen(
+            ["cksum"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    compressor = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert compressor.stdin is not None and compressor.stdout is not None
+    compressed = compressor.stdout
+    compressed_size = 0
+    errors: list[BaseException] = []
+
+    def write_compressed() -> None:
+        nonlocal compressed_size
+        try:
+            for chunk in iter(lambda: compressed.read(CHUNK_SIZE), b""):
+                output.write(chunk)
+                compressed_size += len(chunk)
+                if md5 is not None:
+                    md5.update(chunk)
+                if sha256 is not None:
+                    sha256.update(chunk)
+                if cksum is not None:
+                    assert cksum.stdin is not None
+                    cksum.stdin.write(chunk)
+        except BaseException as exc:
+            errors.append(exc)
+
+    # The compressed data is read in a separate thread, so that the compressor
+    # doesn't block on a full pipe while the uncompressed data is written to it
+    writer_thread = threading.Thread(target=write_compressed)
+    writer_thread.start()
+    assert compressor.stderr is not None
+    stderr_thread = threading.Thread(
+        target=pipe_lines, args=(compressor.stderr, log, "stderr")
+    )
+    stderr_thread.start()
+
+    uncompressed = _CountingWriter(compressor.stdin)
+    cksum_output = b""
+    with contextlib.ExitStack() as tracked:
+        tracked.enter_context(log.cancel_token.track(compressor))
+        if cksum is not None:
+            tracked.enter_context(log.cancel_token.track(cksum))
+        try:
+            write_uncompressed(uncompressed)  # type: ignore[arg-type]
+        finally:
+            try:
+                compressor.stdin.close()
+            except BrokenPipeError:
+                # The compressor was killed, or failed
+                pass
+            writer_thread.join()
+            stderr_thread.join()
+            compressor.wait()
+            if cksum is not None:
+                cksum_output, _ = cksum.communicate()
+
+    log.cancel_token.check()
+    if errors:
+        raise errors[0]
+    if compressor.returncode != 0:
+        raise subprocess.CalledProcessError(
+            compressor.returncode, command, stderr=log.tail("stderr")
+        )
+
+    payload = Payload(compressed_size, uncompressed.size)
+    if md5 is not None:
+        payload.md5 = md5.hexdigest()
+    if sha256 is not None:
+        payload.sha256 = sha256.hexdigest()
+    if cksum is not None:
+        if cksum.returncode != 0:
+            raise subprocess.CalledProcessError(cksum.returncode, ["cksum"])
+        payload.crc = cksum_output.split()[0].decode()
+
+    return payload
+
+
+def write_payload(
+    output: BinaryIO,
+    roots: list[tuple[str, str]],
+    command: list[str],
+    checksum: str,
+    include: Callable[[str], bool] | None = None,
+    log: BuildLog | None = None,
+    order: Sequence[str] | None = None,
+) -> Payload:
+    """
+    Streams a tarball of the roots through the compressor into the output.
+    `roots` are pairs of a directory and the path it is stored at in the
+    tarball, where "." is the top level. Only the files that `include` returns
+    true for are added to it.
+
+    With an `order`, only the files named in it are added, in that order, and
+    without the folders they're in.
+    """
+    if order is not None:
+        paths = {
+            member_name: path
+            for directory, arcname in roots
+            for path, member_name in tree_members(directory, arcname)
+            if not os.path.isdir(path) or os.path.islink(path)
+        }
+        members = [
+            (paths[member_name], member_name)
+            for member_name in dict.fromkeys(order)
+            if member_name in paths and (include is None or include(member_name))
+        ]
+        return write_members(output, members, command, checksum, log)
+
+    def write_tarball(file: IO[bytes]) -> None:
+        with tarfile.open(
+            fileobj=file,
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+        ) as tar:
+            for directory, arcname in roots:
+                add_tree(tar, directory, arcname, include)
+
+    return compress_stream(output, write_tarball, command, checksum, log)
+
+
+def write_members(
+    output: BinaryIO,
+    members: list[tuple[str, str]],
+    command: list[str],
+    checksum: str,
+    log: BuildLog | None = None,
+) -> Payload:
+    """
+    Streams a tarball of the members, pairs of a path and its name in the
+    tarball, through the compressor into the output, in the given order.
+    """
+
+    def write_tarball(file: IO[bytes]) -> None:
+        with tarfile.open(
+            fileobj=file,
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+        ) as tar:
+            for path, member_name in members:
+                tar.add(path, member_name, recursive=False)
+
+    return compress_stream(output, write_tarball, command, checksum, log)
+
+
+def _reproducible(member: tarfile.TarInfo) -> tarfile.TarInfo:
+    """
+    Leaves out the details of a member that differ between builds of the same
+    files: its owner, and for symlinks, which are made anew by every build,
+    their modification time.
+    """
+    member.uid = member.gid = 0
+    member.uname = member.gname = ""
+    if member.issym():
+        member.mtime = 0
+    return member
+
+
+def write_runtime_layer(
+    output: BinaryIO,
+    roots: list[tuple[str, str]],
+    command: list[str],
+    checksum: str,
+    include: Callable[[str], bool],
+    log: BuildLog | None = None,
+) -> Payload:
+    """
+    Streams a tarball of the files in the roots that `include` returns true for
+    through the compressor into the output, and hashes its contents. Folders
+    and other details that differ between builds are left out, so that the same
+    files always make the same tarball, and packages with the same runtime
+    share it.
+    """
+    content_hash = None
+
+    def write_tarball(file: IO[bytes]) -> None:
+        nonlocal content_hash
+        hashing_file = _HashingWriter(file)
+        with tarfile.open(  # type: ignore[call-overload]
+            fileobj=hashing_file,
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+        ) as tar:
+            for directory, arcname in roots:
+                add_tree(
+                    tar,
+                    directory,
+                    arcname,
+                    include,
+                    directories=False,
+                    member_filter=_reproducible,
+                )
+
+        content_hash = hashing_file.hash.hexdigest()
+
+    payload = compress_stream(output, write_tarball, command, checksum, log)
+    payload.content_hash = content_hash
+    return payload
+
+
+def write_package(
+    output_path: str,
+    roots: list[tuple[str, str]],
+    makeself_options: list[str],
+    label: str,
+    startup_script: str,
+    compression: str,
+    compression_level: int | None,
+    compression_threads: int | None,
+    checksum: str,
+    runtime_layer: Callable[[str], bool] | None = None,
+    cached_runtime_layer: tuple[str, Payload] | None = None,
+    shared_runtime: bool = True,
+    hot_files: Sequence[str] | None = None,
+    chunks: int = 1,
+    log: BuildLog | None = None,
+) -> Payload:
+    """
+    Writes the self-extracting package, in the same format as `makeself.sh`.
+    The payload is streamed straight from the roots into the output file, and
+    the header in front of it is filled in once its size and checksum are known.
+    The first root is the directory the package is named after.
+
+    The files that `runtime_layer` returns true for (given their names in the
+    tarball) are written into a separate archive before the rest, which the
+    package extracts once into a store shared by every package with the same
+    runtime. Without `shared_runtime`, it's extracted along with the rest
+    instead. With a `cached_runtime_layer`, the path of a file with that archive
+    from an earlier build and its payload, it's copied from the file instead.
+
+    `hot_files` are the names of the files that the package uses first, in the
+    order it uses them. The ones that aren't in the runtime layer are written
+    into an archive of their own in that order, ahead of the rest of the
+    payload, which the package extracts in the background while the startup
+    script runs.
+
+    With more than one of `chunks`, the rest of the payload is split into
+    that many archives of about the same size, that the package extracts in
+    parallel. Small payloads are split into fewer chunks, or none.
+
+    The compressor's messages are written into the `log`. Raises
+    `FileExistsError` if there's a file at the output path already, and
+    `ValueError` for fewer than one chunk.
+    """
+    if chunks < 1:
+        raise ValueError(f"Expected at least one chunk, got {chunks}")
+    if compression_level is None:
+        compression_level = DEFAULT_COMPRESSION_LEVEL
+
+    header_arguments = (
+        # Rendering both headers with the same date keeps them the same length
+        [*makeself_options, "--packaging-date", time.strftime("%a %b %e %T %Z %Y")],
+        roots[0][0],
+        label,
+        startup_script,
+    )
+    hot_layer: set[str] = set()
+    if hot_files is not None:
+        hot_layer = {
+            name
+            for name in hot_files
+            if runtime_layer is None or not runtime_layer(name)
+        }
+
+    def include(name: str) -> bool:
+        if runtime_layer is not None and runtime_layer(name):
+            return False
+        return name not in hot_layer
+
+    payload_chunks = None
+    if chunks > 1:
+        members = [
+            (path, member_name)
+            for directory, arcname in roots
+            for path, member_name in tree_members(directory, arcname)
+            if os.path.isdir(path) and not os.path.islink(path) or include(member_name)
+        ]
+        payload_chunks = split_members(members, chunks)
+        if len(payload_chunks) == 1:
+            payload_chunks = None
+
+    placeholder_header = render_header(
+        *header_arguments,
+        payload=None,
+        runtime_layer=runtime_layer is not None,
+        hot_layer=hot_files is not None,
+        chunks=1 if payload_chunks is None else len(payload_chunks),
+        shared_runtime=shared_runtime,
+    )
+    command = compress_command(compression, compression_level, compression_threads)
+
+    # Opened exclusively, so that builds of the same output at the same time
+    # can't both write into it
+    output = open(output_path, "xb")
+    try:
+        with output:
+            output.write(placeholder_header)
+            runtime_payload = None
+            if runtime_layer is not None:
+                if cached_runtime_layer is not None:
+                    layer_path, runtime_payload = cached_runtime_layer
+                    with open(layer_path, "rb") as layer_file:
+                        shutil.copyfileobj(layer_file, output, CHUNK_SIZE)
+                else:
+                    runtime_payload = write_runtime_layer(
+                        output, roots, command, checksum, runtime_layer, log
+                    )
+
+            hot_payload = None
+            if hot_files is not None:
+                hot_payload = write_payload(
+                    output,
+                    roots,
+                    command,
+                    checksum,
+                    include=hot_layer.__contains__,
+                    log=log,
+                    order=hot_files,
+                )
+
+            if payload_chunks is None:
+                payload = write_payload(
+                    output, roots, command, checksum, include=include, log=log
+                )
+            else:
+                chunk_payloads = [
+                    write_members(output, chunk, command, checksum, log)
+                    for chunk in payload_chunks
+                ]
+                payload = Payload(
+                    size=sum(chunk.size for chunk in chunk_payloads),
+                    uncompressed_size=sum(
+                        chunk.uncompressed_size for chunk in chunk_payloads
+                    ),
+                    chunks=chunk_payloads,
+                )
+            payload.runtime_layer = runtime_payload
+            payload.hot_layer = hot_payload
+
+            header = render_header(
+                *header_arguments, payload=payload, shared_runtime=shared_runtime
+            )
+            padding = len(placeholder_header) - len(header)
+            assert padding >= 0
+            # The header is read line by line, so trailing spaces are ignored
+            output.seek(0)
+            output.write(header[:-1] + b" " * padding + b"\n")
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    os.chmod(output_path, 0o755)
+    return payload
@@ -0,0 +1,428 @@
+"""
+Cache for the packaged Python and the rest of the package directory, as they
+are after running the build command, and for the compressed layer of the
+packaged Python in incremental packages.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import platform
+import shutil
+import stat
+import sys
+import tempfile
+from typing import Any, Collection, Iterator
+
+from packaged.staging import is_unmodified_by_builds, populate_tree
+
+if sys.platform != "win32":
+    import fcntl
+
+BUILD_CACHE_PATH = os.path.abspath(
+    os.getenv(
+        "PACKAGED_BUILD_CACHE_DIR",
+        os.path.join(
+            os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "packaged",
+            "builds",
+        ),
+    )
+)
+DEFAULT_BUILD_CACHE_SIZE = 5 * 1024  # In megabytes
+
+# Files in the source directory that define what the build command installs
+DEPENDENCY_FILE_PATTERNS = [
+    "requirements*.txt",
+    "pyproject.toml",
+    "setup.cfg",
+    "setup.py",
+]
+METADATA_FILE_NAME = "metadata.json"
+PYTHON_FOLDER_NAME = "python"
+# What the build command added or changed in the rest of the package directory
+PACKAGE_FOLDER_NAME = "package"
+LAYER_FILE_NAME = "layer"
+
+
+def hash_file(file_path: str) -> str:
+    """Returns the sha256 hash of a file's contents."""
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def build_cache_key(
+    python_version: str,
+    build_command: str,
+    source_directory: str,
+) -> str:
+    """
+    Returns the key for a build, made from the Python version, the build command,
+    the dependency files in the source directory, and the current platform.
+    """
+    dependency_files = {}
+    for pattern in DEPENDENCY_FILE_PATTERNS:
+        for file_path in glob.glob(os.path.join(source_directory, pattern)):
+            file_name = os.path.relpath(file_path, source_directory)
+            dependency_files[file_name] = hash_file(file_path)
+
+    key_data = {
+        "python_version": python_version,
+        "build_command": build_command,
+        "dependency_files": dependency_files,
+        "platform": [platform.system(), platform.machine()],
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def hash_tree(directory: str, exclude: Collection[str] = ()) -> str:
+    """
+    Returns the sha256 hash of the paths and contents of everything in the
+    directory tree, other than the `exclude` paths. Symlinks are hashed by
+    where they point to.
+    """
+    directory = os.path.abspath(directory)
+    exclude = {os.path.abspath(path) for path in exclude}
+    entries = []
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [
+            name for name in dirnames if os.path.join(root, name) not in exclude
+        ]
+        for name in [*dirnames, *filenames]:
+            path = os.path.join(root, name)
+            if path in exclude:
+                continue
+
+            relative_path = os.path.relpath(path, directory)
+            if os.path.islink(path):
+                entries.append([relative_path, "symlink", os.readlink(path)])
+            elif os.path.isfile(path):
+                entries.append([relative_path, "file", hash_file(path)])
+
+    return hashlib.sha256(json.dumps(sorted(entries)).encode()).hexdigest()
+
+
+def layer_cache_key(build_key: str, source_hash: str, options: dict[str, Any]) -> str:
+    """
+    Returns the key for the compressed layer of the packaged Python, made from
+    the key of the build, the hash of the source tree, as the build command can
+    install the app itself into the packaged Python, and the options that
+    change what's in the layer or how it's compressed.
+    """
+    key_data = {"build": build_key, "sources": source_hash, "options": options}
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def snapshot_package(
+    package_directory: str, exclude: str
+) -> dict[str, tuple[int, int, int]]:
+    """
+    Returns the type, modification time and size of everything in the package
+    directory other than the `exclude` folder at its top level, keyed by their
+    paths relative to it. Only the type of folders is kept, as their times
+    change along with the files in them.
+    """
+    entries = {}
+    for root, dirnames, filenames in os.walk(package_directory):
+        if root == package_directory and exclude in dirnames:
+            dirnames.remove(exclude)
+        for name in [*dirnames, *filenames]:
+            path = os.path.join(root, name)
+            path_stat = os.lstat(path)
+            mode = stat.S_IFMT(path_stat.st_mode)
+            entries[os.path.relpath(path, package_directory)] = (
+                (mode, 0, 0)
+                if stat.S_ISDIR(mode)
+                else (mode, path_stat.st_mtime_ns, path_stat.st_size)
+            )
+
+    return entries
+
+
+def package_changes(
+    before: dict[str, tuple[int, int, int]], after: dict[str, tuple[int, int, int]]
+) -> tuple[list[str], list[str]]:
+    """
+    Returns the paths that were added or changed between the snapshots of the
+    package directory, and the ones that were removed.
+    """
+    changed = sorted(path for path in after if before.get(path) != after[path])
+    removed = sorted(path for path in before if path not in after)
+    return changed, removed
+
+
+def _entry_path(key: str, cache_path: str | None = None) -> str:
+    return os.path.join(cache_path or BUILD_CACHE_PATH, key)
+
+
+def _tree_size(directory: str) -> int:
+    """
+    Returns the size of the files in the directory, counting hardlinked files
+    only once, as they share their contents.
+    """
+    total_size = 0
+    seen: set[tuple[int, int]] = set()
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            file_stat = os.lstat(os.path.join(root, filename))
+            if stat.S_ISLNK(file_stat.st_mode):
+                continue
+            if file_stat.st_nlink > 1:
+                if (file_stat.st_dev, file_stat.st_ino) in seen:
+                    continue
+                seen.add((file_stat.st_dev, file_stat.st_ino))
+            total_size += file_stat.st_size
+
+    return total_size
+
+
+@contextlib.contextmanager
+def build_lock(key: str, cache_path: str | None = None) -> Iterator[None]:
+    """
+    Holds a lock on the build with the given key, so that builds with the same
+    key run one at a time: the first one builds and stores it, and the rest
+    wait for it and restore it from the cache instead.
+    Works across threads as well as processes, as each call opens the file anew.
+    """
+    cache_path = cache_path or BUILD_CACHE_PATH
+    os.makedirs(cache_path, exist_ok=True)
+    with open(os.path.join(cache_path, f".{key}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def restore_build(
+    key: str,
+    packaged_python_path: str,
+    package_directory: str | None = None,
+    cache_path: str | None = None,
+) -> bool:
+    """
+    Copies the cached build into `packaged_python_path`, if it exists, and
+    makes the changes that the build command made to the rest of the package
+    into `package_directory`. Returns true if it did.
+    Builds are looked up in `cache_path` rather than the user's build cache, if
+    it's given, and likewise for the rest of the functions for builds.
+    """
+    entry_path = _entry_path(key, cache_path)
+    metadata_path = os.path.join(entry_path, METADATA_FILE_NAME)
+    # The metadata file is written last, so it marks the entry as complete
+    if not os.path.isfile(metadata_path):
+        return False
+
+    populate_tree(
+        os.path.join(entry_path, PYTHON_FOLDER_NAME),
+        packaged_python_path,
+        can_hardlink=is_unmodified_by_builds,
+    )
+    if package_directory is not None:
+        with open(metadata_path) as file:
+            removed = json.load(file).get("removed", [])
+        for relative_path in removed:
+            _remove(os.path.join(package_directory, relative_path))
+        _copy_files(
+            os.path.join(entry_path, PACKAGE_FOLDER_NAME),
+            package_directory,
+            _relative_paths(os.path.join(entry_path, PACKAGE_FOLDER_NAME)),
+        )
+
+    # Mark the entry as recently used, for eviction
+    os.utime(metadata_path)
+    return True
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _relative_paths(directory: str) -> list[str]:
+    """Returns the paths of everything in the directory, relative to it."""
+    paths = []
+    for root, dirnames, filenames in os.walk(directory):
+        for name in [*dirnames, *filenames]:
+            paths.append(os.path.relpath(os.path.join(root, name), directory))
+
+    return paths
+
+
+def _copy_files(source: str, destination: str, relative_paths: list[str]) -> None:
+    """
+    Copies the paths from the source directory into the destination, replacing
+    what's there. Symlinks are copied as symlinks.
+    """
+    for relative_path in sorted(relative_paths):
+        source_path = os.path.join(source, relative_path)
+        destination_path = os.path.join(destination, relative_path)
+        if os.path.isdir(source_path) and not os.path.islink(source_path):
+            if os.path.lexists(destination_path) and not os.path.isdir(
+                destination_path
+            ):
+                os.unlink(destination_path)
+            os.makedirs(destination_path, exist_ok=True)
+            continue
+
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        _remove(destination_path)
+        if os.path.islink(source_path):
+            os.symlink(os.readlink(source_path), destination_path)
+        else:
+            shutil.copy2(source_path, destination_path)
+
+
+def save_build(
+    key: str,
+    packaged_python_path: str,
+    max_size: int = DEFAULT_BUILD_CACHE_SIZE,
+    package_directory: str | None = None,
+    changed: Collection[str] = (),
+    removed: Collection[str] = (),
+    cache_path: str | None = None,
+) -> None:
+    """
+    Stores the built `packaged_python_path` in the cache, along with the paths
+    in `package_directory` that the build command `changed` and `removed`
+    outside of it, as `package_changes()` returns them. Evicts the least
+    recently used builds if the cache grows over `max_size` megabytes.
+    """
+    cache_path = cache_path or BUILD_CACHE_PATH
+    os.makedirs(cache_path, exist_ok=True)
+    temp_entry_path = tempfile.mkdtemp(prefix=".tmp-", dir=cache_path)
+    try:
+        populate_tree(
+            packaged_python_path,
+            os.path.join(temp_entry_path, PYTHON_FOLDER_NAME),
+            can_hardlink=is_unmodified_by_builds,
+        )
+        package_path = os.path.join(temp_entry_path, PACKAGE_FOLDER_NAME)
+        os.mkdir(package_path)
+        if package_directory is not None:
+            _copy_files(package_directory, package_path, list(changed))
+        metadata = {"size": _tree_size(temp_entry_path), "removed": list(removed)}
+        with open(os.path.join(temp_entry_path, METADATA_FILE_NAME), "w") as file:
+            json.dump(metadata, file)
+
+        os.rename(temp_entry_path, _entry_path(key, cache_path))
+    except OSError:
+        # Another build with the same key was stored first
+        if not os.path.isdir(_entry_path(key, cache_path)):
+            raise
+    finally:
+        if os.path.exists(temp_entry_path):
+            shutil.rmtree(temp_entry_path)
+
+    evict_builds(max_size, cache_path)
+
+
+def restore_layer(
+    key: str, cache_path: str | None = None
+) -> tuple[str, dict[str, Any]] | None:
+    """
+    Returns the path of the cached layer with the given key, and the details
+    it was saved with, if it exists. Like builds, layers are looked up in
+    `cache_path` if it's given.
+    """
+    entry_path = _entry_path(key, cache_path)
+    metadata_path = os.path.join(entry_path, METADATA_FILE_NAME)
+    if not os.path.isfile(metadata_path):
+        return None
+
+    with open(metadata_path) as file:
+        metadata: dict[str, Any] = json.load(file)
+    os.utime(metadata_path)
+    return os.path.join(entry_path, LAYER_FILE_NAME), metadata["details"]
+
+
+def save_layer(
+    key: str,
+    package_path: str,
+    offset: int,
+    size: int,
+    details: dict[str, Any],
+    max_size: int = DEFAULT_BUILD_CACHE_SIZE,
+    cache_path: str | None = None,
+) -> None:
+    """
+    Stores the `size` bytes at `offset` in the package, which is where its
+    layer of the packaged Python is, in the cache along with its details. Like
+    builds, the least recently used layers are evicted once the cache grows
+    over `max_size` megabytes, and they're stored in `cache_path` if it's given.
+    """
+    cache_path = cache_path or BUILD_CACHE_PATH
+    os.makedirs(cache_path, exist_ok=True)
+    temp_entry_path = tempfile.mkdtemp(prefix=".tmp-", dir=cache_path)
+    try:
+        with open(package_path, "rb") as package, open(
+            os.path.join(temp_entry_path, LAYER_FILE_NAME), "wb"
+        ) as layer_file:
+            package.seek(offset)
+            remaining = size
+            while remaining:
+                chunk = package.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise EOFError(package_path)
+                layer_file.write(chunk)
+                remaining -= len(chunk)
+
+        metadata = {"size": size, "details": details}
+        with open(os.path.join(temp_entry_path, METADATA_FILE_NAME), "w") as file:
+            json.dump(metadata, file)
+
+        os.rename(temp_entry_path, _entry_path(key, cache_path))
+    except OSError:
+        # Another build with the same key was stored first
+        if not os.path.isdir(_entry_path(key, cache_path)):
+            raise
+    finally:
+        if os.path.exists(temp_entry_path):
+            shutil.rmtree(temp_entry_path)
+
+    evict_builds(max_size, cache_path)
+
+
+def evict_builds(
+    max_size: int = DEFAULT_BUILD_CACHE_SIZE, cache_path: str | None = None
+) -> None:
+    """Deletes least recently used builds, until the cache fits `max_size` MB."""
+    cache_path = cache_path or BUILD_CACHE_PATH
+    if not os.path.isdir(cache_path):
+        return
+
+    entries = []
+    for key in os.listdir(cache_path):
+        metadata_path = os.path.join(_entry_path(key, cache_path), METADATA_FILE_NAME)
+        if not os.path.isfile(metadata_path):
+            continue
+
+        with open(metadata_path) as file:
+            size = json.load(file)["size"]
+        entries.append((os.path.getmtime(metadata_path), size, key))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total_size <= max_size * 1024 * 1024:
+            break
+
+        invalidate_build(key, cache_path)
+        total_size -= size
+
+
+def invalidate_build(key: str | None = None, cache_path: str | None = None) -> None:
+    """Deletes the cached build with the given key, or the whole cache."""
+    if key is None:
+        shutil.rmtree(cache_path or BUILD_CACHE_PATH, ignore_errors=True)
+    else:
+        shutil.rmtree(_entry_path(key, cache_path), ignore_errors=True)
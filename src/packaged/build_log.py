@@ -0,0 +1,297 @@
+"""Streaming the output of the build's commands, and its progress as events."""
+
+from __future__ import annotations
+
+from collections import deque
+import contextlib
+from dataclasses import dataclass
+import os
+import re
+import signal
+import subprocess
+import threading
+from typing import IO, Any, Callable, Iterator
+
+# Size in bytes that the log file grows to before it's rotated, and the number
+# of rotated files that are kept, as `build.log.1`, `build.log.2` and so on
+DEFAULT_LOG_SIZE = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 2
+# Lines of each stream kept in memory, which are shown if a command fails
+TAIL_LINES = 200
+# Longer lines are split, so that a command without newlines in its output
+# can't fill up memory either
+MAX_LINE_LENGTH = 64 * 1024
+# Seconds that commands which time out get to exit, before they're killed
+TERMINATE_GRACE_PERIOD = 5
+
+# pip's output when installing packages, and the kind of event each line is
+PIP_PROGRESS_PATTERNS = (
+    ("collecting", re.compile(r"^Collecting (?P<package>[^\s<>=!~;\[]+)")),
+    ("processing", re.compile(r"^Processing (?P<package>\S+?)(?:-\d\S*)?(?:\s|$)")),
+    ("downloading", re.compile(r"^\s*Downloading (?P<package>\S+?)(?:-\d\S*)? ")),
+    ("building", re.compile(r"^\s*Building wheel for (?P<package>\S+)")),
+    ("installing", re.compile(r"^Installing collected packages: (?P<packages>.+)")),
+    ("installed", re.compile(r"^Successfully installed (?P<packages>.+)")),
+)
+
+
+@dataclass
+class ProgressEvent:
+    """
+    Something that happened during the build. `kind` is one of:
+
+    - "phase": the build moved on to its next phase, like pruning
+    - "message": a message about the build, like how much was pruned
+    - "output": a line of output from a command, on its `stream`
+    - "collecting", "processing", "downloading", "building", "installing" and
+      "installed": the progress of installing a `package`, as pip reports it
+    """
+
+    kind: str
+    message: str
+    package: str | None = None
+    stream: str | None = None
+
+
+def progress_events(line: str) -> list[ProgressEvent]:
+    """Returns the package progress in a line of pip's output, if any."""
+    for kind, pattern in PIP_PROGRESS_PATTERNS:
+        match = pattern.match(line)
+        if match is None:
+            continue
+
+        if "packages" not in pattern.groupindex:
+            package = os.path.basename(match["package"])
+            return [ProgressEvent(kind, f"{kind.capitalize()} {package}", package)]
+
+        # One event for each package, named without its version
+        events = []
+        for package in match["packages"].replace(",", " ").split():
+            if kind == "installed":
+                package = package.rsplit("-", 1)[0]
+            events.append(
+                ProgressEvent(kind, f"{kind.capitalize()} {package}", package)
+            )
+        return events
+
+    return []
+
+
+class BuildCancelled(Exception):
+    """Raised when a build stops because it was cancelled."""
+
+
+class CancelToken:
+    """
+    Cancels a build from another thread. The commands that the build is
+    running are killed, along with their child processes, and the build stops
+    instead of starting anything else.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._processes: set[subprocess.Popen[bytes]] = set()
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+
+    def check(self) -> None:
+        """Raises `BuildCancelled` if the build has been cancelled."""
+        if self.cancelled:
+            raise BuildCancelled
+
+    @contextlib.contextmanager
+    def track(self, process: subprocess.Popen[bytes]) -> Iterator[None]:
+        """Kills the process if the build is cancelled while it runs."""
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            _kill(process)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+
+def _kill(
+    process: subprocess.Popen[bytes], signal_number: int = signal.SIGKILL
+) -> None:
+    """Kills the process, and its process group if it leads one."""
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal_number)
+        else:
+            process.send_signal(signal_number)
+    except ProcessLookupError:
+        pass
+
+
+class BuildLog:
+    """
+    Where the output of the build's commands goes. Every line is written to
+    the log file at `path` if there is one, which is rotated once it grows
+    over `max_bytes`, and the last `tail_lines` of each stream are kept in
+    memory. Lines and the progress found in them are passed to `on_event`.
+    The commands are killed if the build is cancelled with `cancel_token`.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        on_event: Callable[[ProgressEvent], None] | None = None,
+        max_bytes: int = DEFAULT_LOG_SIZE,
+        backups: int = DEFAULT_LOG_BACKUPS,
+        tail_lines: int = TAIL_LINES,
+        cancel_token: CancelToken | None = None,
+    ) -> None:
+        self.path = path
+        self.on_event = on_event
+        self.cancel_token = cancel_token if cancel_token is not None else CancelToken()
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.tails: dict[str, deque[str]] = {
+            "stdout": deque(maxlen=tail_lines),
+            "stderr": deque(maxlen=tail_lines),
+        }
+        self._lock = threading.Lock()
+        self._file: IO[str] | None = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def __enter__(self) -> BuildLog:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def emit(self, event: ProgressEvent) -> None:
+        """Passes the event on, if anyone is listening."""
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def write(self, line: str, stream: str = "stdout") -> None:
+        """Adds a line of output, without its line ending, from the stream."""
+        with self._lock:
+            self.tails[stream].append(line)
+            if self._file is not None:
+                self._file.write(line + "\n")
+                if self._file.tell() > self.max_bytes:
+                    self._rotate()
+
+        if self.on_event is not None:
+            self.on_event(ProgressEvent("output", line, stream=stream))
+            for event in progress_events(line):
+                self.on_event(event)
+
+    def tail(self, stream: str) -> bytes:
+        """Returns the last lines of the stream, as a command would've output."""
+        with self._lock:
+            return "".join(line + "\n" for line in self.tails[stream]).encode()
+
+    def clear(self) -> None:
+        """Forgets the lines kept in memory, before running the next command."""
+        with self._lock:
+            for tail in self.tails.values():
+                tail.clear()
+
+    def _rotate(self) -> None:
+        assert self._file is not None and self.path is not None
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "w", encoding="utf-8")
+
+
+def pipe_lines(stream: IO[bytes], log: BuildLog, stream_name: str) -> None:
+    """Writes the lines read from the stream into the log, until it ends."""
+    for line in iter(lambda: stream.readline(MAX_LINE_LENGTH), b""):
+        log.write(line.decode(errors="replace").rstrip("\r\n"), stream_name)
+
+
+def run_command(
+    command: list[str], log: BuildLog, timeout: float | None = None, **kwargs: Any
+) -> None:
+    """
+    Runs the command like `subprocess.run(command, check=True, **kwargs)`,
+    streaming its output into the log line by line. If it fails, the
+    `CalledProcessError` has the last lines of its output.
+
+    The command runs in a process group of its own, which is killed if the
+    build is cancelled or interrupted, so that commands run by a shell stop
+    along with it. After `timeout` seconds, it's terminated, then killed if
+    it's still running after `TERMINATE_GRACE_PERIOD`, and `TimeoutExpired`
+    is raised.
+    """
+    log.cancel_token.check()
+    log.clear()
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+        **kwargs,
+    )
+    assert process.stdout is not None and process.stderr is not None
+    # stderr is read in a thread of its own, so that neither pipe fills up
+    # while the other is being read
+    stderr_thread = threading.Thread(
+        target=pipe_lines, args=(process.stderr, log, "stderr")
+    )
+    timers: list[threading.Timer] = []
+
+    def terminate() -> None:
+        _kill(process, signal.SIGTERM)
+        timers.append(threading.Timer(TERMINATE_GRACE_PERIOD, _kill, (process,)))
+        timers[-1].start()
+
+    if timeout is not None:
+        timers.append(threading.Timer(timeout, terminate))
+        timers[0].start()
+
+    with log.cancel_token.track(process):
+        stderr_thread.start()
+        try:
+            pipe_lines(process.stdout, log, "stdout")
+        except BaseException:
+            _kill(process)
+            raise
+        finally:
+            stderr_thread.join()
+            process.wait()
+            if timers:
+                # Waiting for the first one, in case it's terminating it
+                timers[0].cancel()
+                timers[0].join()
+            for timer in timers:
+                timer.cancel()
+
+    log.cancel_token.check()
+    if len(timers) > 1:
+        assert timeout is not None
+        raise subprocess.TimeoutExpired(
+            command, timeout, output=log.tail("stdout"), stderr=log.tail("stderr")
+        )
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode,
+            command,
+            output=log.tail("stdout"),
+            stderr=log.tail("stderr"),
+        )
@@ -3,23 +3,55 @@
 from __future__ import annotations
 
 import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
 import os.path
 import platform
+import subprocess
 import sys
+import tempfile
+import time
 
 from packaged import (
+    CHECKSUM_OPTIONS,
+    DEFAULT_CHECKSUM,
     DEFAULT_PYTHON_VERSION,
     OutputPathExists,
     PythonNotAvailable,
     SourceDirectoryNotFound,
     create_package,
 )
+from packaged.build_cache import DEFAULT_BUILD_CACHE_SIZE, invalidate_build
+from packaged.build_log import DEFAULT_LOG_BACKUPS
+from packaged.compression import (
+    COMPRESSION_GOALS,
+    COMPRESSORS,
+    DEFAULT_COMPRESSION,
+    DEFAULT_COMPRESSION_GOAL,
+    CompressorNotAvailable,
+)
 from packaged.config import (
     Config,
     ConfigValidationError,
+    DuplicateOutputPath,
     config_file_exists,
-    parse_config,
+    parse_targets,
+    validate_config,
+)
+from packaged.delta import (
+    LayeredPackage,
+    PackageNotReproducible,
+    PatchDoesNotApply,
+    PatchOutputMismatch,
+    apply_patch,
+    diff_packages,
 )
+from packaged.prune import PRUNE_PROFILES, PruneProfileNotFound
+from packaged.strip import StripNotAvailable
+from packaged.trace import Tracer
+from packaged.utils import format_size
+from packaged.watch import watch
 
 
 def error(message: str) -> None:
@@ -27,6 +59,286 @@ def error(message: str) -> None:
     print(f"\033[1;31mError:\033[m {message}", file=sys.stderr)
 
 
+def write_trace(tracer: Tracer, trace_path: str) -> None:
+    """Writes the trace to the file, and prints a summary of it."""
+    tracer.write(trace_path)
+    print(tracer.summary(), file=sys.stderr)
+    print(f"Wrote the build trace to {trace_path!r}.", file=sys.stderr)
+
+
+def build_package(
+    config: Config,
+    tracer: Tracer | None = None,
+    build_cache_path: str | None = None,
+) -> int:
+    """
+    Builds the package for the config, returning the exit code.
+    The phases of the build are recorded into the tracer, if one is given, and
+    builds are cached in `build_cache_path` instead of the user's build cache.
+    """
+    try:
+        create_package(
+            config.source_directory,
+            config.output_path,
+            config.build_command,
+            config.startup_command,
+            config.python_version,
+            config.quiet,
+            config.pyc,
+            config.ignore_file_patterns,
+            launch_cache=config.launch_cache,
+            compression=config.compression,
+            compression_level=config.compression_level,
+            compression_threads=config.compression_threads,
+            compression_goal=config.compression_goal,
+            checksum=config.checksum,
+            build_cache=config.build_cache,
+            rebuild=config.rebuild,
+            build_cache_size=config.build_cache_size,
+            build_cache_path=build_cache_path,
+            prune=config.prune,
+            prune_include=config.prune_include,
+            prune_exclude=config.prune_exclude,
+            prune_unused=config.prune_unused,
+            prune_unused_commands=config.prune_unused_commands,
+            prune_manifest=config.prune_manifest,
+            payload_order=config.payload_order,
+            payload_order_commands=config.payload_order_commands,
+            payload_chunks=config.payload_chunks,
+            bytecode=config.bytecode,
+            bytecode_optimization=config.bytecode_optimization,
+            bytecode_keep_sources=config.bytecode_keep_sources,
+            zip_stdlib=config.zip_stdlib,
+            zip_site_packages=config.zip_site_packages,
+            trace=tracer,
+            shared_runtime=config.shared_runtime,
+            shared_site_packages=config.shared_site_packages,
+            dedupe=config.dedupe,
+            strip=config.strip,
+            wheelhouse=config.wheelhouse,
+            incremental=config.incremental or config.watch,
+            build_log=config.build_log,
+        )
+    except SourceDirectoryNotFound as exc:
+        error(f"Folder {exc.directory_path!r} does not exist.")
+        return 4
+    except PythonNotAvailable as exc:
+        error(f"Python {exc.python_version!r} is not available for download.")
+        return 5
+    except OutputPathExists:
+        err_msg = f"output path {config.output_path!r} already exists"
+        if config.output_path == ".":
+            err_msg += "\nConsider giving a filename, like './myapp.bin'"
+        error(err_msg)
+        return 6
+    except CompressorNotAvailable as exc:
+        if exc.compression == "auto":
+            error("None of the supported compressors are installed.")
+        else:
+            error(f"Compressor {exc.compression!r} is not installed.")
+        return 7
+    except PruneProfileNotFound as exc:
+        error(
+            f"Unknown pruning profile {exc.profile!r},"
+            f" expected one of: {', '.join(PRUNE_PROFILES)}"
+        )
+        return 8
+    except StripNotAvailable:
+        error("Stripping binaries needs `strip` or `objcopy` to be installed.")
+        return 13
+
+    return 0
+
+
+def watch_package(config: Config, tracer: Tracer | None = None) -> int:
+    """
+    Builds the package incrementally, and builds it again whenever the files in
+    the source directory change, until interrupted. The package is replaced by
+    every build.
+    """
+    if config.source_directory is None:
+        error("Watching for changes needs a source directory.")
+        return 4
+
+    configs = [config]
+
+    def rebuild() -> None:
+        if os.path.exists(config.output_path):
+            os.remove(config.output_path)
+
+        start = time.perf_counter()
+        try:
+            exit_code = build_package(configs[0], tracer)
+        except subprocess.CalledProcessError:
+            # The output of the failed command has been printed already
+            exit_code = 1
+        if exit_code == 0:
+            print(f"Built in {time.perf_counter() - start:.2f}s.", file=sys.stderr)
+        print("Watching for changes...", file=sys.stderr)
+        # Only the first build starts over
+        configs[0] = replace(configs[0], rebuild=False)
+
+    def on_change(changes: list[str]) -> None:
+        print(
+            f"{', '.join(changes[:5])}"
+            + (f" and {len(changes) - 5} more" if len(changes) > 5 else "")
+            + " changed, building again...",
+            file=sys.stderr,
+        )
+
+    exclude = [os.path.abspath(config.output_path)]
+    if config.trace is not None:
+        exclude.append(os.path.abspath(config.trace))
+    if config.build_log is not None:
+        build_log = os.path.abspath(config.build_log)
+        exclude.append(build_log)
+        exclude += [
+            f"{build_log}.{index}" for index in range(1, DEFAULT_LOG_BACKUPS + 1)
+        ]
+    try:
+        watch(config.source_directory, rebuild, exclude, on_change)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def build_targets(configs: list[Config], jobs: int | None = None) -> int:
+    """
+    Builds the packages for all the targets, `jobs` at a time. A target that
+    fails doesn't stop the others from being built.
+    """
+    if jobs is None:
+        jobs = min(len(configs), os.cpu_count() or 1)
+
+    # Targets with the same build share it through a build cache, which lets
+    # only one of them run the build command at a time. Unless the user turned
+    # on their build cache, it's a temporary one that only lasts for this run.
+    build_counts = Counter(_build_key(config) for config in configs)
+    shared = {
+        config.output_path
+        for config in configs
+        if not config.build_cache and build_counts[_build_key(config)] > 1
+    }
+    configs = [
+        replace(
+            config,
+            # The spinners of builds running at the same time would overlap
+            quiet=True,
+            build_cache=config.build_cache or config.output_path in shared,
+            # The temporary cache starts out empty anyway
+            rebuild=config.rebuild and config.output_path not in shared,
+        )
+        for config in configs
+    ]
+
+    # Targets with the same trace file are recorded into the same trace
+    tracers = {config.trace: Tracer() for config in configs if config.trace}
+
+    print(f"Building {len(configs)} targets, {jobs} at a time...")
+    failed = []
+    with tempfile.TemporaryDirectory(
+        prefix="packaged-builds-"
+    ) as run_cache_path, ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                build_package,
+                config,
+                tracers[config.trace] if config.trace else None,
+                run_cache_path if config.output_path in shared else None,
+            ): config
+            for config in configs
+        }
+        for future in as_completed(futures):
+            config = futures[future]
+            try:
+                exit_code = future.result()
+            except Exception as exc:
+                error(f"Failed to build {config.output_path!r}: {exc}")
+                exit_code = 1
+
+            if exit_code == 0:
+                print(f"Package {config.output_path!r} built successfully!")
+            else:
+                failed.append(config.output_path)
+
+    for trace_path, tracer in tracers.items():
+        write_trace(tracer, trace_path)
+
+    if failed:
+        error(
+            f"{len(failed)} of {len(configs)} targets failed:"
+            f" {', '.join(repr(output_path) for output_path in failed)}"
+        )
+        return 1
+
+    return 0
+
+
+def _build_key(config: Config) -> tuple[str, str, str | None]:
+    return config.python_version, config.build_command, config.source_directory
+
+
+def delta_cli(argv: list[str]) -> int:
+    """CLI interface for creating and applying patches between packages."""
+    parser = argparse.ArgumentParser(prog="packaged")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    diff_parser = subparsers.add_parser(
+        "diff", help="Create a patch that turns one package into another"
+    )
+    diff_parser.add_argument("old_path", help="Package the patch is applied to")
+    diff_parser.add_argument("new_path", help="Package the patch rebuilds")
+    diff_parser.add_argument(
+        "-o", "--output", dest="output_path", required=True, help="Patch file"
+    )
+    apply_parser = subparsers.add_parser(
+        "apply", help="Rebuild a package from an older one and a patch"
+    )
+    apply_parser.add_argument("old_path", help="Package the patch was made from")
+    apply_parser.add_argument("patch_path", help="Patch file")
+    apply_parser.add_argument(
+        "-o", "--output", dest="output_path", required=True, help="New package"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "diff":
+            diff_packages(args.old_path, args.new_path, args.output_path)
+            print(
+                f"Wrote {format_size(os.path.getsize(args.output_path))} patch,"
+                f" for a {format_size(os.path.getsize(args.new_path))} package."
+            )
+        else:
+            apply_patch(args.old_path, args.patch_path, args.output_path)
+    except OutputPathExists:
+        error(f"output path {args.output_path!r} already exists")
+        return 6
+    except PackageNotReproducible as exc:
+        error(
+            f"Recompressing {exc.package_path!r} gives a different payload,"
+            " check that it was built with the compressor installed here."
+        )
+        return 9
+    except PatchDoesNotApply as exc:
+        error(f"The patch was not made for {exc.package_path!r}.")
+        return 10
+    except PatchOutputMismatch:
+        error(
+            "The rebuilt package doesn't match the original,"
+            " check that the same compressor version is installed."
+        )
+        return 11
+    except LayeredPackage as exc:
+        error(
+            f"{exc.package_path!r} is made of several archives, like a shared"
+            " runtime or incremental layer, or an ordered or chunked payload."
+            " Patches can only be made for packages with one."
+        )
+        return 12
+
+    return 0
+
+
 def cli(argv: list[str] | None = None) -> int:
     """CLI interface."""
     # Manually set argv from sys.argv, as we need to check its length to
@@ -38,14 +350,37 @@ def cli(argv: list[str] | None = None) -> int:
         error("Sorry, Windows is not supported yet. Ask for it on GitHub!")
         return 2
 
-    if len(argv) == 1 and config_file_exists(argv[0]):
+    if len(argv) > 1 and argv[0] in ("diff", "apply"):
+        return delta_cli(argv)
+
+    if argv == ["--clear-build-cache"]:
+        invalidate_build()
+        return 0
+
+    # `--watch` can be used with a config file as well
+    config_argv = [argument for argument in argv if argument != "--watch"]
+    if len(config_argv) == 1 and config_file_exists(config_argv[0]):
         # Use values from config file instead
         try:
-            config = parse_config(argv[0])
+            configs, jobs = parse_targets(config_argv[0])
         except ConfigValidationError as exc:
-            error(f"Expected key {exc.key!r} in config")
+            if exc.reason is None:
+                error(f"Expected key {exc.key!r} in config")
+            else:
+                error(f"Invalid value for {exc.key!r} in config, {exc.reason}")
+            return 3
+        except DuplicateOutputPath as exc:
+            error(f"More than one target has the output path {exc.output_path!r}")
             return 3
 
+        if len(configs) > 1:
+            if len(config_argv) < len(argv):
+                error("Only a single target can be watched for changes.")
+                return 3
+            return build_targets(configs, jobs)
+
+        config = replace(configs[0], watch=len(config_argv) < len(argv))
+
     else:
         parser = argparse.ArgumentParser()
         parser.add_argument("output_path", help="Filename for the generated binary")
@@ -86,31 +421,262 @@ def cli(argv: list[str] | None = None) -> int:
             nargs="+",
             default=["setup.py"],
         )
+        parser.add_argument(
+            "--launch-cache",
+            help=(
+                "Extract the package once into a per-user cache directory,"
+                " and run it from there on later launches"
+            ),
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--compression",
+            help="Compressor to use for the package, or 'auto' to pick one",
+            choices=["auto", *COMPRESSORS],
+            default=DEFAULT_COMPRESSION,
+        )
+        parser.add_argument(
+            "--compression-level",
+            help="Compression level to use, defaults to 9",
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            "--compression-threads",
+            help="Number of threads to compress with, 0 to use all cores",
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            "--compression-goal",
+            help="What 'auto' compression should optimize for",
+            choices=COMPRESSION_GOALS,
+            default=DEFAULT_COMPRESSION_GOAL,
+        )
+        parser.add_argument(
+            "--checksum",
+            help="Checksum that the package verifies itself with when it starts",
+            choices=CHECKSUM_OPTIONS,
+            default=DEFAULT_CHECKSUM,
+        )
+        parser.add_argument(
+            "--build-cache",
+            help="Reuse the result of the build command from earlier builds",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--rebuild",
+            help="Discard the cached build, and run the build command again",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--build-cache-size",
+            metavar="MB",
+            help="Maximum size of the build cache, in megabytes",
+            type=int,
+            default=DEFAULT_BUILD_CACHE_SIZE,
+        )
+        parser.add_argument(
+            "--prune",
+            metavar="PROFILE",
+            help=(
+                "Remove files the application doesn't need, using these profiles:"
+                f" {', '.join(PRUNE_PROFILES)}"
+            ),
+            choices=PRUNE_PROFILES,
+            nargs="+",
+            default=None,
+        )
+        parser.add_argument(
+            "--prune-exclude",
+            metavar="PATTERN",
+            help="Remove files matching these patterns, relative to the package",
+            nargs="+",
+            default=None,
+        )
+        parser.add_argument(
+            "--prune-include",
+            metavar="PATTERN",
+            help="Keep files matching these patterns, even if they would be pruned",
+            nargs="+",
+            default=None,
+        )
+        parser.add_argument(
+            "--prune-unused",
+            help=(
+                "Run the app in the package, and remove the modules and files"
+                " of the bundled Python that it didn't use"
+            ),
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--prune-unused-command",
+            metavar="COMMAND",
+            dest="prune_unused_commands",
+            help=(
+                "Run this command to find the files the app uses, instead of"
+                " the startup command (can be given more than once)"
+            ),
+            action="append",
+            default=None,
+        )
+        parser.add_argument(
+            "--prune-manifest",
+            metavar="FILE",
+            help="Write the files that --prune-unused removed and kept to this file",
+            default=None,
+        )
+        parser.add_argument(
+            "--payload-order",
+            help=(
+                "Run the app in the package, and store the files it uses first"
+                " at the start of the package, so that it can start before the"
+                " rest is extracted"
+            ),
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--payload-order-command",
+            metavar="COMMAND",
+            dest="payload_order_commands",
+            help=(
+                "Run this command to find the files the app uses first, instead"
+                " of the startup command (can be given more than once)"
+            ),
+            action="append",
+            default=None,
+        )
+        parser.add_argument(
+            "--payload-chunks",
+            metavar="N",
+            help=(
+                "Split the package into this many separately compressed chunks,"
+                " which are extracted in parallel when it runs"
+            ),
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "--bytecode",
+            help="Compile the bundled standard library and packages ahead of time",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--bytecode-optimization",
+            metavar="LEVEL",
+            help="Optimization levels to compile bytecode at, defaults to 0",
+            type=int,
+            choices=[0, 1, 2],
+            nargs="+",
+            default=None,
+        )
+        parser.add_argument(
+            "--bytecode-drop-sources",
+            dest="bytecode_keep_sources",
+            help="Replace the .py files with the compiled bytecode",
+            action="store_false",
+            default=True,
+        )
+        parser.add_argument(
+            "--zip-stdlib",
+            help="Move the pure Python standard library into a single zip file",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--trace",
+            metavar="FILE",
+            help=(
+                "Write a Chrome trace of the build's phases to the file,"
+                " and print a summary of it"
+            ),
+            default=None,
+        )
+        parser.add_argument(
+            "--zip-site-packages",
+            help="Move pure Python installed packages into the same zip file",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--shared-runtime",
+            help=(
+                "Extract the bundled Python once into a store shared by every"
+                " package with the same Python"
+            ),
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--shared-site-packages",
+            help="Put the installed packages into the shared runtime as well",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--dedupe",
+            help="Store files with the same contents only once, as hardlinks",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--strip",
+            help="Remove debug symbols from the bundled native libraries",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--incremental",
+            help=(
+                "Cache the packaged Python compressed, and only write the rest"
+                " of the package again while it's unchanged"
+            ),
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--build-log",
+            metavar="FILE",
+            help=(
+                "Write the output of the build command into this file, as it"
+                " runs, instead of keeping it in memory"
+            ),
+            default=None,
+        )
+        parser.add_argument(
+            "--watch",
+            help="Build the package incrementally again whenever the source changes",
+            action="store_true",
+            default=False,
+        )
+        parser.add_argument(
+            "--wheelhouse",
+            metavar="FOLDER",
+            help=(
+                "Install packages from the wheels in this folder, downloading"
+                " them into it the first time"
+            ),
+            default=None,
+        )
         args = parser.parse_args(argv)
         config = Config(**vars(args))
+        try:
+            validate_config(config)
+        except ConfigValidationError as exc:
+            assert exc.reason is not None
+            parser.error(f"argument --{exc.key.replace('_', '-')}: {exc.reason}")
 
+    tracer = Tracer() if config.trace is not None else None
     try:
-        create_package(
-            config.source_directory,
-            config.output_path,
-            config.build_command,
-            config.startup_command,
-            config.python_version,
-            config.quiet,
-            config.pyc,
-            config.ignore_file_patterns,
-        )
-    except SourceDirectoryNotFound as exc:
-        error(f"Folder {exc.directory_path!r} does not exist.")
-        return 4
-    except PythonNotAvailable as exc:
-        error(f"Python {exc.python_version!r} is not available for download.")
-        return 5
-    except OutputPathExists:
-        err_msg = f"output path {config.output_path!r} already exists"
-        if config.output_path == ".":
-            err_msg += "\nConsider giving a filename, like './myapp.bin'"
-        error(err_msg)
-        return 6
-
-    return 0
+        if config.watch:
+            return watch_package(config, tracer)
+        return build_package(config, tracer)
+    finally:
+        if tracer is not None and config.trace is not None:
+            write_trace(tracer, config.trace)
@@ -0,0 +1,233 @@
+"""Compression settings for the package payload, and picking one automatically."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+
+# Compressors supported by `makeself.sh`, along with the executable they need.
+COMPRESSORS = {
+    "gzip": "gzip",
+    "pigz": "pigz",
+    "zstd": "zstd",
+    "xz": "xz",
+    "lz4": "lz4",
+    "bzip2": "bzip2",
+}
+# The command each compressor's output is decompressed with, by the package.
+DECOMPRESS_COMMANDS = {
+    "gzip": ["gzip", "-cd"],
+    "pigz": ["gzip", "-cd"],
+    "zstd": ["zstd", "-cd"],
+    "xz": ["xz", "-d"],
+    "lz4": ["lz4", "-d"],
+    "bzip2": ["bzip2", "-d"],
+}
+COMPRESSION_GOALS = ("smallest", "fastest-start", "balanced")
+DEFAULT_COMPRESSION = "gzip"
+DEFAULT_COMPRESSION_GOAL = "balanced"
+
+# Compressor and level pairs that are tried out in `auto` mode
+AUTO_CANDIDATES = [
+    ("gzip", 6),
+    ("gzip", 9),
+    ("zstd", 3),
+    ("zstd", 19),
+    ("xz", 6),
+    ("lz4", 9),
+]
+# Highest level that each compressor accepts through `makeself.sh`
+MAX_LEVELS = {"gzip": 9, "pigz": 9, "zstd": 19, "xz": 9, "lz4": 12, "bzip2": 9}
+# Total size of the files that are test-compressed in `auto` mode
+AUTO_SAMPLE_SIZE = 32 * 1024 * 1024
+# Rough disk read throughput, for counting the size into start up time
+READ_BYTES_PER_SECOND = 200 * 1024 * 1024
+
+
+class CompressorNotAvailable(Exception):
+    """Raised when the compressor asked for is not installed on the system."""
+
+    def __init__(self, compression: str) -> None:
+        super().__init__(compression)
+        self.compression = compression
+
+
+@dataclass
+class CompressionTrial:
+    """Result of test-compressing the sample with one compressor and level."""
+
+    compression: str
+    level: int
+    compressed_size: int
+    compress_time: float
+    decompress_time: float
+
+
+def is_available(compression: str) -> bool:
+    """Returns true if the compressor, and its decompressor, are installed."""
+    return (
+        shutil.which(COMPRESSORS[compression]) is not None
+        and shutil.which(DECOMPRESS_COMMANDS[compression][0]) is not None
+    )
+
+
+def makeself_options(
+    compression: str,
+    level: int | None,
+    threads: int | None,
+) -> list[str]:
+    """Returns the `makeself.sh` flags for the given compression settings."""
+    if not is_available(compression):
+        raise CompressorNotAvailable(compression)
+
+    options = [f"--{compression}"]
+    if level is not None:
+        options += ["--complevel", str(level)]
+    if threads is not None:
+        options += ["--threads", str(threads)]
+
+    return options
+
+
+def compress_command(compression: str, level: int, threads: int | None) -> list[str]:
+    """The command that `makeself.sh` runs to compress with these settings."""
+    command = [COMPRESSORS[compression], "-c", f"-{level}"]
+    if threads is not None:
+        if compression == "pigz":
+            command += ["--processes", str(threads)]
+        elif compression in ("zstd", "xz"):
+            command.append(f"--threads={threads}")
+
+    return command
+
+
+def create_sample(directory: str, sample_size: int = AUTO_SAMPLE_SIZE) -> bytes:
+    """
+    Creates an uncompressed tarball of files spread evenly across the directory,
+    adding up to roughly `sample_size` bytes.
+    """
+    file_paths = []
+    total_size = 0
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            if os.path.isfile(file_path) and not os.path.islink(file_path):
+                file_paths.append(file_path)
+                total_size += os.path.getsize(file_path)
+
+    # Take every n-th file, so that the sample looks like the whole tree
+    stride = max(1, total_size // sample_size)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for file_path in file_paths[::stride]:
+            tar.add(file_path, arcname=os.path.relpath(file_path, directory))
+
+    return buffer.getvalue()
+
+
+def run_trial(
+    sample: bytes,
+    compression: str,
+    level: int,
+    threads: int | None,
+) -> CompressionTrial:
+    """Compresses and decompresses the sample, timing both."""
+    start = time.perf_counter()
+    compressed = subprocess.run(
+        compress_command(compression, level, threads),
+        input=sample,
+        capture_output=True,
+        check=True,
+    ).stdout
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    subprocess.run(
+        DECOMPRESS_COMMANDS[compression],
+        input=compressed,
+        capture_output=True,
+        check=True,
+    )
+    decompress_time = time.perf_counter() - start
+
+    return CompressionTrial(
+        compression,
+        level,
+        len(compressed),
+        compress_time,
+        decompress_time,
+    )
+
+
+def pick_trial(trials: list[CompressionTrial], goal: str) -> CompressionTrial:
+    """Picks the trial that fits the goal best."""
+    if goal == "smallest":
+        return min(trials, key=lambda t: (t.compressed_size, t.decompress_time))
+
+    if goal == "fastest-start":
+        # Start up time is reading the payload, plus decompressing it
+        return min(
+            trials,
+            key=lambda t: t.decompress_time + t.compressed_size / READ_BYTES_PER_SECOND,
+        )
+
+    # For `balanced`, place each trial between the best and worst one on every
+    # metric, with build time counting for half as much as size and start up.
+    def spread(values: list[float]) -> list[float]:
+        low, high = min(values), max(values)
+        return [(value - low) / (high - low) if high > low else 0 for value in values]
+
+    sizes = spread([t.compressed_size for t in trials])
+    compress_times = spread([t.compress_time for t in trials])
+    decompress_times = spread([t.decompress_time for t in trials])
+    scores = [
+        size + decompress_time + 0.5 * compress_time
+        for size, compress_time, decompress_time in zip(
+            sizes, compress_times, decompress_times
+        )
+    ]
+    return trials[scores.index(min(scores))]
+
+
+def choose_compression(
+    directory: str,
+    goal: str = DEFAULT_COMPRESSION_GOAL,
+    level: int | None = None,
+    threads: int | None = None,
+) -> CompressionTrial:
+    """
+    Test-compresses a sample of the directory with every available compressor,
+    and returns the one that fits the goal best.
+    If `level` is given, it is used for every compressor instead of the presets.
+    """
+    sample = create_sample(directory)
+
+    trials = []
+    tried = set()
+    for compression, preset_level in AUTO_CANDIDATES:
+        # pigz produces gzip streams, and is faster at building them
+        if compression == "gzip" and is_available("pigz"):
+            compression = "pigz"
+        if not is_available(compression):
+            continue
+
+        if level is None:
+            trial_level = preset_level
+        else:
+            trial_level = min(level, MAX_LEVELS[compression])
+        if (compression, trial_level) in tried:
+            continue
+
+        tried.add((compression, trial_level))
+        trials.append(run_trial(sample, compression, trial_level, threads))
+
+    if not trials:
+        raise CompressorNotAvailable("auto")
+
+    return pick_trial(trials, goal)
@@ -3,6 +3,18 @@ from __future__ import annotations
 from dataclasses import dataclass
 import os
 import sys
+from typing import Any
+
+from packaged import CHECKSUM_OPTIONS, DEFAULT_CHECKSUM
+from packaged.build_cache import DEFAULT_BUILD_CACHE_SIZE
+from packaged.compression import (
+    COMPRESSION_GOALS,
+    COMPRESSORS,
+    DEFAULT_COMPRESSION,
+    DEFAULT_COMPRESSION_GOAL,
+    MAX_LEVELS,
+)
+from packaged.prune import PRUNE_PROFILES
 
 if sys.version_info < (3, 11):
     import tomli as tomllib
@@ -11,11 +23,23 @@ else:
 
 
 class ConfigValidationError(Exception):
-    """Raised when the toml config has some problem."""
+    """
+    Raised when the toml config has some problem: a required key is missing, or
+    the `reason` that the value of the key is invalid, if there's one.
+    """
 
-    def __init__(self, key: str) -> None:
-        super().__init__(key)
+    def __init__(self, key: str, reason: str | None = None) -> None:
+        super().__init__(key, reason)
         self.key = key
+        self.reason = reason
+
+
+class DuplicateOutputPath(Exception):
+    """Raised when more than one target in the config has the same output path."""
+
+    def __init__(self, output_path: str) -> None:
+        super().__init__(output_path)
+        self.output_path = output_path
 
 
 @dataclass
@@ -28,6 +52,38 @@ class Config:
     quiet: bool
     pyc: bool
     ignore_file_patterns: list[str] | None
+    launch_cache: bool = False
+    compression: str = DEFAULT_COMPRESSION
+    compression_level: int | None = None
+    compression_threads: int | None = None
+    compression_goal: str = DEFAULT_COMPRESSION_GOAL
+    checksum: str = DEFAULT_CHECKSUM
+    build_cache: bool = False
+    rebuild: bool = False
+    build_cache_size: int = DEFAULT_BUILD_CACHE_SIZE
+    prune: list[str] | None = None
+    prune_include: list[str] | None = None
+    prune_exclude: list[str] | None = None
+    prune_unused: bool = False
+    prune_unused_commands: list[str] | None = None
+    prune_manifest: str | None = None
+    payload_order: bool = False
+    payload_order_commands: list[str] | None = None
+    payload_chunks: int = 1
+    bytecode: bool = False
+    bytecode_optimization: list[int] | None = None
+    bytecode_keep_sources: bool = True
+    zip_stdlib: bool = False
+    zip_site_packages: bool = False
+    trace: str | None = None
+    shared_runtime: bool = False
+    shared_site_packages: bool = False
+    dedupe: bool = False
+    strip: bool = False
+    wheelhouse: str | None = None
+    incremental: bool = False
+    build_log: str | None = None
+    watch: bool = False
 
 
 CONFIG_NAME = "./packaged.toml"
@@ -46,10 +102,92 @@ def parse_config(source_directory: str) -> Config:
     output_path = "myproject.bin"
     build_command = "pip install ."
     startup_command = "python -m myproject"
+
+    Optional keys:
+
+    python_version = "3.12"
+    pyc = true
+    ignore_file_patterns = ["setup.py"]
+    launch_cache = true
+    compression = "zstd"  # or "auto", to pick one for `compression_goal`
+    compression_level = 19
+    compression_threads = 0
+    compression_goal = "balanced"  # or "smallest", "fastest-start"
+    checksum = "sha256"  # or "md5", "crc", "none"
+    build_cache = true
+    build_cache_size = 5120  # in megabytes
+    prune = ["no-dev", "no-gui"]  # or "minimal"
+    prune_exclude = ["docs", "**/*.md"]
+    prune_include = [".packaged_python/python/lib/python3.*/tkinter"]
+    prune_unused = true
+    prune_unused_commands = ["python app.py --selftest"]
+    prune_manifest = "./prune-manifest.json"
+    payload_order = true
+    payload_order_commands = ["python app.py --selftest"]
+    payload_chunks = 8
+    bytecode = true
+    bytecode_optimization = [0, 2]
+    bytecode_keep_sources = false
+    zip_stdlib = true
+    zip_site_packages = true
+    trace = "build-trace.json"
+    shared_runtime = true
+    shared_site_packages = true
+    dedupe = true
+    strip = true
+    wheelhouse = "./wheels"
+    incremental = true
+    build_log = "./build.log"
+    """
+    with open(os.path.join(source_directory, CONFIG_NAME), "rb") as config_file:
+        config_data = tomllib.load(config_file)
+
+    return _config_from_data(source_directory, config_data)
+
+
+def parse_targets(source_directory: str) -> tuple[list[Config], int | None]:
+    """
+    Parses the config file into one config for each target, along with the
+    number of targets to build at a time. Targets are given as tables, with
+    keys that override the ones at the top level of the file:
+
+    build_command = "pip install ."
+    startup_command = "python -m myproject"
+    jobs = 2  # defaults to the number of cores
+
+    [[targets]]
+    output_path = "myproject-3.12.bin"
+
+    [[targets]]
+    output_path = "myproject-3.10.bin"
+    python_version = "3.10"
+    compression = "xz"
+
+    Without any targets, the file is parsed as a single config.
     """
     with open(os.path.join(source_directory, CONFIG_NAME), "rb") as config_file:
         config_data = tomllib.load(config_file)
 
+    targets = config_data.pop("targets", None)
+    jobs = config_data.pop("jobs", None)
+    if not targets:
+        return [_config_from_data(source_directory, config_data)], jobs
+
+    configs = []
+    output_paths = set()
+    for target in targets:
+        config = _config_from_data(source_directory, {**config_data, **target})
+        output_path = os.path.abspath(config.output_path)
+        if output_path in output_paths:
+            raise DuplicateOutputPath(config.output_path)
+
+        output_paths.add(output_path)
+        configs.append(config)
+
+    return configs, jobs
+
+
+def _config_from_data(source_directory: str, config_data: dict[str, Any]) -> Config:
     try:
         config = Config(
             os.path.abspath(source_directory),
@@ -60,9 +198,99 @@ def parse_config(source_directory: str) -> Config:
             config_data.get("quiet", "CI" in os.environ),
             config_data.get("pyc", False),
             config_data.get("ignore_file_patterns"),
+            launch_cache=config_data.get("launch_cache", False),
+            compression=config_data.get("compression", DEFAULT_COMPRESSION),
+            compression_level=config_data.get("compression_level"),
+            compression_threads=config_data.get("compression_threads"),
+            compression_goal=config_data.get(
+                "compression_goal", DEFAULT_COMPRESSION_GOAL
+            ),
+            checksum=config_data.get("checksum", DEFAULT_CHECKSUM),
+            build_cache=config_data.get("build_cache", False),
+            build_cache_size=config_data.get(
+                "build_cache_size", DEFAULT_BUILD_CACHE_SIZE
+            ),
+            prune=config_data.get("prune"),
+            prune_include=config_data.get("prune_include"),
+            prune_exclude=config_data.get("prune_exclude"),
+            prune_unused=config_data.get("prune_unused", False),
+            prune_unused_commands=config_data.get("prune_unused_commands"),
+            prune_manifest=config_data.get("prune_manifest"),
+            payload_order=config_data.get("payload_order", False),
+            payload_order_commands=config_data.get("payload_order_commands"),
+            payload_chunks=config_data.get("payload_chunks", 1),
+            bytecode=config_data.get("bytecode", False),
+            bytecode_optimization=config_data.get("bytecode_optimization"),
+            bytecode_keep_sources=config_data.get("bytecode_keep_sources", True),
+            zip_stdlib=config_data.get("zip_stdlib", False),
+            zip_site_packages=config_data.get("zip_site_packages", False),
+            trace=config_data.get("trace"),
+            shared_runtime=config_data.get("shared_runtime", False),
+            shared_site_packages=config_data.get("shared_site_packages", False),
+            dedupe=config_data.get("dedupe", False),
+            strip=config_data.get("strip", False),
+            wheelhouse=config_data.get("wheelhouse"),
+            incremental=config_data.get("incremental", False),
+            build_log=config_data.get("build_log"),
         )
     except KeyError as exc:
         key = exc.args[0]
         raise ConfigValidationError(key)
 
+    validate_config(config)
     return config
+
+
+def validate_config(config: Config) -> None:
+    """
+    Checks the options that have a fixed set of valid values, so that a bad
+    config or command line fails before the build starts rather than halfway
+    through it. Raises `ConfigValidationError` with the reason.
+    """
+    compressions = ["auto", *COMPRESSORS]
+    if config.compression not in compressions:
+        raise ConfigValidationError(
+            "compression", f"expected one of: {', '.join(compressions)}"
+        )
+
+    if config.compression_level is not None:
+        max_level = (
+            max(MAX_LEVELS.values())
+            if config.compression == "auto"
+            else MAX_LEVELS[config.compression]
+        )
+        if not _is_int(config.compression_level) or not (
+            1 <= config.compression_level <= max_level
+        ):
+            raise ConfigValidationError(
+                "compression_level", f"expected a number from 1 to {max_level}"
+            )
+
+    if config.compression_goal not in COMPRESSION_GOALS:
+        raise ConfigValidationError(
+            "compression_goal", f"expected one of: {', '.join(COMPRESSION_GOALS)}"
+        )
+
+    if config.checksum not in CHECKSUM_OPTIONS:
+        raise ConfigValidationError(
+            "checksum", f"expected one of: {', '.join(CHECKSUM_OPTIONS)}"
+        )
+
+    if config.prune is not None:
+        if not isinstance(config.prune, list):
+            raise ConfigValidationError("prune", "expected a list of profiles")
+        for profile in config.prune:
+            if profile not in PRUNE_PROFILES:
+                raise ConfigValidationError(
+                    "prune",
+                    f"unknown profile {profile!r},"
+                    f" expected one of: {', '.join(PRUNE_PROFILES)}",
+                )
+
+    if not _is_int(config.payload_chunks) or config.payload_chunks < 1:
+        raise ConfigValidationError("payload_chunks", "expected a positive number")
+
+
+def _is_int(value: object) -> bool:
+    # TOML booleans are parsed as `bool`, which is a subclass of `int`
+    return isinstance(value, int) and not isinstance(value, bool)
@@ -0,0 +1,110 @@
+"""Storing the files that have the same contents only once in the package."""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class DedupeReport:
+    """
+    Number of duplicate files that were replaced by hardlinks, the bytes that
+    no longer need to be archived and extracted, and the size of each set of
+    duplicates, keyed by the file that the others now link to (relative to the
+    deduplicated directory).
+    """
+
+    files: int = 0
+    bytes: int = 0
+    duplicates: dict[str, int] = field(default_factory=dict)
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _link(source_path: str, destination_path: str) -> None:
+    """Replaces the destination with a hardlink to the source."""
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".dedupe-", dir=os.path.dirname(destination_path)
+    )
+    os.close(fd)
+    os.remove(temp_path)
+    try:
+        os.link(source_path, temp_path)
+        os.replace(temp_path, destination_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def dedupe_tree(directory: str, jobs: int | None = None) -> DedupeReport:
+    """
+    Replaces the files in the directory that have the same contents and
+    permissions with hardlinks to the first of them, in the order that they're
+    added to the package. Tarballs store every other name of a hardlinked file
+    as a link to the first, so its contents are archived, compressed and
+    extracted only once.
+
+    Only files that have the same size as another are hashed, in parallel.
+    Empty files and symlinks are left as they are.
+    """
+    candidates: dict[tuple[int, int], list[str]] = defaultdict(list)
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            if os.path.islink(file_path):
+                continue
+
+            stat = os.stat(file_path)
+            if stat.st_size > 0:
+                candidates[stat.st_size, stat.st_mode].append(file_path)
+
+    file_paths = [
+        file_path
+        for same_size in candidates.values()
+        if len(same_size) > 1
+        for file_path in same_size
+    ]
+    # Names of a file that's already hardlinked are only hashed once
+    inodes: dict[tuple[int, int], str] = {}
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        inodes.setdefault((stat.st_dev, stat.st_ino), file_path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        inode_hashes = dict(
+            zip(inodes.keys(), executor.map(_file_hash, inodes.values()))
+        )
+
+    report = DedupeReport()
+    first_paths: dict[tuple[int, int, str], str] = {}
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        key = (stat.st_size, stat.st_mode, inode_hashes[stat.st_dev, stat.st_ino])
+        first_path = first_paths.setdefault(key, file_path)
+        if first_path == file_path or os.path.samefile(first_path, file_path):
+            continue
+
+        _link(first_path, file_path)
+        report.files += 1
+        report.bytes += stat.st_size
+        relative_path = os.path.relpath(first_path, directory)
+        report.duplicates[relative_path] = (
+            report.duplicates.get(relative_path, 0) + stat.st_size
+        )
+
+    return report
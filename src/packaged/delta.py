@@ -0,0 +1,429 @@
+"""Binary patches between two versions of a package."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import hashlib
+import json
+import lzma
+import os
+import subprocess
+import tarfile
+import tempfile
+from typing import IO, BinaryIO, Iterator
+
+from packaged import OutputPathExists
+from packaged.archive import CHUNK_SIZE, DEFAULT_COMPRESSION_LEVEL, compress_stream
+from packaged.compression import DECOMPRESS_COMMANDS, compress_command
+
+PATCH_FORMAT = "packaged-delta"
+PATCH_VERSION = 1
+# Files that changed are matched against the old package in chunks of this size
+DELTA_CHUNK_SIZE = 64 * 1024
+
+# Operations in the patch, each followed by 8-byte big endian numbers
+_COPY = b"C"  # offset and length in the old tarball
+_LITERAL = b"L"  # length, followed by that many bytes
+_END = b"E"
+
+
+class PackageNotReproducible(Exception):
+    """
+    Raised when recompressing a package's payload doesn't give back the same
+    bytes, so a patch couldn't rebuild it exactly.
+    """
+
+    def __init__(self, package_path: str) -> None:
+        super().__init__(package_path)
+        self.package_path = package_path
+
+
+class LayeredPackage(Exception):
+    """
+    Raised for packages with a shared runtime or incremental layer, or an
+    ordered or chunked payload, as patches can only rebuild a payload made of a single archive.
+    """
+
+    def __init__(self, package_path: str) -> None:
+        super().__init__(package_path)
+        self.package_path = package_path
+
+
+class PatchDoesNotApply(Exception):
+    """Raised when a patch was made for a different package than the one given."""
+
+    def __init__(self, package_path: str) -> None:
+        super().__init__(package_path)
+        self.package_path = package_path
+
+
+class PatchOutputMismatch(Exception):
+    """
+    Raised when the package rebuilt from a patch differs from the one the patch
+    was made from, usually because the compressor is a different version.
+    """
+
+    def __init__(self, output_path: str) -> None:
+        super().__init__(output_path)
+        self.output_path = output_path
+
+
+@dataclass
+class PackageInfo:
+    """
+    Where the payload starts in a package, how it's compressed, and the number
+    of archives it's made of.
+    """
+
+    header_size: int
+    payload_size: int
+    compression: str
+    compression_level: int
+    compression_threads: int | None
+    archives: int = 1
+
+
+@dataclass
+class DeltaStats:
+    """Bytes of the new tarball copied from the old one, and sent in the patch."""
+
+    copied_bytes: int = 0
+    literal_bytes: int = 0
+
+
+def _sha256_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def read_package_info(package_path: str) -> PackageInfo:
+    """Reads the payload's position and compression from the package's header."""
+    output = subprocess.run(
+        ["sh", package_path, "--dumpconf"], check=True, capture_output=True
+    ).stdout.decode()
+    config = {}
+    for line in output.splitlines():
+        key, _, value = line.partition("=")
+        config[key] = value.strip('"')
+
+    header_size = 0
+    with open(package_path, "rb") as package:
+        for _ in range(int(config["SKIP"])):
+            header_size += len(package.readline())
+
+    threads = config.get("COMPRESS_THREADS")
+    archive_sizes = [int(size) for size in config["filesizes"].split()]
+    return PackageInfo(
+        header_size=header_size,
+        payload_size=sum(archive_sizes),
+        compression=config["COMPRESS"],
+        compression_level=int(
+            config.get("COMPRESS_LEVEL") or DEFAULT_COMPRESSION_LEVEL
+        ),
+        compression_threads=int(threads) if threads else None,
+        archives=len(archive_sizes),
+    )
+
+
+def extract_tarball(package_path: str, info: PackageInfo, tarball_path: str) -> None:
+    """Decompresses the package's payload into an uncompressed tarball."""
+    with open(package_path, "rb") as package, open(tarball_path, "wb") as tarball:
+        package.seek(info.header_size)
+        subprocess.run(
+            DECOMPRESS_COMMANDS[info.compression],
+            stdin=package,
+            stdout=tarball,
+            check=True,
+        )
+
+
+def _regions(tarball_path: str) -> Iterator[tuple[int, int]]:
+    """
+    Splits the tarball into the data of each file, and the headers and padding
+    in between, as offset and length pairs.
+    """
+    offset = 0
+    with tarfile.open(tarball_path, "r:") as tar:
+        for member in tar:
+            if not member.isreg() or member.size == 0:
+                continue
+
+            yield offset, member.offset_data - offset
+            yield member.offset_data, member.size
+            offset = member.offset_data + member.size
+
+    yield offset, os.path.getsize(tarball_path) - offset
+
+
+def _hash_region(
+    tarball: BinaryIO, offset: int, length: int
+) -> tuple[bytes, list[bytes]]:
+    """Hashes a region of the tarball, along with each chunk of it."""
+    region_sha256 = hashlib.sha256()
+    chunk_hashes = []
+    tarball.seek(offset)
+    for start in range(0, length, DELTA_CHUNK_SIZE):
+        chunk = tarball.read(min(DELTA_CHUNK_SIZE, length - start))
+        region_sha256.update(chunk)
+        chunk_hashes.append(hashlib.sha256(chunk).digest())
+
+    return region_sha256.digest(), chunk_hashes
+
+
+def _index_tarball(
+    tarball_path: str,
+) -> tuple[dict[bytes, tuple[int, int]], dict[bytes, int]]:
+    """
+    Hashes every region of the tarball, and every chunk of the files in it,
+    to find where the contents of the new tarball already are in the old one.
+    """
+    regions: dict[bytes, tuple[int, int]] = {}
+    chunks: dict[bytes, int] = {}
+    with open(tarball_path, "rb") as tarball:
+        for offset, length in _regions(tarball_path):
+            region_hash, chunk_hashes = _hash_region(tarball, offset, length)
+            regions.setdefault(region_hash, (offset, length))
+            for index, chunk_hash in enumerate(chunk_hashes):
+                # Only whole chunks are matched, so that copies are the same size
+                if (index + 1) * DELTA_CHUNK_SIZE <= length:
+                    chunks.setdefault(chunk_hash, offset + index * DELTA_CHUNK_SIZE)
+
+    return regions, chunks
+
+
+class _PatchWriter:
+    """Writes patch operations, merging neighbouring ones of the same kind."""
+
+    def __init__(self, file: IO[bytes]) -> None:
+        self.file = file
+        self.copy: tuple[int, int] | None = None
+        self.literal = bytearray()
+        self.stats = DeltaStats()
+
+    def add_copy(self, offset: int, length: int) -> None:
+        self.stats.copied_bytes += length
+        self._flush_literal()
+        if self.copy is not None and sum(self.copy) == offset:
+            self.copy = (self.copy[0], self.copy[1] + length)
+            return
+
+        self._flush_copy()
+        self.copy = (offset, length)
+
+    def add_literal(self, data: bytes) -> None:
+        self.stats.literal_bytes += len(data)
+        self._flush_copy()
+        self.literal += data
+        if len(self.literal) >= CHUNK_SIZE:
+            self._flush_literal()
+
+    def close(self) -> None:
+        self._flush_copy()
+        self._flush_literal()
+        self.file.write(_END)
+
+    def _flush_copy(self) -> None:
+        if self.copy is not None:
+            offset, length = self.copy
+            self.file.write(
+                _COPY + offset.to_bytes(8, "big") + length.to_bytes(8, "big")
+            )
+            self.copy = None
+
+    def _flush_literal(self) -> None:
+        if self.literal:
+            self.file.write(_LITERAL + len(self.literal).to_bytes(8, "big"))
+            self.file.write(self.literal)
+            self.literal = bytearray()
+
+
+def diff_packages(old_path: str, new_path: str, patch_path: str) -> DeltaStats:
+    """
+    Writes a patch that turns the old package into the new one.
+
+    Both payloads are decompressed, and the new tarball is described in terms of
+    the old one: files, headers and 64KB chunks of files that are found in the
+    old tarball are copied from it, and everything else is stored in the patch.
+    As the patch rebuilds the new package by recompressing the new tarball, the
+    new package has to be reproducible with the compressor installed here.
+    """
+    if os.path.exists(patch_path):
+        raise OutputPathExists
+
+    old_info = read_package_info(old_path)
+    new_info = read_package_info(new_path)
+    for path, info in ((old_path, old_info), (new_path, new_info)):
+        if info.archives > 1:
+            raise LayeredPackage(path)
+    with open(new_path, "rb") as new_package:
+        new_header = new_package.read(new_info.header_size)
+    new_payload_sha256 = hashlib.sha256()
+    with open(new_path, "rb") as new_package:
+        new_package.seek(new_info.header_size)
+        for chunk in iter(lambda: new_package.read(CHUNK_SIZE), b""):
+            new_payload_sha256.update(chunk)
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        old_tarball_path = os.path.join(temp_directory, "old.tar")
+        new_tarball_path = os.path.join(temp_directory, "new.tar")
+        extract_tarball(old_path, old_info, old_tarball_path)
+        extract_tarball(new_path, new_info, new_tarball_path)
+
+        with open(new_tarball_path, "rb") as new_tarball, open(
+            os.devnull, "wb"
+        ) as devnull:
+            payload = compress_stream(
+                devnull,
+                lambda file: _copy_file(new_tarball, file),
+                compress_command(
+                    new_info.compression,
+                    new_info.compression_level,
+                    new_info.compression_threads,
+                ),
+                checksum="sha256",
+            )
+        if payload.sha256 != new_payload_sha256.hexdigest():
+            raise PackageNotReproducible(new_path)
+
+        metadata = {
+            "format": PATCH_FORMAT,
+            "version": PATCH_VERSION,
+            "old_sha256": _sha256_file(old_path),
+            "new_payload_sha256": payload.sha256,
+            "new_payload_size": payload.size,
+            "header_size": len(new_header),
+            "compression": new_info.compression,
+            "compression_level": new_info.compression_level,
+            "compression_threads": new_info.compression_threads,
+        }
+        regions, chunks = _index_tarball(old_tarball_path)
+        try:
+            with lzma.open(patch_path, "wb") as patch, open(
+                new_tarball_path, "rb"
+            ) as new_tarball:
+                patch.write(json.dumps(metadata).encode() + b"\n")
+                patch.write(new_header)
+
+                writer = _PatchWriter(patch)
+                for offset, length in _regions(new_tarball_path):
+                    region_hash, chunk_hashes = _hash_region(
+                        new_tarball, offset, length
+                    )
+                    match = regions.get(region_hash)
+                    if match is not None and match[1] == length:
+                        writer.add_copy(match[0], length)
+                        continue
+
+                    for index, chunk_hash in enumerate(chunk_hashes):
+                        start = offset + index * DELTA_CHUNK_SIZE
+                        chunk_length = min(DELTA_CHUNK_SIZE, offset + length - start)
+                        chunk_offset = chunks.get(chunk_hash)
+                        if (
+                            chunk_offset is not None
+                            and chunk_length == DELTA_CHUNK_SIZE
+                        ):
+                            writer.add_copy(chunk_offset, chunk_length)
+                        else:
+                            new_tarball.seek(start)
+                            writer.add_literal(new_tarball.read(chunk_length))
+
+                writer.close()
+        except BaseException:
+            if os.path.exists(patch_path):
+                os.remove(patch_path)
+            raise
+
+    return writer.stats
+
+
+def _copy_file(source: BinaryIO, destination: IO[bytes]) -> None:
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+        destination.write(chunk)
+
+
+def _read_number(file: IO[bytes]) -> int:
+    return int.from_bytes(file.read(8), "big")
+
+
+def _apply_operations(
+    patch: IO[bytes], old_tarball: BinaryIO, output: IO[bytes]
+) -> None:
+    """Writes the new tarball, from the patch's operations."""
+    while True:
+        operation = patch.read(1)
+        if operation == _END:
+            return
+
+        if operation == _COPY:
+            old_tarball.seek(_read_number(patch))
+            remaining = _read_number(patch)
+            source = old_tarball
+        elif operation == _LITERAL:
+            remaining = _read_number(patch)
+            source = patch  # type: ignore[assignment]
+        else:
+            raise ValueError(f"Invalid patch operation: {operation!r}")
+
+        while remaining > 0:
+            data = source.read(min(remaining, CHUNK_SIZE))
+            if not data:
+                raise ValueError("Patch is truncated")
+            output.write(data)
+            remaining -= len(data)
+
+
+def apply_patch(old_path: str, patch_path: str, output_path: str) -> None:
+    """
+    Rebuilds the new package from the old one and a patch made by
+    `diff_packages`, and checks that it matches the package the patch was
+    made from byte for byte.
+    """
+    if os.path.exists(output_path):
+        raise OutputPathExists
+
+    with lzma.open(patch_path, "rb") as patch:
+        metadata = json.loads(patch.readline())
+        if (
+            metadata.get("format") != PATCH_FORMAT
+            or metadata.get("version") != PATCH_VERSION
+        ):
+            raise ValueError(f"{patch_path!r} is not a supported patch")
+        if _sha256_file(old_path) != metadata["old_sha256"]:
+            raise PatchDoesNotApply(old_path)
+
+        old_info = read_package_info(old_path)
+        with tempfile.TemporaryDirectory() as temp_directory:
+            old_tarball_path = os.path.join(temp_directory, "old.tar")
+            extract_tarball(old_path, old_info, old_tarball_path)
+
+            try:
+                with open(output_path, "wb") as output, open(
+                    old_tarball_path, "rb"
+                ) as old_tarball:
+                    output.write(patch.read(metadata["header_size"]))
+                    payload = compress_stream(
+                        output,
+                        lambda file: _apply_operations(patch, old_tarball, file),
+                        compress_command(
+                            metadata["compression"],
+                            metadata["compression_level"],
+                            metadata["compression_threads"],
+                        ),
+                        checksum="sha256",
+                    )
+
+                if (
+                    payload.sha256 != metadata["new_payload_sha256"]
+                    or payload.size != metadata["new_payload_size"]
+                ):
+                    raise PatchOutputMismatch(output_path)
+            except BaseException:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+
+    os.chmod(output_path, 0o755)
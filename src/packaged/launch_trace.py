@@ -0,0 +1,146 @@
+"""Timing how long a package takes to launch, on the machine it runs on."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import json
+
+# Running a package with `PACKAGED_TRACE` set to a file path appends an event to
+# that file for the start and end of every launch stage, as JSON lines like:
+#     {"stage": "extract", "event": "start", "time_ns": 1700000000000000000}
+# With `PACKAGED_TRACE_IMPORTS` set as well, Python's `-X importtime` output is
+# added to it, one line per imported module:
+#     {"import": "json", "self_us": 120, "cumulative_us": 900, "depth": 0}
+TRACE_ENV_VAR = "PACKAGED_TRACE"
+TRACE_IMPORTS_ENV_VAR = "PACKAGED_TRACE_IMPORTS"
+
+# Prints the current time in nanoseconds, falling back to whole seconds where
+# `date` doesn't support `%N` (like on macOS)
+_NOW = 'now=`date +%s%N`; case "$now" in *N) now=${now%N}000000000;; esac'
+
+# Turns `-X importtime` lines from stderr into JSON lines in the trace, and
+# passes everything else through to stderr.
+_IMPORTTIME_FILTER = r"""
+/^import time:/ {
+    split($0, fields, "|")
+    self = fields[1]
+    sub(/^import time: */, "", self)
+    if (self !~ /^[0-9]+ *$/) next
+    name = substr(fields[3], 2)
+    match(name, /^ */)
+    depth = RLENGTH / 2
+    sub(/^ */, "", name)
+    printf "{\"import\": \"%s\", \"self_us\": %d, \"cumulative_us\": %d, \"depth\": %d}\n", name, self, fields[2], depth >> trace
+    next
+}
+{ print > "/dev/stderr"; fflush("/dev/stderr") }
+"""
+
+
+def startup_script(python_bin_folder: str, startup_command: str) -> str:
+    """
+    Returns the startup script, which runs the startup command with the bundled
+    Python first on the PATH. With `PACKAGED_TRACE` set, it records when the
+    app starts and exits, and with `PACKAGED_TRACE_IMPORTS`, it records the
+    time taken by every import, of all Python processes the command runs.
+    """
+    return f"""\
+PATH={python_bin_folder}:$PATH
+packaged_trace() {{
+    if test -n "${TRACE_ENV_VAR}"; then
+        {_NOW}
+        echo "{{\\"stage\\": \\"$1\\", \\"event\\": \\"$2\\", \\"time_ns\\": $now}}" >> "${TRACE_ENV_VAR}"
+    fi
+}}
+packaged_main() {{
+{startup_command or ":"}
+}}
+packaged_trace app start
+if test -n "${TRACE_ENV_VAR}" && test -n "${TRACE_IMPORTS_ENV_VAR}"; then
+    PYTHONPROFILEIMPORTTIME=1
+    export PYTHONPROFILEIMPORTTIME
+    # The app's stderr goes through the filter, and its exit code through a file
+    {{ {{ packaged_main "$@" 2>&1 1>&3 3>&-; echo $? > "${TRACE_ENV_VAR}.status"; }} | awk -v trace="${TRACE_ENV_VAR}" '{_IMPORTTIME_FILTER}'; }} 3>&1
+    status=`cat "${TRACE_ENV_VAR}.status" 2>/dev/null || echo 1`
+    rm -f "${TRACE_ENV_VAR}.status"
+else
+    packaged_main "$@"
+    status=$?
+fi
+packaged_trace app end
+exit $status
+"""
+
+
+@dataclass
+class LaunchTrace:
+    """
+    Durations of the launch stages in seconds, in the order they started,
+    and the imports as (module, own time, cumulative time, depth) with the
+    times in seconds.
+    """
+
+    stages: dict[str, float] = field(default_factory=dict)
+    imports: list[tuple[str, float, float, int]] = field(default_factory=list)
+    total: float = 0.0
+
+    def summary(self, top_imports: int = 10) -> str:
+        """Returns a table of the stages, and the slowest top level imports."""
+        lines = [f"{'Stage':<16}  {'Time':>8}"]
+        for stage, duration in self.stages.items():
+            lines.append(f"{stage:<16}  {duration:>7.3f}s")
+        lines.append(f"{'Total':<16}  {self.total:>7.3f}s")
+
+        top_level = [item for item in self.imports if item[3] == 0]
+        if top_level:
+            lines.append("")
+            lines.append(f"{'Import':<32}  {'Cumulative':>10}")
+            for module, _, cumulative, _ in sorted(
+                top_level, key=lambda item: item[2], reverse=True
+            )[:top_imports]:
+                lines.append(f"{module:<32}  {cumulative:>9.3f}s")
+
+        return "\n".join(lines)
+
+
+def read_launch_trace(trace_path: str) -> LaunchTrace:
+    """
+    Reads the events written by a package launched with `PACKAGED_TRACE`.
+    Stages that were entered more than once, like in a file that several
+    launches were traced into, have their durations added up.
+    """
+    trace = LaunchTrace()
+    starts: dict[str, int] = {}
+    first_time = last_time = None
+    with open(trace_path) as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+
+            event = json.loads(line)
+            if "import" in event:
+                trace.imports.append(
+                    (
+                        event["import"],
+                        event["self_us"] / 1_000_000,
+                        event["cumulative_us"] / 1_000_000,
+                        event["depth"],
+                    )
+                )
+                continue
+
+            time_ns = event["time_ns"]
+            first_time = time_ns if first_time is None else min(first_time, time_ns)
+            last_time = time_ns if last_time is None else max(last_time, time_ns)
+            if event["event"] == "start":
+                starts[event["stage"]] = time_ns
+                trace.stages.setdefault(event["stage"], 0.0)
+            elif event["stage"] in starts:
+                duration = (time_ns - starts.pop(event["stage"])) / 1_000_000_000
+                stage = event["stage"]
+                trace.stages[stage] = trace.stages.get(stage, 0.0) + duration
+
+    if first_time is not None and last_time is not None:
+        trace.total = (last_time - first_time) / 1_000_000_000
+
+    return trace
@@ -3,6 +3,18 @@ cat << EOF  > "$archname"
 # This script was generated using Makeself $MS_VERSION
 # The license covering this archive and its contents, if any, is wholly independent of the Makeself license (GPL)
 
+# With PACKAGED_TRACE set to a file, the start and end of every launch stage
+# is appended to it, as JSON lines
+MS_Trace()
+{
+    if test x"\$PACKAGED_TRACE" != x; then
+        now=\`date +%s%N\`
+        case "\$now" in *N) now=\${now%N}000000000;; esac
+        echo "{\"stage\": \"\$1\", \"event\": \"\$2\", \"time_ns\": \$now}" >> "\$PACKAGED_TRACE"
+    fi
+}
+MS_Trace launcher start
+
 ORIG_UMASK=\`umask\`
 if test "$KEEP_UMASK" = n; then
     umask 077
@@ -33,6 +45,10 @@ quiet="n"
 accept="n"
 nodiskspace="n"
 export_conf="$EXPORT_CONF"
+launch_cache="$LAUNCH_CACHE"
+runtimelayer="$RUNTIME_LAYER"
+coldlayer="$COLD_LAYER"
+chunks="$PAYLOAD_CHUNKS"
 decrypt_cmd="$DECRYPT_CMD"
 skip="$SKIP"
 
@@ -100,8 +116,11 @@ MS_dd()
 {
     blocks=\`expr \$3 / 1024\`
     bytes=\`expr \$3 % 1024\`
+    # Prefer tail and head, which read in large blocks all the way through
+    if test x"\`echo xy | head -c 1 2> /dev/null\`" = xx; then
+        tail -c +\`expr \$2 + 1\` "\$1" | head -c \$3
     # Test for ibs, obs and conv feature
-    if dd if=/dev/zero of=/dev/null count=1 ibs=512 obs=512 conv=sync 2> /dev/null; then
+    elif dd if=/dev/zero of=/dev/null count=1 ibs=512 obs=512 conv=sync 2> /dev/null; then
         dd if="\$1" ibs=\$2 skip=1 obs=1024 conv=sync 2> /dev/null | \\
         { test \$blocks -gt 0 && dd ibs=1024 obs=1024 count=\$blocks ; \\
           test \$bytes  -gt 0 && dd ibs=1 obs=1024 count=\$bytes ; } 2> /dev/null
@@ -127,7 +146,7 @@ MS_dd_Progress()
     blocks=\`expr \$length / \$bsize\`
     bytes=\`expr \$length % \$bsize\`
     (
-        dd ibs=\$offset skip=1 count=1 2>/dev/null
+        dd ibs=\$offset skip=1 count=0 2>/dev/null
         pos=\`expr \$pos \+ \$bsize\`
         MS_Printf "     0%% " 1>&2
         if test \$blocks -gt 0; then
@@ -219,6 +238,62 @@ MS_Verify_Sig()
     fi
 }
 
+MS_Check_Size()
+{
+    offset=\`head -n "\$skip" "\$1" | wc -c | sed "s/ //g"\`
+    fsize=\`wc -c < "\$1" | sed "s/ //g"\`
+    if test \$totalsize -ne \`expr \$fsize - \$offset\`; then
+        echo " Unexpected archive size." >&2
+        exit 2
+    fi
+}
+
+MS_Find_Sum()
+{
+    # Picks the strongest checksum embedded for the \$1-th archive, and sets
+    # sumname, sumexpected and sumcmd for it. sumname is empty if there is none.
+    sumname=""
+    sumexpected=\`echo \$SHA | cut -d" " -f\$1\`
+    if test x"\$sumexpected" != x0000000000000000000000000000000000000000000000000000000000000000; then
+        SHA_PATH=\`exec <&- 2>&-; which shasum || command -v shasum || type shasum\`
+        test -x "\$SHA_PATH" || SHA_PATH=\`exec <&- 2>&-; which sha256sum || command -v sha256sum || type sha256sum\`
+        if test -x "\$SHA_PATH"; then
+            if test x"\`basename \$SHA_PATH\`" = xshasum; then
+                sumcmd="\"\$SHA_PATH\" -a 256 | cut -b-64"
+            else
+                sumcmd="\"\$SHA_PATH\" | cut -b-64"
+            fi
+            sumname=SHA256
+            return
+        fi
+    fi
+
+    sumexpected=\`echo \$MD5 | cut -d" " -f\$1\`
+    if test x"\$sumexpected" != x00000000000000000000000000000000; then
+        OLD_PATH="\$PATH"
+        PATH=\${GUESS_MD5_PATH:-"\$OLD_PATH:/bin:/usr/bin:/sbin:/usr/local/ssl/bin:/usr/local/bin:/opt/openssl/bin"}
+        MD5_PATH=\`exec <&- 2>&-; which md5sum || command -v md5sum || type md5sum\`
+        test -x "\$MD5_PATH" || MD5_PATH=\`exec <&- 2>&-; which md5 || command -v md5 || type md5\`
+        test -x "\$MD5_PATH" || MD5_PATH=\`exec <&- 2>&-; which digest || command -v digest || type digest\`
+        PATH="\$OLD_PATH"
+        if test -x "\$MD5_PATH"; then
+            if test x"\`basename \$MD5_PATH\`" = xdigest; then
+                sumcmd="\"\$MD5_PATH\" -a md5 | cut -b-32"
+            else
+                sumcmd="\"\$MD5_PATH\" | cut -b-32"
+            fi
+            sumname=MD5
+            return
+        fi
+    fi
+
+    sumexpected=\`echo \$CRCsum | cut -d" " -f\$1\`
+    if test x"\$sumexpected" != x0000000000; then
+        sumcmd="CMD_ENV=xpg4 cksum | awk '{print \\\$1}'"
+        sumname=CRC
+    fi
+}
+
 MS_Check()
 {
     OLD_PATH="\$PATH"
@@ -235,12 +310,7 @@ MS_Check()
     if test x"\$quiet" = xn; then
 		MS_Printf "Verifying archive integrity..."
     fi
-    offset=\`head -n "\$skip" "\$1" | wc -c | sed "s/ //g"\`
-    fsize=\`cat "\$1" | wc -c | sed "s/ //g"\`
-    if test \$totalsize -ne \`expr \$fsize - \$offset\`; then
-        echo " Unexpected archive size." >&2
-        exit 2
-    fi
+    MS_Check_Size "\$1"
     verb=\$2
     i=1
     for s in \$filesizes
@@ -311,6 +381,7 @@ MS_Decompress()
     
     if test \$? -ne 0; then
         echo " ... Decompression failed." >&2
+        return 1
     fi
 }
 
@@ -323,6 +394,281 @@ UnTAR()
     fi
 }
 
+MS_Extract()
+{
+    # Extracts the \$1-th archive, that is \$3 bytes long at offset \$2, into
+    # tmpdir. With singlepass, the archive is hashed while it is extracted,
+    # so that it only gets read once.
+    sumname=""
+    if test x"\$singlepass" = xy; then
+        MS_Find_Sum \$1
+    fi
+    if test x"\$sumname" = x; then
+        # Without a checksum, a corrupted archive is only noticed by the
+        # decompressor, which tar can't tell apart from the end of the archive
+        extractout=\`( MS_dd_Progress "\$0" \$2 \$3 | { MS_Decompress || echo failed >&3; } | ( cd "\$tmpdir"; umask \$ORIG_UMASK ; UnTAR xp ) 1>/dev/null ) 3>&1\`
+        test x"\$extractout" = x
+        return
+    fi
+
+    # tee copies the archive to the checksum command on fd 3. tar can stop
+    # reading before the end of the archive, so the rest of it is drained
+    # to make sure that the whole archive gets hashed.
+    sumout=\`( ( MS_dd_Progress "\$0" \$2 \$3 | tee /dev/fd/3 | MS_Decompress | ( cd "\$tmpdir"; umask \$ORIG_UMASK ; UnTAR xp; untarres=\$?; cat > /dev/null; exit \$untarres ) 1>/dev/null || echo failed ) 3>&1 1>&4 | eval "\$sumcmd" ) 4>&1\`
+    case "\$sumout" in
+    *failed*)
+        return 1
+        ;;
+    esac
+    sumactual=\`echo \$sumout\`
+    if test x"\$sumactual" != x"\$sumexpected"; then
+        echo >&2
+        echo "Error in \$sumname checksums: \$sumactual is different from \$sumexpected" >&2
+        return 2
+    fi
+    if test x"\$quiet" = xn; then
+        MS_Printf " \$sumname checksums are OK." >&2
+    fi
+}
+
+MS_Lock()
+{
+    # Takes the lock directory \$1, unless another launch holds it
+    if mkdir "\$1" 2>/dev/null; then
+        echo \$\$ > "\$1/pid"
+        return 0
+    fi
+    lockpid=\`cat "\$1/pid" 2>/dev/null\`
+    if test x"\$lockpid" != x; then
+        # Another launch is extracting right now
+        kill -0 "\$lockpid" 2>/dev/null && return 1
+    elif test x"\`find "\$1" -prune -mmin +5 2>/dev/null\`" = x; then
+        # Lock was just created, its owner has not written its pid yet
+        return 1
+    fi
+    # The process holding the lock is gone, take it over
+    rm -rf "\$1"
+    mkdir "\$1" 2>/dev/null || return 1
+    echo \$\$ > "\$1/pid"
+}
+
+MS_Cache_Key()
+{
+    # The last of the checksums that follow, and if the package has \$1 > 1
+    # archives, a CRC of all of theirs, which keeps the name short
+    keycount=\$1
+    shift
+    key=\`echo "\$@" | awk '{ print \$NF }'\`
+    if test \$keycount -gt 1; then
+        keysum=\`echo "\$@" | awk -v n=\$keycount '{ for (i = NF - n + 1; i <= NF; i++) printf "%s", \$i }' | cksum | awk '{ print \$1 }'\`
+        key=\$key-\$keysum
+    fi
+    echo \$key
+}
+
+MS_Cache_Lookup()
+{
+    cacheroot=\${PACKAGED_CACHE_DIR:-\${XDG_CACHE_HOME:-\$HOME/.cache}/packaged}
+    cachename=\`basename "\$label" | sed 's/[^A-Za-z0-9._-]/_/g'\`
+    # Keyed by the archives of the package itself, as a shared runtime layer
+    # comes before them
+    keyarchives=\`echo \$filesizes | wc -w\`
+    test x"\$runtimelayer" != x && keyarchives=\`expr \$keyarchives - 1\`
+    # Checksums that weren't computed are all zeros
+    keysums="\$SHA"
+    if test x"\`echo \$keysums | tr -d '0 '\`" = x; then
+        keysums="\$MD5"
+    fi
+    if test x"\`echo \$keysums | tr -d '0 '\`" = x; then
+        keysums="\$CRCsum"
+    fi
+    cachekey=\`MS_Cache_Key \$keyarchives \$keysums\`
+    test x"\$keysums" = x"\$CRCsum" && cachekey=\$cachekey-\$totalsize
+    cachedir="\$cacheroot/\$cachename-\$cachekey"
+    cachelock="\$cacheroot/.lock-\$cachename-\$cachekey"
+
+    if test -f "\$cachedir/.packaged-complete"; then
+        # Refresh the marker, eviction keeps the most recently used versions
+        touch "\$cachedir/.packaged-complete"
+        tmpdir="\$cachedir"
+        cached=hit
+        return
+    fi
+
+    mkdir -p "\$cacheroot" 2>/dev/null || return
+    if MS_Lock "\$cachelock"; then
+        tmpdir="\$cacheroot/.tmp-\$cachename-\$cachekey"
+        rm -rf "\$tmpdir"
+        mkdir "\$tmpdir" || { rm -rf "\$cachelock"; return; }
+        cached=install
+    fi
+    # Otherwise another launch is populating the cache, so this one
+    # falls back to a private temporary directory.
+}
+
+MS_Cache_Commit()
+{
+    # With a cold layer still to extract, the cache is only marked complete,
+    # and its lock released, once that's done
+    if test x"\$coldlist" = x; then
+        touch "\$tmpdir/.packaged-complete"
+    fi
+    # Anything left at the cache path without a marker is an incomplete extraction
+    rm -rf "\$cachedir"
+    if mv "\$tmpdir" "\$cachedir"; then
+        tmpdir="\$cachedir"
+        test x"\$coldlist" = x && MS_Cache_Release
+    else
+        # Run from the staging directory and clean it up afterwards
+        cached=n
+        rm -rf "\$cachelock"
+    fi
+}
+
+MS_Cache_Release()
+{
+    rm -rf "\$cachelock"
+
+    # Evict older versions of this package, keeping the most recently used ones
+    cachekeep=\${PACKAGED_CACHE_KEEP:-2}
+    ls -dt "\$cacheroot/\$cachename"-*/.packaged-complete 2>/dev/null | tail -n +\`expr \$cachekeep + 1\` | \\
+    while read marker; do
+        rm -rf "\`dirname "\$marker"\`"
+    done
+}
+
+MS_Runtime_Extract()
+{
+    # Extracts the shared runtime layer, the \$1-th archive that is \$3 bytes
+    # long at offset \$2, into the per-user runtime store, unless a package
+    # with the same runtime already did. It is then hardlinked into tmpdir.
+    runtimeroot=\${PACKAGED_RUNTIME_DIR:-\${XDG_CACHE_HOME:-\$HOME/.cache}/packaged/runtimes}
+    runtimedir="\$runtimeroot/\$runtimelayer"
+    if test ! -f "\$runtimedir/.packaged-complete"; then
+        runtimelock="\$runtimeroot/.lock-\$runtimelayer"
+        mkdir -p "\$runtimeroot" 2>/dev/null
+        if ! MS_Lock "\$runtimelock"; then
+            # Another launch is extracting it, so this one uses its own copy
+            MS_Extract \$1 \$2 \$3
+            return \$?
+        fi
+
+        apptmpdir="\$tmpdir"
+        tmpdir="\$runtimeroot/.tmp-\$runtimelayer"
+        rm -rf "\$tmpdir"
+        mkdir "\$tmpdir" && MS_Extract \$1 \$2 \$3
+        runtimeres=\$?
+        if test \$runtimeres -eq 0; then
+            touch "\$tmpdir/.packaged-complete"
+            rm -rf "\$runtimedir"
+            mv "\$tmpdir" "\$runtimedir"
+        fi
+        rm -rf "\$tmpdir" "\$runtimelock"
+        tmpdir="\$apptmpdir"
+        test \$runtimeres -eq 0 || return \$runtimeres
+    fi
+
+    # Refresh the marker, eviction removes runtimes that haven't been used
+    touch "\$runtimedir/.packaged-complete"
+    # Hardlinks only work within a filesystem, the runtime is copied otherwise
+    ( cd "\$runtimedir" && { cp -al . "\$tmpdir" 2>/dev/null || cp -Rp . "\$tmpdir"; } ) || return 1
+    rm -f "\$tmpdir/.packaged-complete"
+
+    # Packages extracted from a runtime keep their hardlinks to its files
+    # when it is removed from the store
+    find "\$runtimeroot"/*/.packaged-complete -mtime +\${PACKAGED_RUNTIME_KEEP_DAYS:-30} 2>/dev/null | \\
+    while read marker; do
+        rm -rf "\`dirname "\$marker"\`"
+    done
+}
+
+MS_Workers()
+{
+    # One extraction worker for each CPU, unless PACKAGED_EXTRACT_WORKERS says
+    # otherwise. Systems without a way to count them extract one at a time.
+    workers=\${PACKAGED_EXTRACT_WORKERS:-\`nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null\`}
+    case "\$workers" in
+    ""|*[!0-9]*)
+        workers=1
+        ;;
+    esac
+    echo \$workers
+}
+
+MS_Extract_Chunks()
+{
+    # Extracts the archives given as index:offset:size into tmpdir. Each one
+    # is compressed on its own, so with more than one worker, they're
+    # decompressed and extracted in parallel.
+    workers=\`MS_Workers\`
+    if test \$# -le 1 || test \$workers -le 1; then
+        for chunk in "\$@"; do
+            MS_Extract \`echo \$chunk | tr : " "\` || return \$?
+        done
+        return 0
+    fi
+
+    chunkres=0
+    chunkpids=
+    for chunk in "\$@"; do
+        # Once every worker is busy, wait for the oldest one
+        if test \`echo \$chunkpids | wc -w\` -ge \$workers; then
+            chunkpid=\`echo \$chunkpids | awk '{ print \$1 }'\`
+            chunkpids=\`echo \$chunkpids | awk '{ \$1 = ""; print }'\`
+            wait \$chunkpid || { pidres=\$?; test \$chunkres -eq 0 && chunkres=\$pidres; }
+        fi
+        ( noprogress=y; quiet=y; MS_Extract \`echo \$chunk | tr : " "\` ) &
+        chunkpids="\$chunkpids \$!"
+    done
+    for chunkpid in \$chunkpids; do
+        wait \$chunkpid || { pidres=\$?; test \$chunkres -eq 0 && chunkres=\$pidres; }
+    done
+    return \$chunkres
+}
+
+MS_Fix_Ownership()
+{
+    if test x"\$ownership" = xy; then
+        (cd "\$tmpdir"; chown -R \`id -u\` .;  chgrp -R \`id -g\` .)
+    fi
+}
+
+MS_Extract_Failed()
+{
+    # Discards the partially extracted files, after extracting failed with \$1
+    if test \$1 -ne 2; then
+        echo >&2
+        echo "Unable to decompress \$0" >&2
+    fi
+    if test x"\$keep" = xn -o x"\$cached" = xinstall; then
+        cd "\$TMPROOT"
+        rm -rf "\$tmpdir"
+        test x"\$cached" = xinstall && rm -rf "\$cachelock"
+    fi
+    eval \$finish; exit \$1
+}
+
+MS_Cold_Extract()
+{
+    # Extracts the cold layer, the files that the script doesn't need right
+    # away, while it runs
+    trap - 1 2 3 15
+    noprogress=y
+    quiet=y
+    MS_Extract_Chunks \$coldlist
+    coldres=\$?
+    if test \$coldres -eq 0; then
+        MS_Fix_Ownership
+        test x"\$cached" != xn && touch "\$tmpdir/.packaged-complete"
+    elif test \$coldres -ne 2; then
+        echo "Unable to decompress \$0" >&2
+    fi
+    # A cache that wasn't marked complete is extracted again by the next launch
+    test x"\$cached" != xn && MS_Cache_Release
+    MS_Trace cold end
+    return \$coldres
+}
+
 MS_exec_cleanup() {
     if test x"\$cleanup" = xy && test x"\$cleanup_script" != x""; then
         cleanup=n
@@ -334,9 +680,11 @@ MS_exec_cleanup() {
 MS_cleanup()
 {
     echo 'Signal caught, cleaning up' >&2
+    test x"\$coldpid" != x && kill \$coldpid 2>/dev/null
     MS_exec_cleanup
     cd "\$TMPROOT"
     rm -rf "\$tmpdir"
+    test x"\$cached" = xinstall && rm -rf "\$cachelock"
     eval \$finish; exit 15
 }
 
@@ -406,6 +754,11 @@ do
 	echo KEEP=$KEEP
 	echo NOOVERWRITE=$NOOVERWRITE
 	echo COMPRESS=$COMPRESS
+	echo COMPRESS_LEVEL=$COMPRESS_LEVEL
+	echo COMPRESS_THREADS=$COMPRESS_THREADS
+	echo RUNTIME_LAYER=\"\$runtimelayer\"
+	echo COLD_LAYER=\$coldlayer
+	echo PAYLOAD_CHUNKS=\$chunks
 	echo filesizes=\"\$filesizes\"
     echo totalsize=\"\$totalsize\"
 	echo CRCsum=\"\$CRCsum\"
@@ -588,7 +941,17 @@ if test x"\$nox11" = xn; then
     fi
 fi
 
-if test x"\$targetdir" = x.; then
+cached=n
+coldlist=
+if test x"\$launch_cache" = xy && test x"\$keep" = xn && test x"\$targetdir" != x.; then
+    MS_Trace "cache lookup" start
+    MS_Cache_Lookup
+    MS_Trace "cache lookup" end
+fi
+
+if test x"\$cached" != xn; then
+    :
+elif test x"\$targetdir" = x.; then
     tmpdir="."
 else
     if test x"\$keep" = xy; then
@@ -614,12 +977,29 @@ else
 fi
 
 location="\`pwd\`"
+if test x"\$cached" = xhit; then
+    SETUP_NOCHECK=1
+fi
+singlepass=n
 if test x"\$SETUP_NOCHECK" != x1; then
-    MS_Check "\$0"
+    # Checksums can only be verified during extraction when the extracted
+    # files can be thrown away if they don't match
+    if test x"\$keep" = xn -o x"\$cached" = xinstall; then
+        if test -d /dev/fd && type tee > /dev/null 2>&1; then
+            singlepass=y
+        fi
+    fi
+    if test x"\$singlepass" = xy; then
+        MS_Check_Size "\$0"
+    else
+        MS_Trace checksum start
+        MS_Check "\$0"
+        MS_Trace checksum end
+    fi
 fi
 offset=\`head -n "\$skip" "\$0" | wc -c | sed "s/ //g"\`
 
-if test x"\$verbose" = xy; then
+if test x"\$verbose" = xy && test x"\$cached" != xhit; then
 	MS_Printf "About to extract $USIZE KB in \$tmpdir ... Proceed ? [Y/n] "
 	read yn
 	if test x"\$yn" = xn; then
@@ -627,7 +1007,7 @@ if test x"\$verbose" = xy; then
 	fi
 fi
 
-if test x"\$quiet" = xn; then
+if test x"\$quiet" = xn && test x"\$cached" != xhit; then
     # Decrypting with openssl will ask for password,
     # the prompt needs to start on new line
 	if test x"$ENCRYPT" = x"openssl"; then
@@ -637,11 +1017,11 @@ if test x"\$quiet" = xn; then
 	fi
 fi
 res=3
-if test x"\$keep" = xn; then
+if test x"\$keep" = xn && test x"\$cached" != xhit; then
     trap MS_cleanup 1 2 3 15
 fi
 
-if test x"\$nodiskspace" = xn; then
+if test x"\$nodiskspace" = xn && test x"\$cached" != xhit; then
     leftspace=\`MS_diskspace "\$tmpdir"\`
     if test -n "\$leftspace"; then
         if test "\$leftspace" -lt $USIZE; then
@@ -656,25 +1036,69 @@ if test x"\$nodiskspace" = xn; then
     fi
 fi
 
-for s in \$filesizes
-do
-    if MS_dd_Progress "\$0" \$offset \$s | MS_Decompress | ( cd "\$tmpdir"; umask \$ORIG_UMASK ; UnTAR xp ) 1>/dev/null; then
-		if test x"\$ownership" = xy; then
-			(cd "\$tmpdir"; chown -R \`id -u\` .;  chgrp -R \`id -g\` .)
-		fi
+if test x"\$cached" != xhit; then
+    # With singlepass, the checksum is verified during extraction
+    MS_Trace extract start
+    # The layers in front of the payload are extracted first, then the chunks
+    # of the payload (its last archive, unless it was written in chunks). With
+    # a cold layer, those are left to extract in the background while the
+    # script runs, unless PACKAGED_FOREGROUND is set.
+    archives=\`echo \$filesizes | wc -w\`
+    firstchunk=\`expr \$archives - \$chunks + 1\`
+    chunklist=
+    i=1
+    for s in \$filesizes
+    do
+        if test \$i -ge \$firstchunk; then
+            chunklist="\$chunklist \$i:\$offset:\$s"
+        elif test \$i -eq 1 && test x"\$runtimelayer" != x; then
+            MS_Trace runtime start
+            MS_Runtime_Extract \$i \$offset \$s
+            extractres=\$?
+            MS_Trace runtime end
+            test \$extractres -eq 0 || MS_Extract_Failed \$extractres
+            MS_Fix_Ownership
+        else
+            MS_Extract \$i \$offset \$s
+            extractres=\$?
+            test \$extractres -eq 0 || MS_Extract_Failed \$extractres
+            MS_Fix_Ownership
+        fi
+        i=\`expr \$i + 1\`
+        offset=\`expr \$offset + \$s\`
+    done
+    if test x"\$coldlayer" = xy && test x"\$script" != x && test x"\$PACKAGED_FOREGROUND" = x; then
+        coldlist="\$chunklist"
     else
-		echo >&2
-		echo "Unable to decompress \$0" >&2
-		eval \$finish; exit 1
+        MS_Extract_Chunks \$chunklist
+        extractres=\$?
+        test \$extractres -eq 0 || MS_Extract_Failed \$extractres
+        MS_Fix_Ownership
     fi
-    offset=\`expr \$offset + \$s\`
-done
-if test x"\$quiet" = xn; then
-	echo
+    MS_Trace extract end
+    if test x"\$quiet" = xn; then
+        echo
+    fi
+fi
+
+if test x"\$cached" = xinstall; then
+    MS_Trace "cache commit" start
+    MS_Cache_Commit
+    MS_Trace "cache commit" end
+fi
+
+coldpid=
+if test x"\$coldlist" != x; then
+    MS_Trace cold start
+    MS_Cold_Extract &
+    coldpid=\$!
+    # The lock is held until the cold layer is extracted
+    test x"\$cached" = xinstall && echo \$coldpid > "\$cachelock/pid"
 fi
 
 cd "\$tmpdir"
 res=0
+MS_Trace launcher end
 if test x"\$script" != x; then
     if test x"\$export_conf" = x"y"; then
         MS_BUNDLE="\$0"
@@ -690,7 +1114,11 @@ if test x"\$script" != x; then
         export MS_ARCHDIRNAME MS_KEEP MS_NOOVERWRITE MS_COMPRESS
     fi
 
-    if test x"\$verbose" = x"y"; then
+    if test x"\$cached" != xn && test x"\$cleanup_script" = x && test x"\$verbose" = xn; then
+		# Nothing is left to clean up for cached extractions, so the
+		# launcher can hand its process over to the script
+		eval "exec \"\$script\" \$scriptargs \"\\\$@\""
+    elif test x"\$verbose" = x"y"; then
 		MS_Printf "OK to execute: \$script \$scriptargs \$* ? [Y/n] "
 		read yn
 		if test x"\$yn" = x -o x"\$yn" = xy -o x"\$yn" = xY; then
@@ -704,9 +1132,13 @@ if test x"\$script" != x; then
     fi
 fi
 
+if test x"\$coldpid" != x; then
+    wait \$coldpid || { test \$res -eq 0 && res=1; }
+fi
+
 MS_exec_cleanup
 
-if test x"\$keep" = xn; then
+if test x"\$keep" = xn && test x"\$cached" = xn; then
     cd "\$TMPROOT"
     rm -rf "\$tmpdir"
 fi
@@ -109,6 +109,25 @@ MS_Usage()
     echo
     echo "    --keep-umask       : Keep the umask set to shell default, rather than overriding when executing self-extracting archive."
     echo "    --export-conf      : Export configuration variables to startup_script"
+    echo "    --launch-cache     : Extract once into a per-user cache directory keyed by the"
+    echo "                         archive checksum, and run from there on later launches"
+    echo "    --runtime-layer hash"
+    echo "                       : The first archive is a runtime shared between packages, that"
+    echo "                         is extracted once into a per-user store named by the hash"
+    echo "    --cold-layer       : The last archive has the files that the startup script doesn't"
+    echo "                         need right away, and is extracted in the background while it runs"
+    echo "    --payload-chunks n : The last n archives are chunks of the payload, that are extracted"
+    echo "                         in parallel"
+    echo "    --header-only      : Only write the header, for a payload that was built separately"
+    echo "                         and is described by the --payload-* options"
+    echo "    --payload-size n   : Size of the compressed payload in bytes, with --header-only."
+    echo "                         For a payload of several archives, this and the checksums"
+    echo "                         are space separated lists, with one value for each archive"
+    echo "    --payload-usize kb : Uncompressed size of the payload in KB, with --header-only"
+    echo "    --payload-crc sum  : CRC of the payload, with --header-only"
+    echo "    --payload-md5 sum  : MD5 of the payload, with --header-only"
+    echo "    --payload-sha256 sum"
+    echo "                       : SHA256 of the payload, with --header-only"
     echo
     echo "Do not forget to give a fully qualified startup script name"
     echo "(i.e. with a ./ prefix if inside the archive)."
@@ -153,6 +172,16 @@ TARGETDIR=""
 NOOVERWRITE=n
 DATE=`LC_ALL=C date`
 EXPORT_CONF=n
+LAUNCH_CACHE=n
+RUNTIME_LAYER=""
+COLD_LAYER=n
+PAYLOAD_CHUNKS=1
+HEADER_ONLY=n
+PAYLOAD_SIZE=0
+PAYLOAD_USIZE=0
+PAYLOAD_CRC=0000000000
+PAYLOAD_MD5=00000000000000000000000000000000
+PAYLOAD_SHA256=0000000000000000000000000000000000000000000000000000000000000000
 SHA256=n
 OWNERSHIP=n
 SIGN=n
@@ -375,6 +404,46 @@ do
     EXPORT_CONF=y
     shift
     ;;
+    --launch-cache)
+    LAUNCH_CACHE=y
+    shift
+    ;;
+    --runtime-layer)
+    RUNTIME_LAYER="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --cold-layer)
+    COLD_LAYER=y
+    shift
+    ;;
+    --payload-chunks)
+    PAYLOAD_CHUNKS="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --header-only)
+    HEADER_ONLY=y
+    shift
+    ;;
+    --payload-size)
+    PAYLOAD_SIZE="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --payload-usize)
+    PAYLOAD_USIZE="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --payload-crc)
+    PAYLOAD_CRC="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --payload-md5)
+    PAYLOAD_MD5="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
+    --payload-sha256)
+    PAYLOAD_SHA256="$2"
+    shift 2 || { MS_Usage; exit 1; }
+    ;;
     -q | --quiet)
 	QUIET=y
 	shift
@@ -457,6 +526,12 @@ if test "$KEEP" = n -a "$CURRENT" = y; then
     exit 1
 fi
 
+# Threads, if any were asked for, for `--dumpconf`
+COMPRESS_THREADS=""
+if test $THREADS -ne $DEFAULT_THREADS; then
+    COMPRESS_THREADS=$THREADS
+fi
+
 case $COMPRESS in
 gzip)
     GZIP_CMD="gzip -c$COMPRESS_LEVEL"
@@ -588,6 +663,22 @@ if test "$APPEND" = n; then
     fi
 fi
 
+if test "$HEADER_ONLY" = y; then
+    # The payload was built separately, so only the header is written for it
+    filesizes="$PAYLOAD_SIZE"
+    totalsize=0
+    for size in $PAYLOAD_SIZE; do
+        totalsize=`expr $totalsize + $size`
+    done
+    USIZE="$PAYLOAD_USIZE"
+    CRCsum="$PAYLOAD_CRC"
+    MD5sum="$PAYLOAD_MD5"
+    SHAsum="$PAYLOAD_SHA256"
+    Signature=""
+    . "$HEADER"
+    exit 0
+fi
+
 USIZE=`du $DU_ARGS "$archdir" | awk '{print $1}'`
 
 if test "." = "$archdirname"; then
@@ -0,0 +1,292 @@
+"""Pruning files that the application doesn't need out of the package."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import glob
+import json
+import os
+import re
+
+# Patterns for each profile, relative to the packaged Python's folder.
+# A `*` matches within a single path segment, and `**` matches any number of
+# segments. When a folder matches, everything inside it is pruned.
+_NO_DEV_PATTERNS = [
+    # Headers, static libraries and build configuration, for building extensions
+    "python/include",
+    "python/lib/*.a",
+    "python/lib/pkgconfig",
+    "python/lib/python3.*/config-3.*",
+    "python/share",
+    "python/bin/python*-config",
+    # Test suites, of the standard library and of installed packages
+    "python/lib/python3.*/test",
+    "python/lib/python3.*/*/test",
+    "python/lib/python3.*/*/tests",
+    "python/lib/python3.*/idlelib/idle_test",
+    "python/lib/python3.*/lib-dynload/_test*",
+    "python/lib/python3.*/lib-dynload/_ctypes_test*",
+    "python/lib/python3.*/lib-dynload/_xx*",
+    "python/lib/python3.*/lib-dynload/xxlimited*",
+    "python/lib/python3.*/site-packages/**/tests",
+    # Packaging tools, which are only needed by the build command
+    "python/lib/python3.*/ensurepip",
+    "python/lib/python3.*/site-packages/pip",
+    "python/lib/python3.*/site-packages/pip-*.dist-info",
+    "python/lib/python3.*/site-packages/setuptools",
+    "python/lib/python3.*/site-packages/setuptools-*.dist-info",
+    "python/lib/python3.*/site-packages/pkg_resources",
+    "python/lib/python3.*/site-packages/_distutils_hack",
+    "python/lib/python3.*/site-packages/distutils-precedence.pth",
+    "python/lib/python3.*/site-packages/wheel",
+    "python/lib/python3.*/site-packages/wheel-*.dist-info",
+    "python/bin/pip*",
+    "python/bin/wheel",
+    # Developer tools
+    "python/bin/2to3*",
+    "python/bin/idle*",
+    "python/bin/pydoc*",
+]
+_NO_GUI_PATTERNS = [
+    "python/lib/python3.*/tkinter",
+    "python/lib/python3.*/idlelib",
+    "python/lib/python3.*/turtle.py",
+    "python/lib/python3.*/turtledemo",
+    "python/lib/python3.*/lib-dynload/_tkinter*",
+    "python/lib/tcl*",
+    "python/lib/tk*",
+    "python/lib/itcl*",
+    "python/lib/thread2*",
+    "python/bin/idle*",
+]
+PRUNE_PROFILES = {
+    "no-dev": _NO_DEV_PATTERNS,
+    "no-gui": _NO_GUI_PATTERNS,
+    "minimal": [
+        *_NO_DEV_PATTERNS,
+        *_NO_GUI_PATTERNS,
+        "python/lib/python3.*/distutils",
+        "python/lib/python3.*/lib2to3",
+        "python/lib/python3.*/pydoc_data",
+        "python/lib/python3.*/venv",
+    ],
+}
+
+
+# Folders that pruning unused files applies to, relative to the packaged
+# Python's folder: the standard library, along with the installed packages
+UNUSED_PRUNE_ROOTS = ["python/lib/python3.*"]
+# Files that are kept even if the app didn't use them, as whether they're used
+# depends on the data the app handles, or they're tiny and read by tools
+ALWAYS_USED_PATTERNS = [
+    "python/lib/python3.*/encodings",
+    "python/lib/python3.*/lib-dynload/_codecs_*",
+    "python/lib/python3.*/site-packages/*.dist-info",
+    "python/lib/python3.*/site-packages/*.pth",
+]
+
+
+class PruneProfileNotFound(Exception):
+    """Raised when the pruning profile asked for does not exist."""
+
+    def __init__(self, profile: str) -> None:
+        super().__init__(profile)
+        self.profile = profile
+
+
+@dataclass
+class PruneReport:
+    """Number of files and bytes removed, by the pattern that removed them."""
+
+    files: dict[str, int] = field(default_factory=dict)
+    bytes: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_files(self) -> int:
+        return sum(self.files.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.bytes.values())
+
+    def add(self, pattern: str, size: int) -> None:
+        self.files[pattern] = self.files.get(pattern, 0) + 1
+        self.bytes[pattern] = self.bytes.get(pattern, 0) + size
+
+
+@dataclass
+class PruneManifest:
+    """
+    The files that pruning unused files removed, with their sizes, and the
+    ones it kept, as paths relative to the package.
+    """
+
+    removed: dict[str, int] = field(default_factory=dict)
+    kept: list[str] = field(default_factory=list)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.removed.values())
+
+    def write(self, manifest_path: str) -> None:
+        """Writes the manifest as JSON, with the paths sorted."""
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(
+                {
+                    "removed": dict(sorted(self.removed.items())),
+                    "kept": sorted(self.kept),
+                },
+                manifest_file,
+                indent=2,
+            )
+
+
+def profile_patterns(profiles: list[str], python_folder: str) -> list[str]:
+    """
+    Returns the patterns of all the given profiles, relative to the package,
+    where `python_folder` is the packaged Python's folder in the package.
+    """
+    patterns: list[str] = []
+    for profile in profiles:
+        if profile not in PRUNE_PROFILES:
+            raise PruneProfileNotFound(profile)
+
+        for pattern in PRUNE_PROFILES[profile]:
+            pattern = f"{python_folder}/{pattern}"
+            if pattern not in patterns:
+                patterns.append(pattern)
+
+    return patterns
+
+
+def compile_pattern(pattern: str) -> re.Pattern[str]:
+    """Turns a pattern into a regex that matches `/` separated relative paths."""
+    segments = pattern.strip("/").split("/")
+    regex = ""
+    for index, segment in enumerate(segments):
+        is_last = index == len(segments) - 1
+        if segment == "**":
+            regex += ".*" if is_last else "(?:[^/]+/)*"
+            continue
+
+        for char in segment:
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            else:
+                regex += re.escape(char)
+        if not is_last:
+            regex += "/"
+
+    return re.compile(regex + r"\Z")
+
+
+def prune_tree(
+    directory: str,
+    exclude: list[str],
+    include: list[str] | None = None,
+) -> PruneReport:
+    """
+    Deletes files in the directory that match an `exclude` pattern, or are
+    inside a folder that does, along with the folders that end up empty.
+    Paths matching an `include` pattern are kept, unless a more deeply nested
+    path matches an `exclude` pattern again.
+    """
+    exclude_regexes = [(pattern, compile_pattern(pattern)) for pattern in exclude]
+    include_regexes = [compile_pattern(pattern) for pattern in include or []]
+    report = PruneReport()
+
+    def prune(path: str, relative_path: str, excluded_by: str | None) -> None:
+        # The directory is changed while going through it, so list it first
+        with os.scandir(path) as iterator:
+            entries = list(iterator)
+
+        for entry in entries:
+            entry_path = (
+                f"{relative_path}/{entry.name}" if relative_path else entry.name
+            )
+            # The most deeply nested match decides whether a path is pruned
+            entry_excluded_by = excluded_by
+            if any(regex.match(entry_path) for regex in include_regexes):
+                entry_excluded_by = None
+            else:
+                for pattern, regex in exclude_regexes:
+                    if regex.match(entry_path):
+                        entry_excluded_by = pattern
+                        break
+
+            if entry.is_dir(follow_symlinks=False):
+                prune(entry.path, entry_path, entry_excluded_by)
+                if entry_excluded_by is not None and not os.listdir(entry.path):
+                    os.rmdir(entry.path)
+
+            elif entry_excluded_by is not None:
+                size = entry.stat(follow_symlinks=False).st_size
+                os.unlink(entry.path)
+                report.add(entry_excluded_by, size)
+
+    prune(directory, "", None)
+    return report
+
+
+def _module_key(relative_path: str) -> str | None:
+    """
+    Returns the module that a `.py` or `.pyc` file is the source or bytecode
+    of, as its path without the extension, or None for other files.
+    """
+    folder, name = os.path.split(relative_path)
+    if not name.endswith((".py", ".pyc")):
+        return None
+    if os.path.basename(folder) == "__pycache__":
+        # Like `__pycache__/json.cpython-312.pyc`
+        return os.path.join(os.path.dirname(folder), name.split(".")[0])
+    return os.path.join(folder, name.rsplit(".", 1)[0])
+
+
+def prune_unused(
+    directory: str,
+    roots: list[str],
+    used: set[str],
+    include: list[str] | None = None,
+) -> PruneManifest:
+    """
+    Deletes the files in the folders matching the `roots` patterns that aren't
+    in `used`, other than ones matching an `include` pattern or inside a
+    folder that does, along with the folders that end up empty. All paths are
+    relative to the directory. Modules are kept as both source and bytecode if
+    either one was used.
+    """
+    include_regexes = [compile_pattern(pattern) for pattern in include or []]
+    used_modules = {_module_key(path) for path in used} - {None}
+    manifest = PruneManifest()
+
+    def is_included(relative_path: str) -> bool:
+        parts = relative_path.split(os.sep)
+        return any(
+            regex.match("/".join(parts[:length]))
+            for length in range(1, len(parts) + 1)
+            for regex in include_regexes
+        )
+
+    for root in roots:
+        for root_path in glob.glob(os.path.join(directory, root)):
+            for folder, _, filenames in os.walk(root_path, topdown=False):
+                for filename in filenames:
+                    file_path = os.path.join(folder, filename)
+                    relative_path = os.path.relpath(file_path, directory)
+                    if (
+                        relative_path in used
+                        or _module_key(relative_path) in used_modules
+                        or is_included(relative_path)
+                    ):
+                        manifest.kept.append(relative_path)
+                        continue
+
+                    manifest.removed[relative_path] = os.lstat(file_path).st_size
+                    os.unlink(file_path)
+
+                if folder != root_path and not os.listdir(folder):
+                    os.rmdir(folder)
+
+    return manifest
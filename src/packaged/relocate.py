@@ -0,0 +1,219 @@
+"""Rewriting the absolute build paths that installers embed into files."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from dataclasses import dataclass, field
+import os
+import re
+import shutil
+import tempfile
+from typing import IO, Iterator
+
+# Files are scanned in chunks, so that large files aren't read into memory
+CHUNK_SIZE = 1024 * 1024
+
+ENV_PYTHON_SHEBANG = b"#!/usr/bin/env python\n"
+
+# Files that list paths relative to their own folder. The build paths in them
+# are made relative to it.
+RELATIVE_PATH_SUFFIXES = (".pth", ".egg-link")
+RELATIVE_PATH_FILE_NAMES = ("installed-files.txt",)
+# Install records list paths relative to the folder that the package was
+# installed into, which is the parent of their own folder
+INSTALL_RECORD_FILE_NAME = "RECORD"
+
+# Where a package was installed from, which is meaningless once it's packaged
+DIRECT_URL_FILE_NAME = "direct_url.json"
+
+# Python replaces the source path compiled into bytecode with the path it's
+# loaded from, so the build paths in `.pyc` files are harmless
+IGNORED_SUFFIXES = (".pyc",)
+
+# Characters that end a path embedded in a file
+_PATH_COMPONENT = rb"[^/\s\0'\",;:]+"
+
+
+@dataclass
+class RelocationReport:
+    """
+    Number of files scanned, the files that were changed (relative to the
+    package directory) along with what was done to them, and the files that
+    still contain a build path, as they couldn't be rewritten.
+    """
+
+    scanned: int = 0
+    changed: dict[str, str] = field(default_factory=dict)
+    unrelocated: list[str] = field(default_factory=list)
+
+
+def _contains(file_path: str, marker: bytes) -> bool:
+    """
+    Checks if the file contains `marker`, reading it a chunk at a time. Each
+    chunk is searched along with the end of the one before it, in case the
+    marker is split between them.
+    """
+    overlap = len(marker) - 1
+    tail = b""
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            window = tail + chunk
+            if marker in window:
+                return True
+            tail = window[-overlap:] if overlap else b""
+
+    return False
+
+
+@contextlib.contextmanager
+def _replace(file_path: str) -> Iterator[IO[bytes]]:
+    """
+    Yields a new file that replaces `file_path` once the block is done, with
+    the same permissions. Replacing rather than writing to the file breaks any
+    hardlinks to it, like ones to yen's copy of Python.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        prefix=".relocate-", dir=os.path.dirname(file_path)
+    )
+    try:
+        with os.fdopen(fd, "wb") as new_file:
+            yield new_file
+        shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _rewrite_shebang(file_path: str, pattern: re.Pattern[bytes]) -> bool:
+    """
+    Replaces a shebang to the build's Python with `/usr/bin/env python`.
+    Returns false for files that aren't scripts, or run some other program.
+    """
+    with open(file_path, "rb") as file:
+        shebang = file.readline()
+        if not shebang.startswith(b"#!"):
+            return False
+
+        # Case 1: shebang points to packaged python
+        # File looks like this:
+        # #!/path/to/.packaged_python/python/bin/python3.12
+        # ... rest of python code
+        if pattern.search(shebang):
+            with _replace(file_path) as new_file:
+                new_file.write(ENV_PYTHON_SHEBANG)
+                shutil.copyfileobj(file, new_file)
+            return True
+
+        # Case 2: shebang is /bin/sh, but the script is an `exec`
+        # with the shebang to packaged python. Shebangs are length limited, so
+        # installers do this for long paths.
+        # File looks like this:
+        # #!/bin/sh
+        # '''exec' /path/to/.packaged_python/python/bin/python3.12 "$0" "$@"
+        # ' '''
+        # ... rest of python code
+        exec_line = file.readline()
+        if not exec_line.startswith(b"'''exec' ") or not pattern.search(exec_line):
+            return False
+        if file.readline() != b"' '''\n":
+            return False
+
+        # The first three lines aren't needed with a `env python` shebang
+        with _replace(file_path) as new_file:
+            new_file.write(ENV_PYTHON_SHEBANG)
+            shutil.copyfileobj(file, new_file)
+        return True
+
+
+def _rewrite_relative(
+    file_path: str,
+    pattern: re.Pattern[bytes],
+    package_directory: str,
+    base_folder: str,
+) -> None:
+    """Replaces the build paths in the file with paths relative to `base_folder`."""
+    relative_path = os.path.relpath(package_directory, base_folder)
+    replacement = relative_path.encode()
+    with open(file_path, "rb") as file, _replace(file_path) as new_file:
+        for line in file:
+            new_file.write(pattern.sub(lambda _: replacement, line))
+
+
+def _relocate_file(
+    file_path: str,
+    package_directory: str,
+    marker: bytes,
+    pattern: re.Pattern[bytes],
+) -> tuple[str | None, bool]:
+    """
+    Rewrites the build paths in a file, if it has any. Returns what was done to
+    the file, if anything, and whether it still contains a build path.
+    """
+    filename = os.path.basename(file_path)
+    if filename.endswith(IGNORED_SUFFIXES) or not _contains(file_path, marker):
+        return None, False
+
+    if filename == DIRECT_URL_FILE_NAME:
+        os.remove(file_path)
+        return "removed", False
+
+    folder = os.path.dirname(file_path)
+    has_relative_paths = filename in RELATIVE_PATH_FILE_NAMES
+    if filename == INSTALL_RECORD_FILE_NAME:
+        _rewrite_relative(
+            file_path, pattern, package_directory, os.path.dirname(folder)
+        )
+        return "relative paths", _contains(file_path, marker)
+
+    if has_relative_paths or filename.endswith(RELATIVE_PATH_SUFFIXES):
+        _rewrite_relative(file_path, pattern, package_directory, folder)
+        return "relative paths", _contains(file_path, marker)
+
+    if _rewrite_shebang(file_path, pattern):
+        return "shebang", _contains(file_path, marker)
+
+    return None, True
+
+
+def relocate_tree(
+    package_directory: str, build_root: str, jobs: int | None = None
+) -> RelocationReport:
+    """
+    Finds the files in the package that contain the path of a package
+    directory inside `build_root`, either this build's, or that of an earlier
+    build restored from the build cache. Files are scanned in parallel.
+
+    Scripts get a `/usr/bin/env python` shebang, `.pth` files and install
+    records get relative paths, and `direct_url.json` files are removed, as
+    the folder that the package was installed from won't exist at runtime.
+    Files are only changed if they contain a build path, and are replaced
+    rather than changed in place.
+    """
+    marker = os.path.join(build_root, "").encode()
+    pattern = re.compile(re.escape(marker) + _PATH_COMPONENT + b"/" + _PATH_COMPONENT)
+
+    file_paths = []
+    for root, _, filenames in os.walk(package_directory):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            if not os.path.islink(file_path) and os.path.isfile(file_path):
+                file_paths.append(file_path)
+
+    report = RelocationReport(scanned=len(file_paths))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            lambda file_path: _relocate_file(
+                file_path, package_directory, marker, pattern
+            ),
+            file_paths,
+        )
+        for file_path, (action, unrelocated) in zip(file_paths, results):
+            relative_path = os.path.relpath(file_path, package_directory)
+            if action is not None:
+                report.changed[relative_path] = action
+            if unrelocated:
+                report.unrelocated.append(relative_path)
+
+    return report
@@ -0,0 +1,133 @@
+"""Staging directories that packages are assembled in, outside the source tree."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+import shutil
+import sys
+import tempfile
+from typing import Callable
+
+if sys.platform == "linux":
+    import fcntl
+
+# Staging directories are kept in the user's cache rather than in `/tmp`, as it
+# is more likely to be on the same filesystem as the Pythons that yen installs,
+# which is needed for hardlinks.
+STAGING_PATH = os.path.abspath(
+    os.getenv(
+        "PACKAGED_STAGING_DIR",
+        os.path.join(
+            os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "packaged",
+            "staging",
+        ),
+    )
+)
+
+# `ioctl` request that clones a file's contents as copy-on-write, on Linux
+# filesystems that support it (like btrfs and XFS)
+FICLONE = 0x40049409
+
+
+@dataclass
+class PopulateStats:
+    """Number of files that were reflinked, hardlinked and copied."""
+
+    reflinked: int = 0
+    hardlinked: int = 0
+    copied: int = 0
+
+
+def create_staging_directory() -> str:
+    """Creates a new, empty staging directory."""
+    os.makedirs(STAGING_PATH, exist_ok=True)
+    return tempfile.mkdtemp(prefix="build-", dir=STAGING_PATH)
+
+
+def is_unmodified_by_builds(relative_path: str) -> bool:
+    """
+    Returns true for files in a Python install that build commands don't change.
+    That's everything other than the scripts in `bin`, and installed packages.
+    """
+    parts = relative_path.split(os.sep)
+    return "bin" not in parts and "site-packages" not in parts
+
+
+def _reflink(source_path: str, destination_path: str) -> None:
+    with open(source_path, "rb") as source, open(destination_path, "wb") as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+
+    shutil.copystat(source_path, destination_path)
+
+
+def populate_tree(
+    source: str,
+    destination: str,
+    can_hardlink: Callable[[str], bool] | None = None,
+) -> PopulateStats:
+    """
+    Recreates the `source` directory tree at `destination`. Files are cloned as
+    copy-on-write reflinks where the filesystem supports it, hardlinked where
+    `can_hardlink` returns true for their path relative to `source`, and only
+    copied if neither of those works.
+
+    Hardlinked files share their contents with `source`, so they must be
+    replaced rather than changed in place.
+    """
+    stats = PopulateStats()
+    use_reflinks = sys.platform == "linux"
+    use_hardlinks = True
+
+    directories = []
+    for root, dirnames, filenames in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        destination_root = os.path.normpath(os.path.join(destination, relative_root))
+        os.makedirs(destination_root, exist_ok=True)
+        directories.append((root, destination_root))
+
+        # `os.walk` doesn't follow symlinks to directories, but lists them
+        for name in [*dirnames, *filenames]:
+            source_path = os.path.join(root, name)
+            if os.path.islink(source_path):
+                destination_path = os.path.join(destination_root, name)
+                os.symlink(os.readlink(source_path), destination_path)
+
+        for filename in filenames:
+            source_path = os.path.join(root, filename)
+            if os.path.islink(source_path):
+                continue
+
+            destination_path = os.path.join(destination_root, filename)
+            relative_path = os.path.normpath(os.path.join(relative_root, filename))
+            if (
+                can_hardlink is not None
+                and use_hardlinks
+                and can_hardlink(relative_path)
+            ):
+                try:
+                    os.link(source_path, destination_path)
+                    stats.hardlinked += 1
+                    continue
+                except OSError:
+                    # Most likely a different filesystem
+                    use_hardlinks = False
+
+            if use_reflinks:
+                try:
+                    _reflink(source_path, destination_path)
+                    stats.reflinked += 1
+                    continue
+                except OSError:
+                    # The filesystem doesn't support reflinks
+                    use_reflinks = False
+
+            shutil.copy2(source_path, destination_path)
+            stats.copied += 1
+
+    # Directory permissions are copied last, in case they are read-only
+    for source_root, destination_root in reversed(directories):
+        shutil.copystat(source_root, destination_root)
+
+    return stats
@@ -0,0 +1,163 @@
+"""Packing the packaged Python's pure Python modules into a single zip file."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import glob
+import os
+import zipfile
+
+from packaged.bytecode import compile_bytecode
+
+# Standard library packages that read data files next to their modules, or are
+# only used for development, which are left out of the zip file.
+LOOSE_STDLIB_PACKAGES = {
+    "ensurepip",
+    "idlelib",
+    "lib2to3",
+    "pydoc_data",
+    "test",
+    "turtledemo",
+    "venv",
+}
+# Python finds its standard library by looking for this file, so it stays loose.
+STDLIB_LANDMARK = "os.py"
+# Files other than modules that don't stop a package from being zipped
+IGNORED_PACKAGE_FILES = ("py.typed", ".pyi")
+
+
+@dataclass
+class ZipStats:
+    """Number of modules zipped, and of files in the Python before and after."""
+
+    zip_path: str
+    modules: int
+    files_before: int
+    files_after: int
+
+
+def _count_files(directory: str) -> int:
+    return sum(len(filenames) for _, _, filenames in os.walk(directory))
+
+
+def _is_pure_package(directory: str) -> bool:
+    """Returns true if the package folder contains nothing but Python modules."""
+    for root, dirnames, filenames in os.walk(directory):
+        if "__pycache__" in dirnames:
+            dirnames.remove("__pycache__")
+        for filename in filenames:
+            if not filename.endswith((".py", *IGNORED_PACKAGE_FILES)):
+                return False
+
+    return True
+
+
+def _remove_cached_bytecode(module_path: str) -> None:
+    """Removes the module's `.pyc` files from `__pycache__`, which are unused."""
+    pycache_path = os.path.join(os.path.dirname(module_path), "__pycache__")
+    if not os.path.isdir(pycache_path):
+        return
+
+    module_name = os.path.basename(module_path)[: -len(".py")]
+    for filename in os.listdir(pycache_path):
+        if filename.split(".")[0] == module_name:
+            os.remove(os.path.join(pycache_path, filename))
+
+
+def find_stdlib_modules(stdlib_path: str) -> list[str]:
+    """Returns the paths of the standard library modules that can be zipped."""
+    paths = []
+    for name in sorted(os.listdir(stdlib_path)):
+        path = os.path.join(stdlib_path, name)
+        if os.path.isdir(path):
+            if name not in LOOSE_STDLIB_PACKAGES and os.path.isfile(
+                os.path.join(path, "__init__.py")
+            ):
+                paths.append(path)
+        elif name.endswith(".py") and name != STDLIB_LANDMARK:
+            paths.append(path)
+
+    return paths
+
+
+def find_pure_packages(site_packages_path: str) -> list[str]:
+    """Returns the paths of the installed modules with no native or data files."""
+    paths = []
+    for name in sorted(os.listdir(site_packages_path)):
+        path = os.path.join(site_packages_path, name)
+        if os.path.isdir(path):
+            if os.path.isfile(os.path.join(path, "__init__.py")) and _is_pure_package(
+                path
+            ):
+                paths.append(path)
+        elif name.endswith(".py"):
+            paths.append(path)
+
+    return paths
+
+
+def zip_modules(
+    python_path: str,
+    stdlib: bool = True,
+    site_packages: bool = False,
+) -> ZipStats:
+    """
+    Compiles the pure Python modules of the standard library, and optionally the
+    installed packages, and moves them into the `pythonXY.zip` file that is on
+    the interpreter's default `sys.path`. Native extension modules, and packages
+    with data files, are left in place.
+    """
+    prefix = os.path.dirname(os.path.dirname(python_path))
+    [stdlib_path] = [
+        path
+        for path in glob.glob(os.path.join(prefix, "lib", "python3.*"))
+        if os.path.isdir(path)
+    ]
+    version = os.path.basename(stdlib_path).replace(".", "")
+    zip_path = os.path.join(prefix, "lib", f"{version}.zip")
+    site_packages_path = os.path.join(stdlib_path, "site-packages")
+
+    files_before = _count_files(prefix)
+    roots = []
+    if stdlib:
+        roots.append((stdlib_path, find_stdlib_modules(stdlib_path)))
+    if site_packages and os.path.isdir(site_packages_path):
+        roots.append((site_packages_path, find_pure_packages(site_packages_path)))
+
+    compile_bytecode(
+        python_path,
+        [path for _, paths in roots for path in paths],
+        keep_sources=False,
+    )
+
+    modules = 0
+    # The zip file is stored uncompressed, as the package is compressed anyway
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zip_file:
+        for root, paths in roots:
+            for path in paths:
+                pyc_paths = []
+                if path.endswith(".py"):
+                    pyc_paths.append(path + "c")
+                    _remove_cached_bytecode(path)
+                else:
+                    for directory, _, filenames in os.walk(path):
+                        pyc_paths += [
+                            os.path.join(directory, filename)
+                            for filename in filenames
+                            if filename.endswith(".pyc")
+                        ]
+
+                # Modules that failed to compile are left as they were
+                for pyc_path in sorted(pyc_paths):
+                    if not os.path.isfile(pyc_path):
+                        continue
+
+                    zip_file.write(pyc_path, os.path.relpath(pyc_path, root))
+                    os.remove(pyc_path)
+                    modules += 1
+
+                for directory, _, _ in sorted(os.walk(path), reverse=True):
+                    if not os.listdir(directory):
+                        os.rmdir(directory)
+
+    return ZipStats(zip_path, modules, files_before, _count_files(prefix))
@@ -0,0 +1,228 @@
+"""Removing debug symbols from the native libraries and executables in a package."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+
+ELF_MAGIC = b"\x7fELF"
+# ELF executables and shared libraries, rather than object files
+ELF_TYPES = (2, 3)
+# Linux kernel modules, and some other ELF files, have a signature appended
+ELF_SIGNATURE_MARKER = b"~Module signature appended~\n"
+
+MACHO_MAGICS = {
+    b"\xfe\xed\xfa\xce": ">",
+    b"\xfe\xed\xfa\xcf": ">",
+    b"\xce\xfa\xed\xfe": "<",
+    b"\xcf\xfa\xed\xfe": "<",
+}
+MACHO_FAT_MAGIC = b"\xca\xfe\xba\xbe"
+# Executables, dynamic libraries and bundles, which is what extension modules are
+MACHO_TYPES = (2, 6, 8)
+LC_CODE_SIGNATURE = 0x1D
+# Java class files start with the same magic as fat Mach-O files, followed by
+# their version, which is at least 45
+MAX_FAT_ARCHES = 44
+
+
+class StripNotAvailable(Exception):
+    """Raised when neither `strip` nor `objcopy` is installed on the system."""
+
+
+@dataclass
+class StripReport:
+    """
+    Number of files stripped and the bytes saved, keyed by the installed
+    package they belong to (or the top level folder, for other files), and the
+    files that were left as they were because they're signed, or because
+    stripping them failed.
+    """
+
+    files: dict[str, int] = field(default_factory=dict)
+    bytes: dict[str, int] = field(default_factory=dict)
+    signed: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+
+    @property
+    def total_files(self) -> int:
+        return sum(self.files.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.bytes.values())
+
+
+def strip_command() -> list[str]:
+    """
+    Returns the command that strips debug symbols from a binary. Commands
+    ending in `-o` take the output path before the input path, others take
+    the input path first.
+    """
+    if sys.platform == "darwin":
+        if shutil.which("strip") is not None:
+            return ["strip", "-S", "-o"]
+    elif shutil.which("strip") is not None:
+        return ["strip", "--strip-debug", "-o"]
+    elif shutil.which("objcopy") is not None:
+        return ["objcopy", "--strip-debug"]
+
+    raise StripNotAvailable
+
+
+def _macho_is_signed(file_path: str) -> bool | None:
+    """
+    Returns whether the Mach-O binary has a code signature, in any of its
+    architectures, or None if it isn't a Mach-O executable or library.
+    """
+    with open(file_path, "rb") as file:
+        magic = file.read(4)
+        if magic == MACHO_FAT_MAGIC:
+            (arch_count,) = struct.unpack(">I", file.read(4))
+            if arch_count > MAX_FAT_ARCHES:
+                return None
+            offsets = [
+                struct.unpack(">iiIII", file.read(20))[2] for _ in range(arch_count)
+            ]
+        elif magic in MACHO_MAGICS:
+            offsets = [0]
+        else:
+            return None
+
+        is_binary = False
+        for offset in offsets:
+            file.seek(offset)
+            magic = file.read(4)
+            if magic not in MACHO_MAGICS:
+                return None
+            byte_order = MACHO_MAGICS[magic]
+            _, _, file_type, command_count, _, _ = struct.unpack(
+                byte_order + "iiIIII", file.read(24)
+            )
+            if file_type not in MACHO_TYPES:
+                return None
+            is_binary = True
+
+            # The 64 bit header has 4 more bytes of padding
+            if magic in (b"\xfe\xed\xfa\xcf", b"\xcf\xfa\xed\xfe"):
+                file.read(4)
+            for _ in range(command_count):
+                command, command_size = struct.unpack(byte_order + "II", file.read(8))
+                if command == LC_CODE_SIGNATURE:
+                    return True
+                file.seek(command_size - 8, os.SEEK_CUR)
+
+    return False if is_binary else None
+
+
+def _elf_is_signed(file_path: str) -> bool | None:
+    """
+    Returns whether the ELF binary has a signature appended, or None if it
+    isn't an ELF executable or library.
+    """
+    with open(file_path, "rb") as file:
+        header = file.read(18)
+        if len(header) < 18 or header[:4] != ELF_MAGIC:
+            return None
+        byte_order = "<" if header[5] == 1 else ">"
+        (file_type,) = struct.unpack(byte_order + "H", header[16:18])
+        if file_type not in ELF_TYPES:
+            return None
+
+        file.seek(0, os.SEEK_END)
+        if file.tell() < len(ELF_SIGNATURE_MARKER):
+            return False
+        file.seek(-len(ELF_SIGNATURE_MARKER), os.SEEK_END)
+        return file.read() == ELF_SIGNATURE_MARKER
+
+
+def _strip_file(file_path: str, command: list[str]) -> tuple[str, int]:
+    """
+    Strips the file into a new file that replaces it, if it's smaller. Returns
+    what was done to it ("stripped", "signed", "failed", or "" if it isn't a
+    binary or had nothing to strip), and the bytes saved.
+    """
+    try:
+        is_signed = _macho_is_signed(file_path)
+        if is_signed is None:
+            is_signed = _elf_is_signed(file_path)
+    except (OSError, struct.error):
+        return "", 0
+    if is_signed is None:
+        return "", 0
+    if is_signed:
+        return "signed", 0
+
+    fd, temp_path = tempfile.mkstemp(prefix=".strip-", dir=os.path.dirname(file_path))
+    os.close(fd)
+    try:
+        if command[-1] == "-o":
+            arguments = [*command, temp_path, file_path]
+        else:
+            arguments = [*command, file_path, temp_path]
+        result = subprocess.run(arguments, capture_output=True)
+        if result.returncode != 0:
+            return "failed", 0
+
+        saved = os.path.getsize(file_path) - os.path.getsize(temp_path)
+        if saved <= 0:
+            return "", 0
+
+        # Replacing the file rather than stripping it in place leaves the files
+        # it's hardlinked to, like yen's copy of Python, as they are
+        shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+        return "stripped", saved
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _group(relative_path: str) -> str:
+    """Returns the installed package that the file belongs to, if any."""
+    parts = relative_path.split(os.sep)
+    if "site-packages" in parts[:-1]:
+        return parts[parts.index("site-packages") + 1]
+    return parts[0]
+
+
+def strip_tree(
+    directory: str, command: list[str] | None = None, jobs: int | None = None
+) -> StripReport:
+    """
+    Strips the debug symbols from every ELF or Mach-O executable and library in
+    the directory, in parallel. Signed binaries are left as they are, since
+    stripping them would invalidate their signature.
+    """
+    strip = command if command is not None else strip_command()
+
+    file_paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            if not os.path.islink(file_path) and os.path.isfile(file_path):
+                file_paths.append(file_path)
+
+    report = StripReport()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            lambda file_path: _strip_file(file_path, strip), file_paths
+        )
+        for file_path, (action, saved) in zip(file_paths, results):
+            relative_path = os.path.relpath(file_path, directory)
+            if action == "stripped":
+                group = _group(relative_path)
+                report.files[group] = report.files.get(group, 0) + 1
+                report.bytes[group] = report.bytes.get(group, 0) + saved
+            elif action == "signed":
+                report.signed.append(relative_path)
+            elif action == "failed":
+                report.failed.append(relative_path)
+
+    return report
@@ -0,0 +1,159 @@
+"""Timing each phase of a build, for finding out where the build time goes."""
+
+from __future__ import annotations
+
+import contextlib
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator
+
+from packaged.utils import format_size
+
+
+@dataclass
+class Span:
+    """
+    A phase of the build, with its start time relative to the start of the
+    trace, its duration (both in seconds), and details like file counts.
+    """
+
+    name: str
+    start: float
+    duration: float
+    thread_name: str
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+class Tracer:
+    """
+    Records timed spans for the phases of builds. It can be shared by builds
+    running at the same time, in different threads.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[dict[str, Any]]:
+        """
+        Times the code inside the `with` block. The details can be added to
+        the dictionary it returns, like `details["files"] = 10`.
+        """
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            duration = time.perf_counter() - start
+            span = Span(
+                name,
+                start - self._start,
+                duration,
+                threading.current_thread().name,
+                args,
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def elapsed(self) -> float:
+        """Returns the time since the trace started, in seconds."""
+        return time.perf_counter() - self._start
+
+    def durations(self, thread_name: str, since: float = 0.0) -> dict[str, float]:
+        """
+        Returns the total time in seconds that the thread spent in each phase,
+        out of the spans that started `since` seconds into the trace or later.
+        """
+        durations: dict[str, float] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in sorted(spans, key=lambda span: span.start):
+            if span.thread_name == thread_name and span.start >= since:
+                durations[span.name] = durations.get(span.name, 0.0) + span.duration
+
+        return durations
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """
+        Returns the spans in the Chrome trace event format, which can be opened
+        in Perfetto, speedscope or `chrome://tracing`.
+        """
+        thread_ids: dict[str, int] = {}
+        events: list[dict[str, Any]] = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            if span.thread_name not in thread_ids:
+                thread_ids[span.thread_name] = len(thread_ids) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread_ids[span.thread_name],
+                        "args": {"name": span.thread_name},
+                    }
+                )
+
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "build",
+                    "ph": "X",
+                    # Timestamps are in microseconds
+                    "ts": round(span.start * 1_000_000),
+                    "dur": round(span.duration * 1_000_000),
+                    "pid": os.getpid(),
+                    "tid": thread_ids[span.thread_name],
+                    "args": span.args,
+                }
+            )
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, trace_path: str) -> None:
+        """Writes the Chrome trace to the file."""
+        with open(trace_path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file, default=str)
+
+    def summary(self) -> str:
+        """
+        Returns a table of the total time spent in each phase, in the order the
+        phases first started, with their details added up. The total is the
+        time from the start of the first phase to the end of the last one.
+        """
+        phases: dict[str, tuple[float, dict[str, Any]]] = {}
+        for span in sorted(self.spans, key=lambda span: span.start):
+            duration, details = phases.get(span.name, (0.0, {}))
+            for key, value in span.args.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    details[key] = details.get(key, 0) + value
+                else:
+                    details[key] = value
+            phases[span.name] = (duration + span.duration, details)
+
+        name_width = max([len("Phase"), *(len(name) for name in phases)])
+        lines = [f"{'Phase':<{name_width}}  {'Time':>8}  Details"]
+        for name, (duration, details) in phases.items():
+            details_text = ", ".join(
+                f"{key}={_format_detail(key, value)}" for key, value in details.items()
+            )
+            line = f"{name:<{name_width}}  {duration:>7.2f}s  {details_text}"
+            lines.append(line.rstrip())
+
+        if self.spans:
+            start = min(span.start for span in self.spans)
+            end = max(span.start + span.duration for span in self.spans)
+            lines.append(f"{'Total':<{name_width}}  {end - start:>7.2f}s")
+
+        return "\n".join(lines)
+
+
+def _format_detail(key: str, value: Any) -> str:
+    if key.endswith("bytes") and isinstance(value, int):
+        return format_size(value)
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
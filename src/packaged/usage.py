@@ -0,0 +1,136 @@
+"""Recording which files of the packaged Python an application actually uses."""
+
+from __future__ import annotations
+
+import glob
+import os
+import subprocess
+import tempfile
+
+from packaged.build_log import BuildLog, run_command
+
+# Seconds that each command runs for before it's stopped, for applications
+# like servers and GUIs that don't exit on their own
+DEFAULT_USAGE_TIMEOUT = 60
+USAGE_ENV_VAR = "PACKAGED_USAGE"
+
+# Put on the `PYTHONPATH` of the commands as `sitecustomize.py`, which Python
+# imports at startup. Every file that Python opens, including the modules it
+# imports, is appended to a file of its own for each process as it's opened,
+# along with the time it was first used, and the files of extension modules and
+# the libraries they load are added at exit. Being terminated runs the exit
+# handlers too.
+_SITECUSTOMIZE = """\
+import atexit
+import os
+import signal
+import sys
+import time
+
+
+def _packaged_record_usage():
+    recorded = set()
+    usage_file = open(
+        os.environ["{env_var}"] + "." + str(os.getpid()), "a", encoding="utf-8"
+    )
+
+    def record(path):
+        if path not in recorded:
+            recorded.add(path)
+            usage_file.write(str(time.monotonic_ns()) + " " + path + "\\n")
+            usage_file.flush()
+
+    def audit_hook(event, args):
+        if event == "open" and isinstance(args[0], str):
+            record(os.path.abspath(args[0]))
+
+    def record_loaded():
+        for module in list(sys.modules.values()):
+            module_file = getattr(module, "__file__", None)
+            if isinstance(module_file, str):
+                record(os.path.abspath(module_file))
+        # Shared libraries are mapped into memory, rather than opened
+        try:
+            with open("/proc/self/maps") as maps:
+                for line in maps:
+                    fields = line.split(maxsplit=5)
+                    if len(fields) == 6 and fields[5].startswith("/"):
+                        record(fields[5].rstrip("\\n"))
+        except OSError:
+            pass
+
+    sys.addaudithook(audit_hook)
+    atexit.register(record_loaded)
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+
+
+_packaged_record_usage()
+del _packaged_record_usage
+"""
+
+
+def record_usage(
+    directory: str,
+    commands: list[str],
+    python_bin_folder: str,
+    log: BuildLog,
+    timeout: float = DEFAULT_USAGE_TIMEOUT,
+) -> list[str]:
+    """
+    Runs the commands in the directory, with the packaged Python first on the
+    PATH, and returns the paths of every file that Python used while running
+    them, relative to the directory, in the order they were first used. Files
+    outside of it are left out.
+
+    A command that's still running after `timeout` seconds is stopped, and
+    what it used until then is recorded. One that fails raises
+    `CalledProcessError`.
+    """
+    used: list[tuple[int, str]] = []
+    with tempfile.TemporaryDirectory() as hook_directory:
+        with open(os.path.join(hook_directory, "sitecustomize.py"), "w") as file:
+            file.write(_SITECUSTOMIZE.replace("{env_var}", USAGE_ENV_VAR))
+
+        usage_prefix = os.path.join(hook_directory, "usage")
+        for command in commands:
+            try:
+                run_command(
+                    [command],
+                    log,
+                    timeout=timeout,
+                    shell=True,
+                    cwd=directory,
+                    stdin=subprocess.DEVNULL,
+                    env={
+                        **os.environ,
+                        "PATH": os.pathsep.join(
+                            [python_bin_folder, os.environ.get("PATH", "")]
+                        ),
+                        "PYTHONPATH": hook_directory,
+                        "PYTHONDONTWRITEBYTECODE": "1",
+                        USAGE_ENV_VAR: usage_prefix,
+                    },
+                )
+            except subprocess.TimeoutExpired:
+                pass
+
+        for usage_path in glob.glob(f"{usage_prefix}.*"):
+            with open(usage_path, encoding="utf-8") as usage_file:
+                for line in usage_file:
+                    time_ns, path = line.rstrip("\n").split(" ", 1)
+                    used.append((int(time_ns), path))
+
+    # The directory might be reached through a symlink, which opened paths
+    # keep, while mapped libraries are resolved. Files that Python tried to
+    # open but didn't exist, like bytecode that wasn't cached, are left out.
+    # The monotonic clock is shared by every process, so the files used by
+    # all of them are ordered by when they were used.
+    bases = {os.path.abspath(directory), os.path.realpath(directory)}
+    relative_paths: dict[str, None] = {}
+    for _, path in sorted(used):
+        for base in bases:
+            if path.startswith(base + os.sep) and os.path.lexists(path):
+                relative_paths.setdefault(os.path.relpath(path, base))
+
+    return list(relative_paths)
@@ -0,0 +1,16 @@
+"""Helpers shared across packaged's modules."""
+
+from __future__ import annotations
+
+
+def format_size(size: int) -> str:
+    """Formats a size in bytes for humans, like `12.3 MB`."""
+    value = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024 or unit == "GB":
+            break
+        value /= 1024
+
+    if unit == "B":
+        return f"{size} B"
+    return f"{value:.1f} {unit}"
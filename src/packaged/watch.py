@@ -0,0 +1,89 @@
+"""Rebuilding a package whenever its source directory changes."""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Callable, Collection
+
+# Seconds between checks of the source directory for changes
+POLL_INTERVAL = 0.5
+# Folders that change without the package's source changing
+IGNORED_FOLDERS = {
+    ".git",
+    ".hg",
+    "__pycache__",
+    ".mypy_cache",
+    ".pytest_cache",
+    ".tox",
+    "node_modules",
+}
+
+
+def snapshot(
+    directory: str, exclude: Collection[str] = ()
+) -> dict[str, tuple[int, int]]:
+    """
+    Returns the modification time and size of every file in the directory,
+    keyed by their paths relative to it, other than the paths in `exclude`.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    files = {}
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [
+            dirname
+            for dirname in dirnames
+            if dirname not in IGNORED_FOLDERS
+            and os.path.join(root, dirname) not in exclude
+        ]
+        for filename in filenames:
+            file_path = os.path.join(root, filename)
+            if file_path in exclude:
+                continue
+            try:
+                stat = os.lstat(file_path)
+            except FileNotFoundError:
+                continue
+            files[os.path.relpath(file_path, directory)] = (
+                stat.st_mtime_ns,
+                stat.st_size,
+            )
+
+    return files
+
+
+def changed_files(
+    old: dict[str, tuple[int, int]], new: dict[str, tuple[int, int]]
+) -> list[str]:
+    """Returns the files that were added, removed or changed between snapshots."""
+    return sorted(
+        path for path in old.keys() | new.keys() if old.get(path) != new.get(path)
+    )
+
+
+def watch(
+    directory: str,
+    build: Callable[[], object],
+    exclude: Collection[str] = (),
+    on_change: Callable[[list[str]], None] | None = None,
+    interval: float = POLL_INTERVAL,
+) -> None:
+    """
+    Runs `build`, and runs it again whenever the files in the directory change,
+    until interrupted. Files that change while it runs trigger the next build.
+    """
+    directory = os.path.abspath(directory)
+    exclude = [os.path.join(directory, path) for path in exclude]
+    files = snapshot(directory, exclude)
+    build()
+    while True:
+        time.sleep(interval)
+        new_files = snapshot(directory, exclude)
+        changes = changed_files(files, new_files)
+        if not changes:
+            continue
+
+        files = new_files
+        if on_change is not None:
+            on_change(changes)
+        build()
@@ -0,0 +1,573 @@
+"""Installing the build's packages from a local directory of wheels."""
+
+from __future__ import annotations
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import csv
+from dataclasses import dataclass
+from email.parser import Parser
+import glob
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Any
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import zipfile
+
+from packaged.build_log import BuildLog, ProgressEvent, run_command
+from packaged.relocate import ENV_PYTHON_SHEBANG
+
+if sys.version_info < (3, 11):
+    import tomli as tomllib
+else:
+    import tomllib
+
+CHUNK_SIZE = 1024 * 1024
+
+# Build commands with any of these, or with these operators outside of quotes,
+# run more than a single `pip install`
+SHELL_CHARACTERS = set("$`\n")
+SHELL_OPERATOR_CHARACTERS = set(";&|<>()")
+# Options of `pip install` that only make sense when installing, and are left
+# out when downloading into the wheelhouse. The values are whether they take a
+# value.
+INSTALL_ONLY_OPTIONS = {
+    "-U": False,
+    "--upgrade": False,
+    "--upgrade-strategy": True,
+    "--force-reinstall": False,
+    "-I": False,
+    "--ignore-installed": False,
+    "--compile": False,
+    "--no-compile": False,
+    "--no-warn-script-location": False,
+    "--no-warn-conflicts": False,
+}
+# Options that install somewhere other than the bundled Python, or install
+# projects in a way that can't come from a wheel
+UNSUPPORTED_OPTIONS = (
+    "-e",
+    "--editable",
+    "-t",
+    "--target",
+    "--prefix",
+    "--root",
+    "--user",
+)
+# Options whose value is a file or URL, rather than something to install
+VALUE_OPTIONS = (
+    "-r",
+    "--requirement",
+    "-c",
+    "--constraint",
+    "-f",
+    "--find-links",
+    "-i",
+    "--index-url",
+    "--extra-index-url",
+)
+# What pip builds projects without a `[build-system]` table with
+DEFAULT_BUILD_REQUIREMENTS = ["setuptools>=40.8.0", "wheel"]
+
+INSTALLER = "packaged"
+# The same script that pip creates for entry points
+ENTRY_POINT_SCRIPT = """\
+#!/usr/bin/env python
+import re
+import sys
+from {module} import {import_name}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({attribute}())
+"""
+# Compiles the modules listed on stdin like pip does, printing the paths of the
+# `.pyc` files. Run by the bundled Python, so that they're its bytecode.
+COMPILE_SCRIPT = """\
+import compileall
+import importlib.util
+import sys
+for path in sys.stdin.read().splitlines():
+    if compileall.compile_file(path, force=True, quiet=2):
+        print(importlib.util.cache_from_source(path))
+"""
+
+
+@dataclass
+class WheelhouseReport:
+    """
+    Number of wheels that were installed, how many of them were built from
+    source first (like the project itself), and how many wheels were
+    downloaded into the wheelhouse, if it didn't have everything.
+    """
+
+    installed: int = 0
+    built: int = 0
+    downloaded: int = 0
+
+
+def pip_install_arguments(build_command: str) -> list[str] | None:
+    """
+    Returns the arguments of the build command, if it's a single `pip install`
+    that the wheelhouse can install instead, like `pip install .` or
+    `python -m pip install -r requirements.txt`.
+    """
+    if SHELL_CHARACTERS & set(build_command):
+        return None
+
+    lexer = shlex.shlex(build_command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        arguments = list(lexer)
+    except ValueError:
+        return None
+    if any(set(argument) <= SHELL_OPERATOR_CHARACTERS for argument in arguments):
+        return None
+
+    if arguments[:1] and re.fullmatch(r"python[0-9.]*", arguments[0]):
+        if arguments[1:3] != ["-m", "pip"]:
+            return None
+        arguments = arguments[2:]
+    if not arguments or not re.fullmatch(r"pip[0-9.]*", arguments[0]):
+        return None
+    if arguments[1:2] != ["install"]:
+        return None
+
+    install_arguments = arguments[2:]
+    for argument in install_arguments:
+        if argument.split("=")[0] in UNSUPPORTED_OPTIONS:
+            return None
+
+    return install_arguments
+
+
+def wheelhouse_environment(wheelhouse: str) -> dict[str, str]:
+    """
+    Returns the environment variables that make pip install packages only from
+    the wheelhouse.
+    """
+    return {
+        "PIP_FIND_LINKS": os.path.abspath(wheelhouse),
+        "PIP_NO_INDEX": "1",
+        "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+    }
+
+
+def _pip(
+    python_path: str,
+    arguments: list[str],
+    cwd: str,
+    environment: dict[str, str] | None = None,
+    log: BuildLog | None = None,
+) -> bytes:
+    """
+    Runs pip with the arguments, returning its output, or streaming it into
+    the log if there is one.
+    """
+    command = [python_path, "-m", "pip", *arguments]
+    env = {
+        "PATH": os.pathsep.join(
+            [os.path.dirname(python_path), os.environ.get("PATH", "")]
+        ),
+        "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        **(environment or {}),
+    }
+    if log is not None:
+        run_command(command, log, env=env, cwd=cwd)
+        return b""
+
+    return subprocess.run(
+        command, env=env, cwd=cwd, check=True, capture_output=True
+    ).stdout
+
+
+def _download_arguments(arguments: list[str]) -> list[str]:
+    """Leaves out the options of `pip install` that `pip wheel` doesn't take."""
+    download_arguments = []
+    skip_value = False
+    for argument in arguments:
+        if skip_value:
+            skip_value = False
+            continue
+
+        option = argument.split("=")[0]
+        if option in INSTALL_ONLY_OPTIONS:
+            skip_value = INSTALL_ONLY_OPTIONS[option] and "=" not in argument
+            continue
+
+        download_arguments.append(argument)
+
+    return download_arguments
+
+
+def _project_directories(arguments: list[str], cwd: str) -> list[str]:
+    """Returns the local projects in the arguments, like `.`."""
+    directories = []
+    for previous, argument in zip(["", *arguments], arguments):
+        if argument.startswith("-") or previous in VALUE_OPTIONS:
+            continue
+        directory = os.path.join(cwd, argument.split("[")[0])
+        if os.path.isdir(directory):
+            directories.append(directory)
+
+    return directories
+
+
+def _build_requirements(project_directory: str) -> list[str]:
+    pyproject_path = os.path.join(project_directory, "pyproject.toml")
+    if not os.path.isfile(pyproject_path):
+        return DEFAULT_BUILD_REQUIREMENTS
+
+    with open(pyproject_path, "rb") as pyproject_file:
+        pyproject = tomllib.load(pyproject_file)
+
+    build_system = pyproject.get("build-system")
+    if build_system is None:
+        return DEFAULT_BUILD_REQUIREMENTS
+    return list(build_system.get("requires", []))
+
+
+def _wheel_count(wheelhouse: str) -> int:
+    return len(glob.glob(os.path.join(wheelhouse, "*.whl")))
+
+
+def fill_wheelhouse(
+    python_path: str,
+    arguments: list[str],
+    wheelhouse: str,
+    cwd: str,
+    log: BuildLog | None = None,
+) -> int:
+    """
+    Downloads or builds wheels of everything that `pip install` would install
+    with the arguments into the wheelhouse, along with what's needed to build
+    the local projects in it. Returns the number of wheels added. pip's output
+    goes into the log.
+    """
+    os.makedirs(wheelhouse, exist_ok=True)
+    wheel_count = _wheel_count(wheelhouse)
+    wheel_arguments = ["wheel", "--wheel-dir", wheelhouse, "--find-links", wheelhouse]
+    build_requirements = []
+    for project_directory in _project_directories(arguments, cwd):
+        build_requirements += _build_requirements(project_directory)
+    if build_requirements:
+        _pip(python_path, [*wheel_arguments, *build_requirements], cwd, log=log)
+
+    _pip(
+        python_path,
+        [*wheel_arguments, *_download_arguments(arguments)],
+        cwd,
+        log=log,
+    )
+    return _wheel_count(wheelhouse) - wheel_count
+
+
+def resolve(
+    python_path: str, arguments: list[str], wheelhouse: str, cwd: str
+) -> list[dict[str, Any]]:
+    """
+    Resolves what `pip install` would install with the arguments, using only
+    the wheelhouse. Returns the items of pip's installation report.
+    """
+    output = _pip(
+        python_path,
+        ["install", "--dry-run", "--quiet", "--report", "-", *arguments],
+        cwd,
+        wheelhouse_environment(wheelhouse),
+    )
+    report: dict[str, Any] = json.loads(output)
+    return list(report["install"])
+
+
+def _record_hash(digest: Any) -> str:
+    encoded = base64.urlsafe_b64encode(digest.digest()).rstrip(b"=").decode()
+    return f"sha256={encoded}"
+
+
+def _canonical_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _uninstall(site_packages: str, project_name: str) -> None:
+    """Removes the files of an installed version of the project, if any."""
+    canonical_name = _canonical_name(project_name)
+    for dist_info in glob.glob(os.path.join(site_packages, "*.dist-info")):
+        name = os.path.basename(dist_info)[: -len(".dist-info")].rsplit("-", 1)[0]
+        if _canonical_name(name) != canonical_name:
+            continue
+
+        record_path = os.path.join(dist_info, "RECORD")
+        if os.path.isfile(record_path):
+            with open(record_path, newline="") as record_file:
+                for row in csv.reader(record_file):
+                    file_path = os.path.normpath(os.path.join(site_packages, row[0]))
+                    if os.path.isfile(file_path) or os.path.islink(file_path):
+                        os.remove(file_path)
+        shutil.rmtree(dist_info, ignore_errors=True)
+
+
+def _write_member(
+    wheel: zipfile.ZipFile, member: zipfile.ZipInfo, destination: str, script: bool
+) -> tuple[str, int]:
+    """
+    Writes a file of the wheel to its destination, returning its hash and size.
+    Scripts with a `#!python` shebang get a `/usr/bin/env python` shebang.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with wheel.open(member) as source, open(destination, "wb") as file:
+        if script:
+            first_line = source.readline()
+            if first_line.startswith(b"#!python"):
+                first_line = ENV_PYTHON_SHEBANG
+            file.write(first_line)
+            digest.update(first_line)
+            size += len(first_line)
+
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            file.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+
+    mode = member.external_attr >> 16
+    if script or mode & 0o111:
+        os.chmod(destination, 0o755)
+
+    return _record_hash(digest), size
+
+
+def compiles_bytecode(arguments: list[str]) -> bool:
+    """
+    Returns false if the arguments of `pip install` turn off compiling the
+    installed modules, which pip does by default. The last option wins.
+    """
+    for argument in reversed(arguments):
+        if argument in ("--compile", "--no-compile"):
+            return argument == "--compile"
+
+    return True
+
+
+def _compile_modules(python_path: str, module_paths: list[str]) -> list[str]:
+    """
+    Compiles the modules with the Python, returning the paths of the `.pyc`
+    files it wrote.
+    """
+    if not module_paths:
+        return []
+
+    result = subprocess.run(
+        [python_path, "-c", COMPILE_SCRIPT],
+        input="\n".join(module_paths).encode(),
+        check=True,
+        capture_output=True,
+    )
+    return result.stdout.decode().splitlines()
+
+
+def _entry_point_scripts(entry_points: str) -> dict[str, str]:
+    """Returns the scripts to create for the wheel's entry points."""
+    parser = configparser.ConfigParser(delimiters=("=",))
+    parser.optionxform = str  # type: ignore[assignment,method-assign]
+    parser.read_string(entry_points)
+    scripts = {}
+    for section in ("console_scripts", "gui_scripts"):
+        if not parser.has_section(section):
+            continue
+        for name, value in parser.items(section):
+            module, _, attribute = value.split("[")[0].strip().partition(":")
+            scripts[name] = ENTRY_POINT_SCRIPT.format(
+                module=module, import_name=attribute.split(".")[0], attribute=attribute
+            )
+
+    return scripts
+
+
+def install_wheel(
+    wheel_path: str, paths: dict[str, str], python_path: str | None = None
+) -> None:
+    """
+    Unpacks the wheel into the install scheme `paths`, given by
+    `sysconfig.get_paths()`, replacing any installed version of it. Scripts are
+    created for its entry points, and the files are listed in its `RECORD`.
+    With a `python_path`, the modules it installs are compiled with that Python,
+    and their `.pyc` files are listed in `RECORD` as well, like pip does.
+    """
+    with zipfile.ZipFile(wheel_path) as wheel:
+        dist_info = next(
+            name.split("/")[0]
+            for name in wheel.namelist()
+            if re.fullmatch(r"[^/]+\.dist-info/WHEEL", name)
+        )
+        project_name = dist_info[: -len(".dist-info")].rsplit("-", 1)[0]
+        data_folder = dist_info[: -len(".dist-info")] + ".data"
+        wheel_metadata = Parser().parsestr(wheel.read(f"{dist_info}/WHEEL").decode())
+        is_purelib = wheel_metadata.get("Root-Is-Purelib", "").strip() == "true"
+        site_packages = paths["purelib" if is_purelib else "platlib"]
+        folders = {**paths, "headers": os.path.join(paths["include"], project_name)}
+
+        _uninstall(site_packages, project_name)
+
+        records = []
+        for member in wheel.infolist():
+            name = member.filename
+            if member.is_dir() or name == f"{dist_info}/RECORD":
+                continue
+            if name.startswith("/") or ".." in name.split("/"):
+                raise ValueError(f"{wheel_path} has a file outside of it: {name}")
+
+            is_script = False
+            if name.startswith(data_folder + "/"):
+                _, key, relative_name = name.split("/", 2)
+                destination = os.path.join(folders[key], relative_name)
+                is_script = key == "scripts"
+            else:
+                destination = os.path.join(site_packages, name)
+
+            file_hash, size = _write_member(wheel, member, destination, is_script)
+            records.append((destination, file_hash, str(size)))
+
+        entry_points_name = f"{dist_info}/entry_points.txt"
+        if entry_points_name in wheel.namelist():
+            entry_points = wheel.read(entry_points_name).decode()
+            for script_name, script in _entry_point_scripts(entry_points).items():
+                script_path = os.path.join(paths["scripts"], script_name)
+                os.makedirs(paths["scripts"], exist_ok=True)
+                with open(script_path, "w") as script_file:
+                    script_file.write(script)
+                os.chmod(script_path, 0o755)
+                digest = hashlib.sha256(script.encode())
+                records.append(
+                    (script_path, _record_hash(digest), str(len(script.encode())))
+                )
+
+    if python_path is not None:
+        library_folders = {
+            os.path.join(paths[key], "") for key in ("purelib", "platlib")
+        }
+        module_paths = [
+            file_path
+            for file_path, _, _ in records
+            if file_path.endswith(".py")
+            and file_path.startswith(tuple(library_folders))
+        ]
+        for pyc_path in _compile_modules(python_path, module_paths):
+            with open(pyc_path, "rb") as pyc_file:
+                pyc = pyc_file.read()
+            digest = hashlib.sha256(pyc)
+            records.append((pyc_path, _record_hash(digest), str(len(pyc))))
+
+    installer_path = os.path.join(site_packages, dist_info, "INSTALLER")
+    with open(installer_path, "w") as installer_file:
+        installer_file.write(INSTALLER + "\n")
+    digest = hashlib.sha256(f"{INSTALLER}\n".encode())
+    records.append((installer_path, _record_hash(digest), str(len(INSTALLER) + 1)))
+
+    record_path = os.path.join(site_packages, dist_info, "RECORD")
+    with open(record_path, "w", newline="") as record_file:
+        writer = csv.writer(record_file, lineterminator="\n")
+        for file_path, record_hash, record_size in records:
+            writer.writerow(
+                (os.path.relpath(file_path, site_packages), record_hash, record_size)
+            )
+        writer.writerow((os.path.relpath(record_path, site_packages), "", ""))
+
+
+def _install_paths(python_path: str) -> dict[str, str]:
+    result = subprocess.run(
+        [
+            python_path,
+            "-c",
+            "import json, sysconfig; print(json.dumps(sysconfig.get_paths()))",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    paths: dict[str, str] = json.loads(result.stdout)
+    return paths
+
+
+def _url_path(url: str) -> str:
+    return url2pathname(urlparse(url).path)
+
+
+def install_from_wheelhouse(
+    python_path: str,
+    build_command: str,
+    wheelhouse: str,
+    cwd: str,
+    jobs: int | None = None,
+    log: BuildLog | None = None,
+) -> WheelhouseReport | None:
+    """
+    Installs what the build command would, if it's a single `pip install`,
+    using only the wheels in the wheelhouse, which is filled from the package
+    index first if it doesn't have everything. Projects that aren't in it as
+    wheels, like the local project, are built into wheels, and the wheels are
+    unpacked into the bundled Python in parallel, and compiled unless the
+    command has `--no-compile`. pip's output goes into the log, along with an
+    "installed" event for every wheel.
+
+    Returns None if the build command is something else.
+    """
+    arguments = pip_install_arguments(build_command)
+    if arguments is None:
+        return None
+
+    wheelhouse = os.path.abspath(wheelhouse)
+    report = WheelhouseReport()
+    try:
+        items = resolve(python_path, arguments, wheelhouse, cwd)
+    except subprocess.CalledProcessError:
+        report.downloaded = fill_wheelhouse(
+            python_path, arguments, wheelhouse, cwd, log
+        )
+        items = resolve(python_path, arguments, wheelhouse, cwd)
+
+    wheel_paths = []
+    sources = []
+    for item in items:
+        url = item["download_info"]["url"]
+        if url.startswith("file:") and url.endswith(".whl"):
+            wheel_paths.append(_url_path(url))
+        else:
+            sources.append(_url_path(url) if url.startswith("file:") else url)
+
+    paths = _install_paths(python_path)
+    with tempfile.TemporaryDirectory() as build_directory:
+        if sources:
+            _pip(
+                python_path,
+                ["wheel", "--no-deps", "--wheel-dir", build_directory, *sources],
+                cwd,
+                wheelhouse_environment(wheelhouse),
+                log,
+            )
+            built_wheels = glob.glob(os.path.join(build_directory, "*.whl"))
+            wheel_paths += built_wheels
+            report.built = len(built_wheels)
+
+        compile_with = python_path if compiles_bytecode(arguments) else None
+
+        def install(wheel_path: str) -> str:
+            install_wheel(wheel_path, paths, compile_with)
+            return os.path.basename(wheel_path).split("-")[0]
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for package in executor.map(install, wheel_paths):
+                report.installed += 1
+                if log is not None:
+                    log.emit(
+                        ProgressEvent("installed", f"Installed {package}", package)
+                    )
+
+    return report
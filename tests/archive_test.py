@@ -0,0 +1,394 @@
+from __future__ import annotations
+
+import io
+import os
+from pathlib import Path
+import signal
+import subprocess
+import tarfile
+import time
+from typing import IO, ContextManager
+
+import pytest
+
+import packaged.archive
+from packaged.archive import compress_stream, write_package
+from packaged.build_log import BuildCancelled, BuildLog, CancelToken
+
+
+def create_roots(tmp_path: Path) -> tuple[Path, Path]:
+    """Creates a package directory with a startup script, and another root."""
+    package = tmp_path / "package"
+    (package / "lib").mkdir(parents=True)
+    (package / "lib" / "greeting.txt").write_text("Hello from packaged\n")
+    (package / "startup.sh").write_text("cat lib/greeting.txt extra/data.txt\n")
+    (package / "startup.sh").chmod(0o755)
+    (package / "link.txt").symlink_to("lib/greeting.txt")
+
+    extra = tmp_path / "extra"
+    extra.mkdir()
+    (extra / "data.txt").write_text("Extra data\n")
+    return package, extra
+
+
+@pytest.mark.parametrize("checksum", ["sha256", "md5", "crc", "none"])
+def test_write_package(tmp_path: Path, checksum: str) -> None:
+    """Ensures that the package extracts and runs, and passes its own check."""
+    package, extra = create_roots(tmp_path)
+    output_path = str(tmp_path / "package.bin")
+
+    payload = write_package(
+        output_path,
+        [(str(package), "."), (str(extra), "extra")],
+        [],
+        label="test package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=None,
+        compression_threads=None,
+        checksum=checksum,
+    )
+
+    assert os.access(output_path, os.X_OK)
+    assert (payload.md5 is not None) == (checksum == "md5")
+    assert (payload.sha256 is not None) == (checksum == "sha256")
+    assert (payload.crc is not None) == (checksum == "crc")
+
+    output = subprocess.check_output([output_path, "--nox11", "--quiet"])
+    assert output == b"Hello from packaged\nExtra data\n"
+    subprocess.run([output_path, "--check"], check=True, capture_output=True)
+
+
+@pytest.mark.parametrize("checksum", ["sha256", "md5", "crc", "none"])
+@pytest.mark.parametrize("launch_cache", [True, False])
+def test_corrupted_package(tmp_path: Path, checksum: str, launch_cache: bool) -> None:
+    """
+    Ensures that a package with a corrupted payload fails to launch, without
+    leaving anything it partly extracted behind, in its cache or elsewhere.
+    """
+    package = tmp_path / "package"
+    package.mkdir()
+    (package / "data.bin").write_bytes(os.urandom(64 * 1024))
+    (package / "startup.sh").write_text("echo started\n")
+    (package / "startup.sh").chmod(0o755)
+
+    output_path = tmp_path / "package.bin"
+    payload = write_package(
+        str(output_path),
+        [(str(package), ".")],
+        ["--launch-cache"] if launch_cache else [],
+        label="package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=None,
+        compression_threads=None,
+        checksum=checksum,
+    )
+    contents = bytearray(output_path.read_bytes())
+    contents[len(contents) - payload.size // 2] ^= 0xFF
+    output_path.write_bytes(contents)
+
+    (tmp_path / "tmp").mkdir()
+    env = {
+        **os.environ,
+        "PACKAGED_CACHE_DIR": str(tmp_path / "cache"),
+        "TMPDIR": str(tmp_path / "tmp"),
+    }
+    result = subprocess.run(
+        [str(output_path), "--nox11", "--quiet"], env=env, capture_output=True
+    )
+
+    assert result.returncode != 0
+    assert b"started" not in result.stdout
+    assert os.listdir(tmp_path / "tmp") == []
+    cache_entries = (
+        os.listdir(tmp_path / "cache") if (tmp_path / "cache").exists() else []
+    )
+    assert [entry for entry in cache_entries if not entry.startswith(".lock")] == []
+
+
+def test_write_package_members(tmp_path: Path) -> None:
+    """Ensures that the payload is a tarball, named like `makeself.sh` does."""
+    package, extra = create_roots(tmp_path)
+    output_path = str(tmp_path / "package.bin")
+
+    write_package(
+        output_path,
+        [(str(package), "."), (str(extra), "extra")],
+        [],
+        label="test package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=1,
+        compression_threads=None,
+        checksum="md5",
+    )
+
+    # The payload starts after the header's `SKIP` lines
+    dumpconf = subprocess.check_output([output_path, "--dumpconf"]).decode()
+    [skip] = [line for line in dumpconf.splitlines() if line.startswith("SKIP=")]
+    with open(output_path, "rb") as file:
+        for _ in range(int(skip.split('"')[1])):
+            file.readline()
+        with tarfile.open(fileobj=file, mode="r|gz") as tar:
+            members = {member.name: member for member in tar}
+
+    assert sorted(members) == [
+        "./extra/data.txt",
+        "./lib",
+        "./lib/greeting.txt",
+        "./link.txt",
+        "./startup.sh",
+    ]
+    assert members["./link.txt"].issym()
+    assert members["./link.txt"].linkname == "lib/greeting.txt"
+    assert members["./startup.sh"].mode & 0o111
+
+
+def test_write_package_runtime_layer(tmp_path: Path) -> None:
+    """
+    Ensures that packages with the same runtime layer extract it once into the
+    shared store, and hardlink it from there.
+    """
+    outputs = []
+    for version in ("1.0", "2.0"):
+        package = tmp_path / f"package-{version}"
+        (package / "runtime").mkdir(parents=True)
+        (package / "runtime" / "python.txt").write_text("Python 3.12\n")
+        # Files copied from yen's Python keep their modification times
+        os.utime(package / "runtime" / "python.txt", (1_700_000_000, 1_700_000_000))
+        (package / "startup.sh").write_text(f"cat runtime/python.txt; echo {version}\n")
+        (package / "startup.sh").chmod(0o755)
+
+        output_path = str(tmp_path / f"package-{version}.bin")
+        payload = write_package(
+            output_path,
+            [(str(package), ".")],
+            ["--launch-cache"],
+            label=f"package-{version}",
+            startup_script="./startup.sh",
+            compression="gzip",
+            compression_level=None,
+            compression_threads=None,
+            checksum="md5",
+            runtime_layer=lambda name: name.startswith("./runtime/"),
+        )
+        assert payload.runtime_layer is not None
+        outputs.append((output_path, payload.runtime_layer.content_hash))
+
+    # Same files in the runtime layer, so the same hash
+    [runtime_hash] = {runtime_hash for _, runtime_hash in outputs}
+    assert runtime_hash is not None
+
+    env = {
+        **os.environ,
+        "PACKAGED_RUNTIME_DIR": str(tmp_path / "runtimes"),
+        "PACKAGED_CACHE_DIR": str(tmp_path / "cache"),
+    }
+    for (output_path, _), version in zip(outputs, ("1.0", "2.0")):
+        output = subprocess.check_output([output_path, "--nox11", "--quiet"], env=env)
+        assert output == f"Python 3.12\n{version}\n".encode()
+        subprocess.run([output_path, "--check"], check=True, capture_output=True)
+
+    assert os.listdir(tmp_path / "runtimes") == [runtime_hash]
+    runtime_file = tmp_path / "runtimes" / runtime_hash / "runtime" / "python.txt"
+    for extracted in (tmp_path / "cache").glob("package-*/runtime/python.txt"):
+        assert os.path.samefile(extracted, runtime_file)
+
+
+def test_write_package_unshared_runtime_layer(tmp_path: Path) -> None:
+    """
+    Ensures that a runtime layer that isn't shared is extracted with the rest of
+    the package, rather than into the shared store.
+    """
+    package = tmp_path / "package"
+    (package / "runtime").mkdir(parents=True)
+    (package / "runtime" / "python.txt").write_text("Python 3.12\n")
+    (package / "startup.sh").write_text("cat runtime/python.txt\n")
+    (package / "startup.sh").chmod(0o755)
+
+    output_path = str(tmp_path / "package.bin")
+    payload = write_package(
+        output_path,
+        [(str(package), ".")],
+        ["--launch-cache"],
+        label="package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=None,
+        compression_threads=None,
+        checksum="md5",
+        runtime_layer=lambda name: name.startswith("./runtime/"),
+        shared_runtime=False,
+    )
+    assert payload.runtime_layer is not None
+
+    env = {
+        **os.environ,
+        "PACKAGED_RUNTIME_DIR": str(tmp_path / "runtimes"),
+        "PACKAGED_CACHE_DIR": str(tmp_path / "cache"),
+    }
+    output = subprocess.check_output([output_path, "--nox11", "--quiet"], env=env)
+    assert output == b"Python 3.12\n"
+    subprocess.run([output_path, "--check"], check=True, capture_output=True)
+
+    assert not os.path.exists(tmp_path / "runtimes")
+    [extracted] = (tmp_path / "cache").glob("package-*/runtime/python.txt")
+    assert os.stat(extracted).st_nlink == 1
+
+
+def test_write_package_hot_files(tmp_path: Path) -> None:
+    """
+    Ensures that the hot files are written first, in their order, and that the
+    rest of the package is extracted while the startup script runs.
+    """
+    package, extra = create_roots(tmp_path)
+    (package / "startup.sh").write_text(
+        "cat lib/greeting.txt\n"
+        "while test ! -f extra/data.txt; do sleep 0.1; done\n"
+        "cat extra/data.txt\n"
+    )
+    output_path = str(tmp_path / "package.bin")
+
+    payload = write_package(
+        output_path,
+        [(str(package), "."), (str(extra), "extra")],
+        ["--launch-cache"],
+        label="test package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=1,
+        compression_threads=None,
+        checksum="sha256",
+        hot_files=["./startup.sh", "./lib/greeting.txt", "./missing.txt"],
+    )
+
+    assert payload.hot_layer is not None
+    dumpconf = subprocess.check_output([output_path, "--dumpconf"]).decode()
+    assert "COLD_LAYER=y" in dumpconf
+    [skip] = [line for line in dumpconf.splitlines() if line.startswith("SKIP=")]
+    with open(output_path, "rb") as file:
+        for _ in range(int(skip.split('"')[1])):
+            file.readline()
+        hot_layer = io.BytesIO(file.read(payload.hot_layer.size))
+    with tarfile.open(fileobj=hot_layer, mode="r:gz") as tar:
+        assert tar.getnames() == ["./startup.sh", "./lib/greeting.txt"]
+
+    for env in ({}, {"PACKAGED_FOREGROUND": "1"}):
+        cache = tmp_path / f"cache-{len(env)}"
+        output = subprocess.check_output(
+            [output_path, "--nox11", "--quiet"],
+            env={**os.environ, **env, "PACKAGED_CACHE_DIR": str(cache)},
+        )
+        assert output == b"Hello from packaged\nExtra data\n"
+    subprocess.run([output_path, "--check"], check=True, capture_output=True)
+
+    # The cache is complete once the rest is extracted
+    cache = tmp_path / "cache-0"
+    [cache_dir] = cache.glob("test_package-*")
+    for _ in range(50):
+        if (cache_dir / ".packaged-complete").exists():
+            break
+        time.sleep(0.1)
+    assert (cache_dir / ".packaged-complete").exists()
+    assert (cache_dir / "link.txt").is_symlink()
+    assert not list(cache.glob(".lock-*"))
+
+
+def test_write_package_no_chunks(tmp_path: Path) -> None:
+    """Ensures that fewer than one chunk is an error, and nothing is written."""
+    package, _ = create_roots(tmp_path)
+    output_path = tmp_path / "package.bin"
+    with pytest.raises(ValueError):
+        write_package(
+            str(output_path),
+            [(str(package), ".")],
+            [],
+            label="test package",
+            startup_script="./startup.sh",
+            compression="gzip",
+            compression_level=None,
+            compression_threads=None,
+            checksum="md5",
+            chunks=0,
+        )
+
+    assert not output_path.exists()
+
+
+def test_write_package_chunks(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Ensures that the payload is split into chunks of about the same size, with
+    hardlinked files kept together, and extracts the same in parallel.
+    """
+    monkeypatch.setattr(packaged.archive, "MIN_PAYLOAD_CHUNK_SIZE", 1000)
+    package, _ = create_roots(tmp_path)
+    for index in range(6):
+        (package / "lib" / f"data{index}.bin").write_bytes(os.urandom(3000))
+    os.link(package / "lib" / "data0.bin", package / "lib" / "data0-link.bin")
+    output_path = str(tmp_path / "package.bin")
+
+    payload = write_package(
+        output_path,
+        [(str(package), ".")],
+        [],
+        label="test package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=1,
+        compression_threads=None,
+        checksum="sha256",
+        chunks=3,
+    )
+
+    assert payload.chunks is not None and len(payload.chunks) == 3
+    assert payload.size == sum(chunk.size for chunk in payload.chunks)
+    sizes = [chunk.uncompressed_size for chunk in payload.chunks]
+    assert max(sizes) - min(sizes) <= 4 * 1024
+
+    listing = subprocess.check_output([output_path, "--list"]).decode()
+    assert "./lib/data0.bin link to ./lib/data0-link.bin" in listing
+
+    for workers in ("4", "1", "none"):
+        target = tmp_path / f"extracted-{workers}"
+        subprocess.run(
+            [output_path, "--quiet", "--noexec", "--target", str(target)],
+            env={**os.environ, "PACKAGED_EXTRACT_WORKERS": workers},
+            check=True,
+        )
+        assert sorted(os.listdir(target / "lib")) == sorted(os.listdir(package / "lib"))
+        assert (target / "lib" / "data0-link.bin").samefile(
+            target / "lib" / "data0.bin"
+        )
+    subprocess.run([output_path, "--check"], check=True, capture_output=True)
+
+
+def test_compress_stream_cancelled(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensures that cancelling kills the compressor, and the CRC checksum too."""
+    processes: list[subprocess.Popen[bytes]] = []
+    track = CancelToken.track
+
+    def record_track(
+        self: CancelToken, process: subprocess.Popen[bytes]
+    ) -> ContextManager[None]:
+        processes.append(process)
+        return track(self, process)
+
+    monkeypatch.setattr(CancelToken, "track", record_track)
+    cancel_token = CancelToken()
+
+    def write_uncompressed(file: IO[bytes]) -> None:
+        file.write(b"x" * 1024)
+        cancel_token.cancel()
+
+    with pytest.raises(BuildCancelled):
+        compress_stream(
+            io.BytesIO(),
+            write_uncompressed,
+            ["gzip", "-c"],
+            "crc",
+            BuildLog(cancel_token=cancel_token),
+        )
+
+    assert [process.args for process in processes] == [["gzip", "-c"], ["cksum"]]
+    assert all(process.returncode == -signal.SIGKILL for process in processes)
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import threading
+import time
+
+from pytest import MonkeyPatch
+
+from packaged import build_cache
+from packaged.build_cache import (
+    build_cache_key,
+    build_lock,
+    evict_builds,
+    hash_tree,
+    invalidate_build,
+    package_changes,
+    restore_build,
+    restore_layer,
+    save_build,
+    save_layer,
+    snapshot_package,
+)
+
+
+def create_build(directory: Path, contents: str) -> str:
+    """Creates a fake packaged Python, with one file of the given contents."""
+    (directory / "python" / "bin").mkdir(parents=True)
+    (directory / "python" / "bin" / "python").write_text(contents)
+    return str(directory)
+
+
+def test_build_cache_key(tmp_path: Path) -> None:
+    """Ensures that the key changes with the build's inputs, and only those."""
+    (tmp_path / "requirements.txt").write_text("numpy\n")
+    (tmp_path / "main.py").write_text("print('hi')\n")
+    key = build_cache_key("3.12.3", "pip install -r requirements.txt", str(tmp_path))
+
+    # Non dependency files don't matter
+    (tmp_path / "main.py").write_text("print('hello')\n")
+    assert key == build_cache_key(
+        "3.12.3", "pip install -r requirements.txt", str(tmp_path)
+    )
+
+    assert key != build_cache_key(
+        "3.11.9", "pip install -r requirements.txt", str(tmp_path)
+    )
+    assert key != build_cache_key("3.12.3", "pip install numpy", str(tmp_path))
+
+    (tmp_path / "requirements-dev.txt").write_text("pytest\n")
+    assert key != build_cache_key(
+        "3.12.3", "pip install -r requirements.txt", str(tmp_path)
+    )
+
+
+def test_hash_tree(tmp_path: Path) -> None:
+    """Ensures that the hash changes with the tree, other than excluded paths."""
+    (tmp_path / "src" / "app").mkdir(parents=True)
+    (tmp_path / "src" / "app" / "main.py").write_text("print('hello')\n")
+    tree_hash = hash_tree(str(tmp_path / "src"))
+
+    # Writing the output into the tree doesn't change it
+    (tmp_path / "src" / "app.bin").write_text("package")
+    (tmp_path / "src" / "logs").mkdir()
+    (tmp_path / "src" / "logs" / "build.log").write_text("built")
+    assert tree_hash == hash_tree(
+        str(tmp_path / "src"),
+        exclude=[str(tmp_path / "src" / "app.bin"), str(tmp_path / "src" / "logs")],
+    )
+
+    (tmp_path / "src" / "app" / "main.py").write_text("print('bye')\n")
+    changed_hash = hash_tree(str(tmp_path / "src"), [str(tmp_path / "src" / "app.bin")])
+    assert changed_hash != tree_hash
+
+    os.symlink("main.py", tmp_path / "src" / "app" / "link.py")
+    assert changed_hash != hash_tree(
+        str(tmp_path / "src"), [str(tmp_path / "src" / "app.bin")]
+    )
+
+
+def test_save_and_restore(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Ensures that a saved build is restored as-is, and can be invalidated."""
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+    build_path = create_build(tmp_path / "build", "#!/bin/sh\n")
+
+    restore_path = str(tmp_path / "restored")
+    assert not restore_build("somekey", restore_path)
+
+    save_build("somekey", build_path)
+    assert restore_build("somekey", restore_path)
+    with open(os.path.join(restore_path, "python", "bin", "python")) as file:
+        assert file.read() == "#!/bin/sh\n"
+
+    invalidate_build("somekey")
+    assert not restore_build("somekey", str(tmp_path / "restored_again"))
+
+
+def test_save_and_restore_cache_path(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Ensures that builds in another cache path leave the user's cache alone."""
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+    build_path = create_build(tmp_path / "build", "#!/bin/sh\n")
+    run_cache_path = str(tmp_path / "run_cache")
+
+    with build_lock("somekey", run_cache_path):
+        save_build("somekey", build_path, cache_path=run_cache_path)
+    assert not os.path.exists(tmp_path / "cache")
+    assert not restore_build("somekey", str(tmp_path / "restored"))
+    assert restore_build(
+        "somekey", str(tmp_path / "restored"), cache_path=run_cache_path
+    )
+
+    invalidate_build("somekey", run_cache_path)
+    assert not restore_build(
+        "somekey", str(tmp_path / "restored_again"), cache_path=run_cache_path
+    )
+
+    package_path = tmp_path / "package.bin"
+    package_path.write_bytes(b"header" + b"layer" + b"app")
+    save_layer("layerkey", str(package_path), 6, 5, {}, cache_path=run_cache_path)
+    assert not os.path.exists(tmp_path / "cache")
+    assert restore_layer("layerkey") is None
+    assert restore_layer("layerkey", run_cache_path) is not None
+
+
+def test_save_and_restore_package_changes(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    """
+    Ensures that what the build command changed outside of the packaged Python
+    is restored into the package directory along with it.
+    """
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+
+    def create_package(directory: Path) -> Path:
+        (directory / "lib").mkdir(parents=True)
+        (directory / "main.py").write_text("import mod\n")
+        (directory / "build.log").write_text("")
+        create_build(directory / ".packaged_python", "#!/bin/sh\n")
+        return directory
+
+    package = create_package(tmp_path / "package")
+    before = snapshot_package(str(package), ".packaged_python")
+    (package / "lib" / "mod.py").write_text("print('built')\n")
+    (package / "vendor" / "dep").mkdir(parents=True)
+    (package / "vendor" / "dep" / "__init__.py").write_text("")
+    (package / "vendor" / "current").symlink_to("dep")
+    (package / "build.log").unlink()
+    (package / ".packaged_python" / "python" / "lib").mkdir()
+    changed, removed = package_changes(
+        before, snapshot_package(str(package), ".packaged_python")
+    )
+    assert changed == [
+        os.path.join("lib", "mod.py"),
+        "vendor",
+        os.path.join("vendor", "current"),
+        os.path.join("vendor", "dep"),
+        os.path.join("vendor", "dep", "__init__.py"),
+    ]
+    assert removed == ["build.log"]
+
+    save_build(
+        "somekey",
+        str(package / ".packaged_python"),
+        package_directory=str(package),
+        changed=changed,
+        removed=removed,
+    )
+    restored = create_package(tmp_path / "restored")
+    assert restore_build("somekey", str(restored / ".packaged_python"), str(restored))
+    assert (restored / "lib" / "mod.py").read_text() == "print('built')\n"
+    assert (restored / "vendor" / "dep" / "__init__.py").exists()
+    assert os.readlink(restored / "vendor" / "current") == "dep"
+    assert not (restored / "build.log").exists()
+    assert (restored / "main.py").read_text() == "import mod\n"
+
+
+def test_save_and_restore_layer(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Ensures that the layer is cut out of the package, with its details."""
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+    package_path = tmp_path / "package.bin"
+    package_path.write_bytes(b"header" + b"layer" + b"app")
+
+    assert restore_layer("somekey") is None
+
+    save_layer("somekey", str(package_path), 6, 5, {"compression": "gzip"})
+    restored = restore_layer("somekey")
+    assert restored is not None
+    layer_path, details = restored
+    with open(layer_path, "rb") as file:
+        assert file.read() == b"layer"
+    assert details == {"compression": "gzip"}
+
+    invalidate_build("somekey")
+    assert restore_layer("somekey") is None
+
+
+def test_evict_builds(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Ensures that the least recently used builds are evicted first."""
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+    megabyte = "x" * 1024 * 1024
+    for index, key in enumerate(["old", "used", "new"]):
+        save_build(key, create_build(tmp_path / key, megabyte))
+        os.utime(tmp_path / "cache" / key / "metadata.json", (index, index))
+
+    # Using a build makes it the most recently used one
+    assert restore_build("old", str(tmp_path / "restored"))
+
+    evict_builds(max_size=2)
+    assert sorted(os.listdir(tmp_path / "cache")) == ["new", "old"]
+
+
+def test_tree_size_hardlinks(tmp_path: Path) -> None:
+    """Ensures that hardlinked files only count once for a build's size."""
+    build_path = create_build(tmp_path / "build", "x" * 1024)
+    python_path = os.path.join(build_path, "python", "bin", "python")
+    for index in range(3):
+        os.link(python_path, os.path.join(build_path, f"link-{index}"))
+
+    assert build_cache._tree_size(build_path) == 1024
+
+
+def test_build_lock(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    """Ensures that builds with the same key wait for each other."""
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache"))
+    events = []
+
+    def build(name: str) -> None:
+        with build_lock("somekey"):
+            events.append(f"{name} start")
+            time.sleep(0.1)
+            events.append(f"{name} end")
+
+    threads = [threading.Thread(target=build, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert events in (
+        ["a start", "a end", "b start", "b end"],
+        ["b start", "b end", "a start", "a end"],
+    )
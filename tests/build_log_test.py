@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from pathlib import Path
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from packaged.build_log import (
+    BuildCancelled,
+    BuildLog,
+    CancelToken,
+    ProgressEvent,
+    progress_events,
+    run_command,
+)
+
+
+@pytest.mark.parametrize(
+    ("line", "expected"),
+    (
+        ("Collecting numpy<2", [("collecting", "numpy")]),
+        (
+            "Processing ./wheels/tiny-1.0-py3-none-any.whl",
+            [("processing", "tiny")],
+        ),
+        (
+            "  Downloading numpy-1.26.4-cp312-cp312-manylinux.whl (18.0 MB)",
+            [("downloading", "numpy")],
+        ),
+        (
+            "  Building wheel for tiny (pyproject.toml): started",
+            [("building", "tiny")],
+        ),
+        (
+            "Installing collected packages: tiny, typing-extensions",
+            [("installing", "tiny"), ("installing", "typing-extensions")],
+        ),
+        (
+            "Successfully installed tiny-1.0 typing-extensions-4.12.2",
+            [("installed", "tiny"), ("installed", "typing-extensions")],
+        ),
+        ("Requirement already satisfied: pip in ./lib", []),
+    ),
+)
+def test_progress_events(line: str, expected: list[tuple[str, str]]) -> None:
+    """Ensures that the packages are picked out of pip's output."""
+    events = progress_events(line)
+    assert [(event.kind, event.package) for event in events] == expected
+
+
+def test_run_command(tmp_path: Path) -> None:
+    """
+    Ensures that the whole output goes into the rotated log files, while only
+    the last lines are kept in memory, and passed on as events.
+    """
+    log_path = tmp_path / "logs" / "build.log"
+    events: list[ProgressEvent] = []
+    script = (
+        "import sys\n"
+        "for index in range(1000):\n"
+        "    print(f'line {index}', flush=True)\n"
+        "print('Collecting tiny')\n"
+        "print('oops', file=sys.stderr)\n"
+    )
+    with BuildLog(str(log_path), events.append, max_bytes=4000, tail_lines=10) as log:
+        run_command([sys.executable, "-c", script], log)
+
+    assert list(log.tails["stdout"]) == [
+        *(f"line {index}" for index in range(991, 1000)),
+        "Collecting tiny",
+    ]
+    assert list(log.tails["stderr"]) == ["oops"]
+    assert log_path.stat().st_size <= 4100
+    assert (tmp_path / "logs" / "build.log.2").exists()
+    assert not (tmp_path / "logs" / "build.log.3").exists()
+    assert "Collecting tiny\n" in log_path.read_text()
+
+    kinds = [event.kind for event in events]
+    assert kinds.count("output") == 1002
+    assert ProgressEvent("collecting", "Collecting tiny", "tiny") in events
+
+
+def test_run_command_fails() -> None:
+    """Ensures that a failed command's error has the last lines of each stream."""
+    script = "import sys; print('out'); print('err', file=sys.stderr); sys.exit(3)"
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        run_command([sys.executable, "-c", script], BuildLog())
+
+    assert exc_info.value.returncode == 3
+    assert exc_info.value.stdout == b"out\n"
+    assert exc_info.value.stderr == b"err\n"
+
+
+def test_run_command_cancelled(tmp_path: Path) -> None:
+    """Ensures that cancelling kills the command, and what the shell started."""
+    marker_path = tmp_path / "marker"
+    cancel_token = CancelToken()
+    timer = threading.Timer(0.5, cancel_token.cancel)
+    timer.start()
+    start = time.perf_counter()
+    with pytest.raises(BuildCancelled):
+        run_command(
+            [f"sleep 2 && touch {marker_path}"],
+            BuildLog(cancel_token=cancel_token),
+            shell=True,
+        )
+
+    assert time.perf_counter() - start < 1.5
+    time.sleep(2)
+    assert not marker_path.exists()
+
+    # Nothing else runs once it's cancelled
+    with pytest.raises(BuildCancelled):
+        run_command(["true"], BuildLog(cancel_token=cancel_token))
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from packaged.bytecode import compile_bytecode
+
+
+def create_package(directory: Path) -> None:
+    """Creates a package with a module that compiles, and one that doesn't."""
+    (directory / "foo").mkdir()
+    (directory / "foo" / "__init__.py").write_text("VALUE = 42\n")
+    (directory / "foo" / "broken.py").write_text("print 'python 2'\n")
+
+
+def test_compile_bytecode(tmp_path: Path) -> None:
+    """Ensures that modules are compiled with unchecked hashes."""
+    create_package(tmp_path)
+
+    stats = compile_bytecode(sys.executable, [str(tmp_path)], [0, 2])
+
+    assert stats.modules == 2
+    assert "broken.py" in stats.errors
+    pycache = tmp_path / "foo" / "__pycache__"
+    cache_tag = sys.implementation.cache_tag
+    assert sorted(os.listdir(pycache)) == [
+        f"__init__.{cache_tag}.opt-2.pyc",
+        f"__init__.{cache_tag}.pyc",
+    ]
+    # Flags in the `.pyc` header: 0b01 is hash based, and 0b10 is checked
+    flags = (pycache / f"__init__.{cache_tag}.pyc").read_bytes()[4:8]
+    assert int.from_bytes(flags, "little") == 0b01
+    assert (tmp_path / "foo" / "__init__.py").exists()
+
+
+def test_compile_bytecode_without_sources(tmp_path: Path) -> None:
+    """Ensures that sources are replaced, and the package still imports."""
+    create_package(tmp_path)
+
+    compile_bytecode(sys.executable, [str(tmp_path)], keep_sources=False)
+
+    assert sorted(os.listdir(tmp_path / "foo")) == ["__init__.pyc", "broken.py"]
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import foo; print(foo.VALUE)"],
+        cwd=tmp_path,
+    )
+    assert output == b"42\n"
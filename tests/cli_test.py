@@ -1,12 +1,52 @@
 from __future__ import annotations
 
+import json
 import os
+from pathlib import Path
 from unittest import mock
 
-from pytest import MonkeyPatch
+import pytest
+from pytest import CaptureFixture, MonkeyPatch
 
 import packaged
 import packaged.cli
+from packaged.trace import Tracer
+
+# Keyword options that `cli()` passes to `create_package()` when not specified
+DEFAULT_OPTIONS = {
+    "launch_cache": False,
+    "compression": "gzip",
+    "compression_level": None,
+    "compression_threads": None,
+    "compression_goal": "balanced",
+    "checksum": "md5",
+    "build_cache": False,
+    "rebuild": False,
+    "build_cache_size": 5120,
+    "build_cache_path": None,
+    "prune": None,
+    "prune_include": None,
+    "prune_exclude": None,
+    "prune_unused": False,
+    "prune_unused_commands": None,
+    "prune_manifest": None,
+    "payload_order": False,
+    "payload_order_commands": None,
+    "payload_chunks": 1,
+    "bytecode": False,
+    "bytecode_optimization": None,
+    "bytecode_keep_sources": True,
+    "zip_stdlib": False,
+    "zip_site_packages": False,
+    "trace": None,
+    "shared_runtime": False,
+    "shared_site_packages": False,
+    "dedupe": False,
+    "strip": False,
+    "wheelhouse": None,
+    "incremental": False,
+    "build_log": None,
+}
 
 
 def test_cli(monkeypatch: MonkeyPatch) -> None:
@@ -24,6 +64,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         False,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
 
     with mock.patch.object(packaged.cli, "create_package") as mocked:
@@ -41,6 +82,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         False,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
 
     with mock.patch.object(packaged.cli, "create_package") as mocked:
@@ -63,6 +105,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         False,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
     args = mocked.call_args[0]
     assert args[0].endswith("/mypackage")
@@ -83,6 +126,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         True,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
 
     # Test --quiet when CI is true, regardless of if the flag is passed
@@ -100,6 +144,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         True,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
     monkeypatch.setattr(os, "environ", {"CI": "1"})
     with mock.patch.object(packaged.cli, "create_package") as mocked:
@@ -117,6 +162,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         True,
         False,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
 
     # unset CI
@@ -136,6 +182,7 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         False,
         True,
         ["setup.py"],
+        **DEFAULT_OPTIONS,
     )
 
     with mock.patch.object(packaged.cli, "create_package") as mocked:
@@ -162,4 +209,366 @@ def test_cli(monkeypatch: MonkeyPatch) -> None:
         False,
         True,
         ["foo.py", "test/*.py"],
+        **DEFAULT_OPTIONS,
     )
+
+
+def test_cli_launch_cache() -> None:
+    """Ensures that `--launch-cache` is passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            ["./some", "pip install some", "python some.py", "--launch-cache"]
+        )
+
+    assert mocked.call_args.kwargs["launch_cache"] is True
+
+
+def test_cli_compression() -> None:
+    """Ensures that the compression flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--compression=auto",
+                "--compression-level=5",
+                "--compression-threads=0",
+                "--compression-goal=smallest",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["compression"] == "auto"
+    assert kwargs["compression_level"] == 5
+    assert kwargs["compression_threads"] == 0
+    assert kwargs["compression_goal"] == "smallest"
+
+
+def test_cli_checksum() -> None:
+    """Ensures that `--checksum` is passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            ["./some", "pip install some", "python some.py", "--checksum=sha256"]
+        )
+
+    assert mocked.call_args.kwargs["checksum"] == "sha256"
+
+
+def test_cli_build_cache() -> None:
+    """Ensures that the build cache flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--build-cache",
+                "--rebuild",
+                "--build-cache-size=100",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["build_cache"] is True
+    assert kwargs["rebuild"] is True
+    assert kwargs["build_cache_size"] == 100
+
+
+def test_cli_clear_build_cache() -> None:
+    """Ensures that `--clear-build-cache` clears the cache without building."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked_create:
+        with mock.patch.object(packaged.cli, "invalidate_build") as mocked:
+            assert packaged.cli.cli(["--clear-build-cache"]) == 0
+
+    mocked.assert_called_once_with()
+    mocked_create.assert_not_called()
+
+
+def test_cli_prune() -> None:
+    """Ensures that the pruning flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--prune",
+                "no-dev",
+                "no-gui",
+                "--prune-exclude",
+                "docs",
+                "--prune-include",
+                "docs/index.md",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["prune"] == ["no-dev", "no-gui"]
+    assert kwargs["prune_exclude"] == ["docs"]
+    assert kwargs["prune_include"] == ["docs/index.md"]
+
+
+def test_cli_payload_order() -> None:
+    """Ensures that the payload order flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--payload-order",
+                "--payload-order-command",
+                "python some.py --help",
+                "--payload-order-command",
+                "python some.py --version",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["payload_order"] is True
+    assert kwargs["payload_order_commands"] == [
+        "python some.py --help",
+        "python some.py --version",
+    ]
+
+
+def test_cli_payload_chunks() -> None:
+    """Ensures that the number of payload chunks is passed to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            ["./some", "pip install some", "python some.py", "--payload-chunks", "8"]
+        )
+
+    assert mocked.call_args.kwargs["payload_chunks"] == 8
+
+
+def test_cli_bytecode() -> None:
+    """Ensures that the bytecode flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--bytecode",
+                "--bytecode-optimization",
+                "0",
+                "2",
+                "--bytecode-drop-sources",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["bytecode"] is True
+    assert kwargs["bytecode_optimization"] == [0, 2]
+    assert kwargs["bytecode_keep_sources"] is False
+
+
+def test_cli_zip_stdlib() -> None:
+    """Ensures that the zip flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--zip-stdlib",
+                "--zip-site-packages",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["zip_stdlib"] is True
+    assert kwargs["zip_site_packages"] is True
+
+
+def test_cli_shared_runtime() -> None:
+    """Ensures that the shared runtime flags are passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            [
+                "./some",
+                "pip install some",
+                "python some.py",
+                "--shared-runtime",
+                "--shared-site-packages",
+            ]
+        )
+
+    kwargs = mocked.call_args.kwargs
+    assert kwargs["shared_runtime"] is True
+    assert kwargs["shared_site_packages"] is True
+
+
+def test_cli_delta() -> None:
+    """Ensures that `diff` and `apply` are handled before packaging options."""
+    with mock.patch.object(packaged.cli, "diff_packages") as mocked, mock.patch(
+        "os.path.getsize", return_value=0
+    ):
+        assert packaged.cli.cli(["diff", "old.bin", "new.bin", "-o", "patch"]) == 0
+
+    mocked.assert_called_with("old.bin", "new.bin", "patch")
+
+    with mock.patch.object(packaged.cli, "apply_patch") as mocked:
+        assert packaged.cli.cli(["apply", "old.bin", "patch", "-o", "new.bin"]) == 0
+
+    mocked.assert_called_with("old.bin", "patch", "new.bin")
+
+
+def test_cli_targets(tmp_path: Path) -> None:
+    """Ensures that every target is built, even when one of them fails."""
+    (tmp_path / "packaged.toml").write_text(
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "[[targets]]\n"
+        'output_path = "foo.bin"\n'
+        "[[targets]]\n"
+        'output_path = "foo-legacy.bin"\n'
+        'startup_command = "python -m foo --legacy"\n'
+        "[[targets]]\n"
+        'output_path = "foo-3.10.bin"\n'
+        'python_version = "3.10"\n',
+    )
+
+    def create_package(*args: object, **kwargs: object) -> None:
+        if args[4] == "3.10":
+            raise packaged.PythonNotAvailable("3.10")
+
+    with mock.patch.object(
+        packaged.cli, "create_package", side_effect=create_package
+    ) as mocked:
+        assert packaged.cli.cli([str(tmp_path)]) == 1
+
+    calls = {call.args[1]: call for call in mocked.call_args_list}
+    assert set(calls) == {"foo.bin", "foo-legacy.bin", "foo-3.10.bin"}
+    # The two targets with the same build share it through a build cache that
+    # only lasts for this run, rather than the user's build cache
+    assert calls["foo.bin"].kwargs["build_cache"] is True
+    assert calls["foo-legacy.bin"].kwargs["build_cache"] is True
+    assert calls["foo-3.10.bin"].kwargs["build_cache"] is False
+    run_cache_path = calls["foo.bin"].kwargs["build_cache_path"]
+    assert run_cache_path is not None
+    assert calls["foo-legacy.bin"].kwargs["build_cache_path"] == run_cache_path
+    assert calls["foo-3.10.bin"].kwargs["build_cache_path"] is None
+    assert not os.path.exists(run_cache_path)
+    assert all(call.args[5] is True for call in calls.values())
+
+
+def test_cli_trace(tmp_path: Path) -> None:
+    """Ensures that the trace is recorded, and written to the trace file."""
+    trace_path = tmp_path / "trace.json"
+
+    def create_package(*args: object, trace: Tracer, **kwargs: object) -> None:
+        with trace.span("build command"):
+            pass
+
+    with mock.patch.object(packaged.cli, "create_package", side_effect=create_package):
+        exit_code = packaged.cli.cli(
+            ["./some", "pip install some", "python some.py", "--trace", str(trace_path)]
+        )
+
+    assert exit_code == 0
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    assert [event["name"] for event in events if event["ph"] == "X"] == [
+        "build command"
+    ]
+
+
+def test_cli_incremental() -> None:
+    """Ensures that `--incremental` is passed on to `create_package()`."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        packaged.cli.cli(
+            ["./some", "pip install some", "python some.py", "--incremental"]
+        )
+
+    assert mocked.call_args.kwargs["incremental"] is True
+
+
+def test_cli_watch(tmp_path: Path) -> None:
+    """Ensures that `--watch` watches the source directory, excluding the output."""
+    with mock.patch.object(packaged.cli, "watch") as mocked:
+        exit_code = packaged.cli.cli(
+            [
+                str(tmp_path / "out.sh"),
+                "true",
+                "python some.py",
+                str(tmp_path),
+                "--watch",
+            ]
+        )
+
+    assert exit_code == 0
+    directory, _, exclude, _ = mocked.call_args.args
+    assert directory == str(tmp_path)
+    assert exclude == [str(tmp_path / "out.sh")]
+
+
+def test_cli_watch_config(tmp_path: Path) -> None:
+    """Ensures that `--watch` works before the path of a project with a config."""
+    (tmp_path / "packaged.toml").write_text(
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+    )
+    with mock.patch.object(packaged.cli, "watch") as mocked:
+        exit_code = packaged.cli.cli(["--watch", str(tmp_path)])
+
+    assert exit_code == 0
+    directory, _, _, _ = mocked.call_args.args
+    assert directory == str(tmp_path)
+
+
+def test_cli_invalid_config(tmp_path: Path, capsys: CaptureFixture[str]) -> None:
+    """Ensures that an invalid value in the config fails before building."""
+    (tmp_path / "packaged.toml").write_text(
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        'compression = "rar"\n'
+    )
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        assert packaged.cli.cli([str(tmp_path)]) == 3
+
+    mocked.assert_not_called()
+    assert "Invalid value for 'compression' in config" in capsys.readouterr().err
+
+
+def test_cli_invalid_compression_level(capsys: CaptureFixture[str]) -> None:
+    """Ensures that the command line is validated like the config file."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        with pytest.raises(SystemExit):
+            packaged.cli.cli(
+                [
+                    "./some",
+                    "pip install some",
+                    "python some.py",
+                    "--compression",
+                    "zstd",
+                    "--compression-level",
+                    "30",
+                ]
+            )
+
+    mocked.assert_not_called()
+    assert "--compression-level: expected a number from 1 to 19" in (
+        capsys.readouterr().err
+    )
+
+
+@pytest.mark.parametrize("chunks", ["0", "-2"])
+def test_cli_invalid_payload_chunks(chunks: str, capsys: CaptureFixture[str]) -> None:
+    """Ensures that fewer than one chunk is rejected, rather than ignored."""
+    with mock.patch.object(packaged.cli, "create_package") as mocked:
+        with pytest.raises(SystemExit):
+            packaged.cli.cli(
+                [
+                    "./some",
+                    "pip install some",
+                    "python some.py",
+                    f"--payload-chunks={chunks}",
+                ]
+            )
+
+    mocked.assert_not_called()
+    assert "--payload-chunks: expected a positive number" in capsys.readouterr().err
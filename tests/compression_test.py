@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import io
+from pathlib import Path
+import tarfile
+from unittest import mock
+
+import pytest
+
+from packaged import compression
+from packaged.compression import (
+    CompressionTrial,
+    CompressorNotAvailable,
+    choose_compression,
+    create_sample,
+    makeself_options,
+    pick_trial,
+)
+
+TRIALS = [
+    CompressionTrial("gzip", 9, 1000, 2.0, 0.5),
+    CompressionTrial("zstd", 3, 950, 0.6, 0.1),
+    CompressionTrial("zstd", 19, 800, 8.0, 0.1),
+    CompressionTrial("xz", 6, 700, 6.0, 1.5),
+    CompressionTrial("lz4", 9, 1500, 0.5, 0.05),
+]
+
+
+def test_makeself_options() -> None:
+    """Ensures that compression settings turn into `makeself.sh` flags."""
+    assert makeself_options("gzip", None, None) == ["--gzip"]
+    with mock.patch.object(compression, "is_available", return_value=True):
+        assert makeself_options("zstd", 19, 0) == [
+            "--zstd",
+            "--complevel",
+            "19",
+            "--threads",
+            "0",
+        ]
+
+
+def test_makeself_options_not_available() -> None:
+    """Ensures that a missing compressor raises `CompressorNotAvailable`."""
+    with mock.patch.object(compression, "is_available", return_value=False):
+        with pytest.raises(CompressorNotAvailable) as exc_info:
+            makeself_options("zstd", None, None)
+
+    assert exc_info.value.compression == "zstd"
+
+
+def test_pick_trial() -> None:
+    """Ensures that each goal picks the expected tradeoff."""
+    assert pick_trial(TRIALS, "smallest").compression == "xz"
+    assert pick_trial(TRIALS, "fastest-start").compression == "lz4"
+    assert pick_trial(TRIALS, "balanced") == TRIALS[1]
+
+
+def test_create_sample(tmp_path: Path) -> None:
+    """Ensures that the sample is spread across the tree, and stays small."""
+    for index in range(10):
+        (tmp_path / f"file{index}.txt").write_bytes(b"x" * 1000)
+
+    sample = create_sample(str(tmp_path), sample_size=5000)
+    with tarfile.open(fileobj=io.BytesIO(sample)) as tar:
+        names = tar.getnames()
+
+    assert names == ["file0.txt", "file2.txt", "file4.txt", "file6.txt", "file8.txt"]
+
+
+def test_choose_compression(tmp_path: Path) -> None:
+    """Ensures that `auto` compression picks one of the available compressors."""
+    (tmp_path / "foo.py").write_text("print('hello world')\n" * 1000)
+
+    with mock.patch.object(
+        compression,
+        "is_available",
+        side_effect=lambda name: name == "gzip",
+    ):
+        trial = choose_compression(str(tmp_path), "smallest")
+
+    assert trial.compression == "gzip"
+    assert trial.level == 9
+    assert trial.compressed_size < 22000
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from packaged import DEFAULT_CHECKSUM
+from packaged.config import (
+    ConfigValidationError,
+    DuplicateOutputPath,
+    parse_config,
+    parse_targets,
+)
+
+
+def write_config(directory: Path, contents: str) -> None:
+    """Writes a `packaged.toml` with the given contents in the directory."""
+    (directory / "packaged.toml").write_text(contents)
+
+
+def test_parse_config_defaults(tmp_path: Path) -> None:
+    """Ensures that optional keys get their defaults."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n',
+    )
+    config = parse_config(str(tmp_path))
+
+    assert config.source_directory == str(tmp_path)
+    assert config.output_path == "foo.bin"
+    assert config.python_version == "3.12"
+    assert config.pyc is False
+    assert config.launch_cache is False
+    assert config.checksum == DEFAULT_CHECKSUM
+    assert config.prune is None
+
+
+def test_parse_config_launch_cache(tmp_path: Path) -> None:
+    """Ensures that `launch_cache` is read from the config."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "launch_cache = true\n",
+    )
+    config = parse_config(str(tmp_path))
+
+    assert config.launch_cache is True
+
+
+def test_parse_config_prune(tmp_path: Path) -> None:
+    """Ensures that the pruning profiles and patterns are read from the config."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        'prune = ["minimal"]\n'
+        'prune_exclude = ["docs"]\n'
+        'prune_include = ["docs/index.md"]\n',
+    )
+    config = parse_config(str(tmp_path))
+
+    assert config.prune == ["minimal"]
+    assert config.prune_exclude == ["docs"]
+    assert config.prune_include == ["docs/index.md"]
+
+
+def test_parse_config_missing_key(tmp_path: Path) -> None:
+    """Ensures that a missing required key raises `ConfigValidationError`."""
+    write_config(tmp_path, 'output_path = "foo.bin"\n')
+
+    with pytest.raises(ConfigValidationError) as exc_info:
+        parse_config(str(tmp_path))
+
+    assert exc_info.value.key == "build_command"
+
+
+def test_parse_targets(tmp_path: Path) -> None:
+    """Ensures that each target overrides the keys at the top level."""
+    write_config(
+        tmp_path,
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "jobs = 2\n"
+        "[[targets]]\n"
+        'output_path = "foo-3.12.bin"\n'
+        "[[targets]]\n"
+        'output_path = "foo-3.10.bin"\n'
+        'python_version = "3.10"\n'
+        'startup_command = "python -m foo --legacy"\n',
+    )
+    configs, jobs = parse_targets(str(tmp_path))
+
+    assert jobs == 2
+    assert [config.output_path for config in configs] == [
+        "foo-3.12.bin",
+        "foo-3.10.bin",
+    ]
+    assert [config.python_version for config in configs] == ["3.12", "3.10"]
+    assert configs[0].startup_command == "python -m foo"
+    assert configs[1].startup_command == "python -m foo --legacy"
+    assert configs[1].build_command == "pip install ."
+
+
+def test_parse_targets_without_targets(tmp_path: Path) -> None:
+    """Ensures that a config without targets is a single target."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n',
+    )
+    configs, jobs = parse_targets(str(tmp_path))
+
+    assert configs == [parse_config(str(tmp_path))]
+    assert jobs is None
+
+
+def test_parse_targets_errors(tmp_path: Path) -> None:
+    """Ensures that targets are validated like a single config."""
+    write_config(
+        tmp_path,
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "[[targets]]\n"
+        'python_version = "3.10"\n',
+    )
+    with pytest.raises(ConfigValidationError):
+        parse_targets(str(tmp_path))
+
+    write_config(
+        tmp_path,
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "[[targets]]\n"
+        'output_path = "foo.bin"\n'
+        "[[targets]]\n"
+        'output_path = "./foo.bin"\n',
+    )
+    with pytest.raises(DuplicateOutputPath):
+        parse_targets(str(tmp_path))
+
+    # An unknown pruning profile in one target fails before any are built
+    write_config(
+        tmp_path,
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        "[[targets]]\n"
+        'output_path = "foo.bin"\n'
+        "[[targets]]\n"
+        'output_path = "foo-small.bin"\n'
+        'prune = ["minimall"]\n',
+    )
+    with pytest.raises(ConfigValidationError) as exc_info:
+        parse_targets(str(tmp_path))
+    assert exc_info.value.key == "prune"
+
+
+@pytest.mark.parametrize(
+    ("line", "key"),
+    [
+        ('compression = "rar"', "compression"),
+        ("compression_level = 0", "compression_level"),
+        ('compression = "xz"\ncompression_level = 12', "compression_level"),
+        ('compression_level = "9"', "compression_level"),
+        ('compression_goal = "fast"', "compression_goal"),
+        ("payload_chunks = 0", "payload_chunks"),
+        ("payload_chunks = true", "payload_chunks"),
+        ('checksum = "sha1"', "checksum"),
+        ('prune = ["minimal", "tiny"]', "prune"),
+        ('prune = "minimal"', "prune"),
+    ],
+)
+def test_parse_config_invalid_value(tmp_path: Path, line: str, key: str) -> None:
+    """Ensures that invalid values are rejected when the config is parsed."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n' + line + "\n",
+    )
+    with pytest.raises(ConfigValidationError) as exc_info:
+        parse_config(str(tmp_path))
+
+    assert exc_info.value.key == key
+    assert exc_info.value.reason is not None
+
+
+def test_parse_config_compression(tmp_path: Path) -> None:
+    """Ensures that valid compression options are read from the config."""
+    write_config(
+        tmp_path,
+        'output_path = "foo.bin"\n'
+        'build_command = "pip install ."\n'
+        'startup_command = "python -m foo"\n'
+        'compression = "zstd"\n'
+        "compression_level = 19\n"
+        'compression_goal = "smallest"\n'
+        "payload_chunks = 4\n",
+    )
+    config = parse_config(str(tmp_path))
+
+    assert config.compression == "zstd"
+    assert config.compression_level == 19
+    assert config.compression_goal == "smallest"
+    assert config.payload_chunks == 4
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import io
+import os
+from pathlib import Path
+import tarfile
+
+from packaged.archive import add_tree
+from packaged.dedupe import dedupe_tree
+
+
+def test_dedupe_tree(tmp_path: Path) -> None:
+    """Ensures that only files with the same contents and mode are linked."""
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a" / "LICENSE").write_text("MIT License\n" * 100)
+    (tmp_path / "b" / "LICENSE").write_text("MIT License\n" * 100)
+    (tmp_path / "b" / "COPYING").write_text("MIT License\n" * 100)
+    (tmp_path / "b" / "NOTICE").write_text("BSD License\n" * 100)
+    (tmp_path / "lib.so").write_text("MIT License\n" * 100)
+    (tmp_path / "lib.so").chmod(0o755)
+    (tmp_path / "a" / "empty").touch()
+    (tmp_path / "b" / "empty").touch()
+    (tmp_path / "link").symlink_to("lib.so")
+
+    report = dedupe_tree(str(tmp_path), jobs=2)
+
+    assert report.files == 2
+    assert report.bytes == 2400
+    assert report.duplicates == {os.path.join("a", "LICENSE"): 2400}
+    license_path = tmp_path / "a" / "LICENSE"
+    assert os.path.samefile(license_path, tmp_path / "b" / "LICENSE")
+    assert os.path.samefile(license_path, tmp_path / "b" / "COPYING")
+    assert not os.path.samefile(license_path, tmp_path / "b" / "NOTICE")
+    assert not os.path.samefile(license_path, tmp_path / "lib.so")
+    assert not os.path.samefile(tmp_path / "a" / "empty", tmp_path / "b" / "empty")
+    assert (tmp_path / "link").is_symlink()
+
+    # Running it again finds nothing new to link
+    assert dedupe_tree(str(tmp_path)).files == 0
+
+    # Duplicates are stored as links to the first copy in the tarball
+    tarball = io.BytesIO()
+    with tarfile.open(fileobj=tarball, mode="w|") as tar:
+        add_tree(tar, str(tmp_path), ".")
+
+    tarball.seek(0)
+    with tarfile.open(fileobj=tarball) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+
+    assert members["./a/LICENSE"].isfile()
+    assert members["./b/LICENSE"].islnk()
+    assert members["./b/LICENSE"].linkname == "./a/LICENSE"
+    assert members["./b/COPYING"].islnk()
+    assert members["./b/NOTICE"].isfile()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from packaged.archive import write_package
+from packaged.compression import is_available
+from packaged.delta import (
+    LayeredPackage,
+    PatchDoesNotApply,
+    apply_patch,
+    diff_packages,
+)
+
+
+def build(directory: Path, output_path: Path, compression: str = "gzip") -> str:
+    """Writes a package of the directory, like `create_package()` does."""
+    write_package(
+        str(output_path),
+        [(str(directory), ".")],
+        [f"--{compression}"],
+        label="test package",
+        startup_script="./startup.sh",
+        compression=compression,
+        compression_level=None,
+        compression_threads=None,
+        checksum="md5",
+    )
+    return str(output_path)
+
+
+@pytest.fixture
+def packages(tmp_path: Path) -> tuple[str, str]:
+    """Builds two versions of a package, where a few files have changed."""
+    old = tmp_path / "old"
+    (old / "lib").mkdir(parents=True)
+    (old / "startup.sh").write_text("cat lib/version.txt\n")
+    (old / "startup.sh").chmod(0o755)
+    (old / "lib" / "version.txt").write_text("1.0\n")
+    (old / "lib" / "library.bin").write_bytes(os.urandom(512 * 1024))
+
+    new = tmp_path / "new"
+    (new / "lib").mkdir(parents=True)
+    (new / "startup.sh").write_text("cat lib/version.txt\n")
+    (new / "startup.sh").chmod(0o755)
+    (new / "lib" / "version.txt").write_text("2.0\n")
+    # Changed at the end, so most of its chunks are the same as before
+    library = (old / "lib" / "library.bin").read_bytes()
+    (new / "lib" / "library.bin").write_bytes(library + b"more data")
+    (new / "lib" / "added.txt").write_text("Added in 2.0\n")
+
+    return build(old, tmp_path / "old.bin"), build(new, tmp_path / "new.bin")
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd", "xz"])
+def test_diff_and_apply(tmp_path: Path, compression: str) -> None:
+    """Ensures that applying the patch gives back the exact same package."""
+    if not is_available(compression):
+        pytest.skip(f"{compression} is not installed")
+
+    old_directory = tmp_path / "old"
+    old_directory.mkdir()
+    (old_directory / "startup.sh").write_text("echo 1.0\n")
+    (old_directory / "data.bin").write_bytes(os.urandom(256 * 1024))
+    new_directory = tmp_path / "new"
+    new_directory.mkdir()
+    (new_directory / "startup.sh").write_text("echo 2.0\n")
+    (new_directory / "data.bin").write_bytes((old_directory / "data.bin").read_bytes())
+    old_path = build(old_directory, tmp_path / "old.bin", compression)
+    new_path = build(new_directory, tmp_path / "new.bin", compression)
+    patch_path = str(tmp_path / "patch")
+    output_path = str(tmp_path / "output.bin")
+
+    stats = diff_packages(old_path, new_path, patch_path)
+    apply_patch(old_path, patch_path, output_path)
+
+    assert stats.copied_bytes >= 256 * 1024
+    assert Path(output_path).read_bytes() == Path(new_path).read_bytes()
+    assert os.access(output_path, os.X_OK)
+
+
+def test_patch_size(packages: tuple[str, str], tmp_path: Path) -> None:
+    """Ensures that unchanged files and chunks are not stored in the patch."""
+    old_path, new_path = packages
+    patch_path = str(tmp_path / "patch")
+    output_path = str(tmp_path / "output.bin")
+
+    diff_packages(old_path, new_path, patch_path)
+    apply_patch(old_path, patch_path, output_path)
+
+    assert Path(output_path).read_bytes() == Path(new_path).read_bytes()
+    assert os.path.getsize(patch_path) < os.path.getsize(new_path) // 10
+
+
+def test_apply_to_wrong_package(packages: tuple[str, str], tmp_path: Path) -> None:
+    """Ensures that a patch is only applied to the package it was made from."""
+    old_path, new_path = packages
+    patch_path = str(tmp_path / "patch")
+    output_path = str(tmp_path / "output.bin")
+    diff_packages(old_path, new_path, patch_path)
+
+    with pytest.raises(PatchDoesNotApply):
+        apply_patch(new_path, patch_path, output_path)
+
+    assert not os.path.exists(output_path)
+
+
+def test_diff_layered_package(tmp_path: Path) -> None:
+    """Ensures that packages with a shared runtime layer are rejected."""
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "run.sh").write_text("echo hello\n")
+    (source / "runtime.txt").write_text("runtime\n")
+    package_path = str(tmp_path / "layered.bin")
+    write_package(
+        package_path,
+        [(str(source), ".")],
+        [],
+        label="layered",
+        startup_script="./run.sh",
+        compression="gzip",
+        compression_level=None,
+        compression_threads=None,
+        checksum="md5",
+        runtime_layer=lambda name: name == "./runtime.txt",
+    )
+
+    with pytest.raises(LayeredPackage):
+        diff_packages(package_path, package_path, str(tmp_path / "patch"))
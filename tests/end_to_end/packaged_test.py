@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import contextlib
 import os
+from pathlib import Path
 import subprocess
+import time
 from typing import Iterator
+import zipfile
+
+import pytest
 
 import packaged
+import packaged.build_cache
 import packaged.config
 
 
@@ -68,6 +75,9 @@ def test_numpy_pandas() -> None:
     ):
         assert "0   -2.222222\ndtype: float64" in get_output(executable_path)
 
+    # The source directory itself should be left untouched
+    assert sorted(os.listdir(package_path)) == ["somefile.py"]
+
 
 def test_config_parsing() -> None:
     """Packages `configtest` to ensure config parsing works as expected."""
@@ -94,3 +104,141 @@ def test_console_scripts() -> None:
         "./script.zxpy",
     ):
         assert "hello world!" in get_output(executable_path)
+
+
+def test_concurrent_async_builds(tmp_path: Path) -> None:
+    """Builds the same project twice at the same time, with the async API."""
+    package_path = os.path.join(TEST_PACKAGES, "just_python")
+    output_paths = [str(tmp_path / "first.bin"), str(tmp_path / "second.bin")]
+
+    async def build_both() -> list[packaged.BuildResult]:
+        return await asyncio.gather(
+            *(
+                packaged.create_package_async(
+                    package_path,
+                    output_path,
+                    "",
+                    "python foo.py",
+                    packaged.DEFAULT_PYTHON_VERSION,
+                    quiet=True,
+                )
+                for output_path in output_paths
+            )
+        )
+
+    results = asyncio.run(build_both())
+    for output_path, result in zip(output_paths, results):
+        assert result.output_path == output_path
+        assert result.size == os.path.getsize(output_path)
+        assert "write package" in result.timings
+        assert "Although practicality beats purity." in get_output(output_path)
+
+    # The source directory itself should be left untouched
+    assert sorted(os.listdir(package_path)) == ["foo.py"]
+
+
+def test_cancel_async_build(tmp_path: Path) -> None:
+    """Ensures that cancelling a build kills its build command, and cleans up."""
+    output_path = str(tmp_path / "cancelled.bin")
+    marker_path = tmp_path / "marker"
+
+    async def build_and_cancel() -> None:
+        build = asyncio.ensure_future(
+            packaged.create_package_async(
+                None,
+                output_path,
+                f"sleep 2 && touch {marker_path}",
+                "python -c pass",
+                packaged.DEFAULT_PYTHON_VERSION,
+                quiet=True,
+            )
+        )
+        await asyncio.sleep(1)
+        build.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await build
+
+    asyncio.run(build_and_cancel())
+    time.sleep(2)
+    assert not marker_path.exists()
+    assert not os.path.exists(output_path)
+
+
+def test_build_cache_outputs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Ensures that a package restored from the build cache has everything that
+    the build command wrote into the package, and not just the packaged Python.
+    """
+    monkeypatch.setattr(
+        packaged.build_cache, "BUILD_CACHE_PATH", str(tmp_path / "cache")
+    )
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "main.py").write_text("import sys\nsys.path.append('lib')\nimport mod\n")
+    build_command = "mkdir lib && echo \"print('built module')\" > lib/mod.py"
+
+    for name in ("first", "second"):
+        output_path = str(tmp_path / f"{name}.bin")
+        result = packaged.create_package(
+            str(source),
+            output_path,
+            build_command,
+            "python main.py",
+            packaged.DEFAULT_PYTHON_VERSION,
+            quiet=True,
+            build_cache=True,
+        )
+        assert "built module" in get_output(output_path)
+
+    # The second build was restored from the cache
+    assert "build command" not in result.timings
+
+
+@pytest.mark.parametrize(
+    ("build_command", "compiled"),
+    [("pip install demo-pkg", True), ("pip install --no-compile demo-pkg", False)],
+)
+def test_wheelhouse_bytecode(
+    tmp_path: Path, build_command: str, compiled: bool
+) -> None:
+    """
+    Ensures that the packages installed from a wheelhouse are compiled like pip
+    would, unless the build command says not to.
+    """
+    wheelhouse = tmp_path / "wheels"
+    wheelhouse.mkdir()
+    with zipfile.ZipFile(wheelhouse / "demo_pkg-1.0-py3-none-any.whl", "w") as wheel:
+        wheel.writestr("demo_pkg/__init__.py", "print('hello')\n")
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/WHEEL",
+            "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/METADATA",
+            "Metadata-Version: 2.1\nName: demo-pkg\nVersion: 1.0\n",
+        )
+        wheel.writestr("demo_pkg-1.0.dist-info/RECORD", "")
+
+    source = tmp_path / "source"
+    source.mkdir()
+    # Checked before importing it, which would compile it
+    (source / "main.py").write_text(
+        "import glob\n"
+        "pattern = '.packaged_python/**/site-packages/demo_pkg/__pycache__/*.pyc'\n"
+        "print('compiled:', bool(glob.glob(pattern, recursive=True)))\n"
+        "import demo_pkg\n"
+    )
+    output_path = str(tmp_path / "demo.bin")
+    packaged.create_package(
+        str(source),
+        output_path,
+        build_command,
+        "python main.py",
+        packaged.DEFAULT_PYTHON_VERSION,
+        quiet=True,
+        wheelhouse=str(wheelhouse),
+    )
+
+    output = get_output(output_path)
+    assert f"compiled: {compiled}" in output
+    assert "hello" in output
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from packaged.archive import write_package
+from packaged.launch_trace import read_launch_trace, startup_script
+
+
+def build(tmp_path: Path, startup_command: str) -> str:
+    """Writes a package that runs the startup command through the startup script."""
+    package = tmp_path / "package"
+    package.mkdir()
+    (package / "startup.sh").write_text(startup_script("bin", startup_command))
+    (package / "startup.sh").chmod(0o755)
+
+    output_path = str(tmp_path / "package.bin")
+    write_package(
+        output_path,
+        [(str(package), ".")],
+        [],
+        label="test package",
+        startup_script="./startup.sh",
+        compression="gzip",
+        compression_level=None,
+        compression_threads=None,
+        checksum="md5",
+    )
+    return output_path
+
+
+def test_launch_trace(tmp_path: Path) -> None:
+    """Ensures that every launch stage is traced, and the exit code is kept."""
+    output_path = build(tmp_path, "echo Hello\nexit 3")
+    trace_path = str(tmp_path / "trace.jsonl")
+
+    result = subprocess.run(
+        [output_path, "--quiet"],
+        env={**os.environ, "PACKAGED_TRACE": trace_path},
+        capture_output=True,
+    )
+
+    assert result.returncode == 3
+    assert result.stdout == b"Hello\n"
+    trace = read_launch_trace(trace_path)
+    assert list(trace.stages) == ["launcher", "extract", "app"]
+    assert trace.total >= trace.stages["launcher"] + trace.stages["app"]
+    assert trace.imports == []
+
+
+def test_launch_trace_imports(tmp_path: Path) -> None:
+    """Ensures that imports are traced, while other stderr output is kept."""
+    output_path = build(
+        tmp_path,
+        f'"{sys.executable}" -c "import json, sys; print(\'oops\', file=sys.stderr)"',
+    )
+    trace_path = str(tmp_path / "trace.jsonl")
+
+    result = subprocess.run(
+        [output_path, "--quiet"],
+        env={**os.environ, "PACKAGED_TRACE": trace_path, "PACKAGED_TRACE_IMPORTS": "1"},
+        capture_output=True,
+    )
+
+    assert result.returncode == 0
+    assert result.stderr == b"oops\n"
+    trace = read_launch_trace(trace_path)
+    imports = {module: depth for module, _, _, depth in trace.imports}
+    assert imports["json"] == 0
+    assert imports["json.decoder"] == 1
+    assert "json" in trace.summary()
+
+
+def test_no_trace(tmp_path: Path) -> None:
+    """Ensures that nothing is written without `PACKAGED_TRACE`."""
+    output_path = build(tmp_path, "echo Hello")
+    env = {key: value for key, value in os.environ.items() if key != "PACKAGED_TRACE"}
+
+    output = subprocess.check_output([output_path, "--quiet"], env=env, cwd=tmp_path)
+
+    assert output == b"Hello\n"
+    assert sorted(os.listdir(tmp_path)) == ["package", "package.bin"]
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from packaged.prune import (
+    PruneProfileNotFound,
+    compile_pattern,
+    profile_patterns,
+    prune_tree,
+    prune_unused,
+)
+
+
+def create_files(directory: Path, paths: list[str]) -> None:
+    """Creates files with a few bytes in them at the given paths."""
+    for path in paths:
+        file_path = directory / path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text("1234")
+
+
+def list_files(directory: Path) -> list[str]:
+    """Lists all the files in the directory, relative to it."""
+    return sorted(
+        os.path.relpath(os.path.join(root, filename), directory)
+        for root, _, filenames in os.walk(directory)
+        for filename in filenames
+    )
+
+
+def test_compile_pattern() -> None:
+    """Ensures that `*` stays within a segment, and `**` spans segments."""
+    assert compile_pattern("lib/*.a").match("lib/libpython3.12.a")
+    assert not compile_pattern("lib/*.a").match("lib/python3.12/foo.a")
+    assert compile_pattern("site-packages/**/tests").match("site-packages/tests")
+    assert compile_pattern("site-packages/**/tests").match("site-packages/a/b/tests")
+    assert not compile_pattern("site-packages/**/tests").match("site-packages/a/xtests")
+    assert compile_pattern("docs/**").match("docs/a/b.md")
+
+
+def test_profile_patterns() -> None:
+    """Ensures that profiles are made relative to the packaged Python."""
+    patterns = profile_patterns(["no-dev", "minimal"], ".packaged_python")
+
+    assert ".packaged_python/python/include" in patterns
+    assert ".packaged_python/python/lib/python3.*/tkinter" in patterns
+    assert len(patterns) == len(set(patterns))
+
+    with pytest.raises(PruneProfileNotFound) as exc_info:
+        profile_patterns(["no-docs"], ".packaged_python")
+
+    assert exc_info.value.profile == "no-docs"
+
+
+def test_prune_tree(tmp_path: Path) -> None:
+    """Ensures that matching files are removed, and reported."""
+    create_files(
+        tmp_path,
+        [
+            "main.py",
+            "docs/index.md",
+            "docs/api/foo.md",
+            ".packaged_python/python/include/Python.h",
+            ".packaged_python/python/lib/python3.12/os.py",
+            ".packaged_python/python/lib/python3.12/test/test_os.py",
+            ".packaged_python/python/lib/python3.12/tkinter/__init__.py",
+            ".packaged_python/python/lib/python3.12/tkinter/test/test_tk.py",
+            ".packaged_python/python/lib/python3.12/site-packages/foo/__init__.py",
+            ".packaged_python/python/lib/python3.12/site-packages/foo/a/tests/t.py",
+        ],
+    )
+    exclude = [
+        *profile_patterns(["no-dev", "no-gui"], ".packaged_python"),
+        "docs",
+    ]
+    include = [".packaged_python/python/lib/python3.*/tkinter", "docs/index.md"]
+
+    report = prune_tree(str(tmp_path), exclude, include)
+
+    assert list_files(tmp_path) == [
+        ".packaged_python/python/lib/python3.12/os.py",
+        ".packaged_python/python/lib/python3.12/site-packages/foo/__init__.py",
+        ".packaged_python/python/lib/python3.12/tkinter/__init__.py",
+        "docs/index.md",
+        "main.py",
+    ]
+    # Folders that were emptied out are removed as well
+    assert not (tmp_path / ".packaged_python/python/include").exists()
+    assert not (tmp_path / "docs/api").exists()
+
+    assert report.total_files == 5
+    assert report.total_bytes == 20
+    assert report.files["docs"] == 1
+    assert report.files[".packaged_python/python/lib/python3.*/*/test"] == 1
+
+
+def test_prune_unused(tmp_path: Path) -> None:
+    """
+    Ensures that only the unused files of the packaged Python are removed, and
+    that modules are kept as both source and bytecode.
+    """
+    stdlib = ".packaged_python/python/lib/python3.12"
+    create_files(
+        tmp_path,
+        [
+            "main.py",
+            ".packaged_python/python/bin/python3.12",
+            f"{stdlib}/os.py",
+            f"{stdlib}/__pycache__/os.cpython-312.pyc",
+            f"{stdlib}/json/__init__.py",
+            f"{stdlib}/json/__pycache__/__init__.cpython-312.pyc",
+            f"{stdlib}/json/decoder.py",
+            f"{stdlib}/json/__pycache__/decoder.cpython-312.pyc",
+            f"{stdlib}/tkinter/__init__.py",
+            f"{stdlib}/lib-dynload/_json.cpython-312-x86_64-linux-gnu.so",
+            f"{stdlib}/lib-dynload/_tkinter.cpython-312-x86_64-linux-gnu.so",
+            f"{stdlib}/site-packages/foo/__init__.py",
+            f"{stdlib}/site-packages/foo/data.json",
+            f"{stdlib}/site-packages/foo/unused.json",
+        ],
+    )
+    used = {
+        "main.py",
+        f"{stdlib}/__pycache__/os.cpython-312.pyc",
+        f"{stdlib}/json/__init__.py",
+        f"{stdlib}/lib-dynload/_json.cpython-312-x86_64-linux-gnu.so",
+        f"{stdlib}/site-packages/foo/__init__.py",
+        f"{stdlib}/site-packages/foo/data.json",
+    }
+
+    manifest = prune_unused(
+        str(tmp_path),
+        [".packaged_python/python/lib/python3.*"],
+        used,
+        [".packaged_python/python/lib/python3.*/tkinter"],
+    )
+
+    assert list_files(tmp_path) == [
+        ".packaged_python/python/bin/python3.12",
+        f"{stdlib}/__pycache__/os.cpython-312.pyc",
+        f"{stdlib}/json/__init__.py",
+        f"{stdlib}/json/__pycache__/__init__.cpython-312.pyc",
+        f"{stdlib}/lib-dynload/_json.cpython-312-x86_64-linux-gnu.so",
+        f"{stdlib}/os.py",
+        f"{stdlib}/site-packages/foo/__init__.py",
+        f"{stdlib}/site-packages/foo/data.json",
+        f"{stdlib}/tkinter/__init__.py",
+        "main.py",
+    ]
+    assert sorted(manifest.removed) == [
+        f"{stdlib}/json/__pycache__/decoder.cpython-312.pyc",
+        f"{stdlib}/json/decoder.py",
+        f"{stdlib}/lib-dynload/_tkinter.cpython-312-x86_64-linux-gnu.so",
+        f"{stdlib}/site-packages/foo/unused.json",
+    ]
+    assert manifest.total_bytes == 16
+    assert len(manifest.kept) == 8
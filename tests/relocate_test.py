@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from pytest import MonkeyPatch
+
+import packaged.relocate
+from packaged.relocate import relocate_tree
+
+
+def test_relocate_tree(tmp_path: Path) -> None:
+    """Ensures that every kind of embedded build path is rewritten."""
+    build_root = tmp_path / "staging"
+    package = build_root / "build-abc" / "myapp"
+    python = package / ".packaged_python" / "python"
+    bin_folder = python / "bin"
+    site_packages = python / "lib" / "python3.12" / "site-packages"
+    dist_info = site_packages / "myapp-1.0.dist-info"
+    for folder in (bin_folder, dist_info, package / "venv" / "bin"):
+        folder.mkdir(parents=True)
+
+    python_path = bin_folder / "python3.12"
+    (bin_folder / "myapp").write_text(f"#!{python_path}\nimport myapp\nmyapp.main()\n")
+    (bin_folder / "myapp").chmod(0o755)
+    (package / "venv" / "bin" / "tool").write_text(
+        f"#!/bin/sh\n'''exec' {python_path} \"$0\" \"$@\"\n' '''\nimport tool\n"
+    )
+    (site_packages / "myapp.pth").write_text(f"{package}/src\n")
+    (dist_info / "RECORD").write_text(f"{bin_folder}/myapp,sha256=abc,10\n")
+    (dist_info / "direct_url.json").write_text(f'{{"url": "file://{package}"}}')
+    (site_packages / "finder.py").write_text(f"MAPPING = {{'myapp': '{package}'}}\n")
+    (site_packages / "cached.pyc").write_bytes(b"\0" + str(package).encode())
+    (site_packages / "other.py").write_text("import os\n")
+
+    report = relocate_tree(str(package), str(build_root), jobs=4)
+
+    assert report.scanned == 8
+    assert report.changed == {
+        ".packaged_python/python/bin/myapp": "shebang",
+        "venv/bin/tool": "shebang",
+        ".packaged_python/python/lib/python3.12/site-packages/myapp.pth": (
+            "relative paths"
+        ),
+        ".packaged_python/python/lib/python3.12/site-packages/myapp-1.0.dist-info/RECORD": (
+            "relative paths"
+        ),
+        ".packaged_python/python/lib/python3.12/site-packages/myapp-1.0.dist-info/direct_url.json": (
+            "removed"
+        ),
+    }
+    assert report.unrelocated == [
+        ".packaged_python/python/lib/python3.12/site-packages/finder.py"
+    ]
+
+    assert (bin_folder / "myapp").read_text() == (
+        "#!/usr/bin/env python\nimport myapp\nmyapp.main()\n"
+    )
+    assert os.access(bin_folder / "myapp", os.X_OK)
+    assert (package / "venv" / "bin" / "tool").read_text() == (
+        "#!/usr/bin/env python\nimport tool\n"
+    )
+    assert (site_packages / "myapp.pth").read_text() == "../../../../../src\n"
+    assert (dist_info / "RECORD").read_text() == (
+        "../../../../../.packaged_python/python/bin/myapp,sha256=abc,10\n"
+    )
+    assert not (dist_info / "direct_url.json").exists()
+    assert not any(name.startswith(".relocate-") for name in os.listdir(bin_folder))
+
+
+def test_relocate_tree_restored_build(tmp_path: Path) -> None:
+    """Ensures that paths of other builds, like cached ones, are found too."""
+    build_root = tmp_path / "staging"
+    package = build_root / "build-new" / "myapp"
+    package.mkdir(parents=True)
+    old_package = build_root / "build-old" / "myapp"
+    (package / "old.pth").write_text(f"{old_package}/lib\n")
+    (package / "unrelated.pth").write_text(f"{tmp_path}/lib\n")
+
+    report = relocate_tree(str(package), str(build_root))
+
+    assert report.changed == {"old.pth": "relative paths"}
+    assert (package / "old.pth").read_text() == "./lib\n"
+    assert (package / "unrelated.pth").read_text() == f"{tmp_path}/lib\n"
+
+
+def test_relocate_tree_breaks_hardlinks(tmp_path: Path) -> None:
+    """Ensures that hardlinked files are replaced, leaving the original as is."""
+    build_root = tmp_path / "staging"
+    package = build_root / "build-abc" / "myapp"
+    package.mkdir(parents=True)
+    original = tmp_path / "original"
+    original.write_text(f"#!{package}/bin/python\nprint('hi')\n")
+    os.link(original, package / "script")
+
+    relocate_tree(str(package), str(build_root))
+
+    assert (package / "script").read_text() == "#!/usr/bin/env python\nprint('hi')\n"
+    assert original.read_text() == f"#!{package}/bin/python\nprint('hi')\n"
+
+
+def test_relocate_tree_chunk_boundaries(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    """Ensures that build paths split between the chunks a file is read in are found."""
+    monkeypatch.setattr(packaged.relocate, "CHUNK_SIZE", 16)
+    build_root = tmp_path / "staging"
+    package = build_root / "build-abc" / "myapp"
+    package.mkdir(parents=True)
+    # Every position of the build path relative to the chunks
+    for offset in range(16):
+        (package / f"binary-{offset}").write_bytes(
+            b"\0" * offset + f"{package}/lib\0".encode() + b"\0" * 32
+        )
+    # The build path, other than its trailing slash
+    (package / "partial").write_bytes(str(build_root).encode())
+
+    report = relocate_tree(str(package), str(build_root))
+
+    assert sorted(report.unrelocated) == sorted(
+        f"binary-{offset}" for offset in range(16)
+    )
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from packaged.staging import is_unmodified_by_builds, populate_tree
+
+
+def test_is_unmodified_by_builds() -> None:
+    """Ensures that scripts and installed packages are not hardlinked."""
+    assert is_unmodified_by_builds("python/lib/python3.12/os.py")
+    assert is_unmodified_by_builds("python/lib/libpython3.12.so")
+    assert not is_unmodified_by_builds("python/bin/pip")
+    assert not is_unmodified_by_builds(
+        "python/lib/python3.12/site-packages/pip/__init__.py"
+    )
+
+
+def test_populate_tree(tmp_path: Path) -> None:
+    """Ensures that the tree is recreated, hardlinking only the allowed files."""
+    source = tmp_path / "source"
+    (source / "lib").mkdir(parents=True)
+    (source / "bin").mkdir()
+    (source / "lib" / "os.py").write_text("import sys\n")
+    (source / "bin" / "pip").write_text("#!/bin/sh\n")
+    (source / "bin" / "pip").chmod(0o755)
+    (source / "bin" / "pip3").symlink_to("pip")
+    (source / "lib64").symlink_to("lib")
+
+    destination = tmp_path / "destination"
+    stats = populate_tree(
+        str(source),
+        str(destination),
+        can_hardlink=lambda path: path.startswith("lib"),
+    )
+
+    assert stats.hardlinked == 1
+    assert stats.reflinked + stats.copied == 1
+    assert os.path.samefile(destination / "lib" / "os.py", source / "lib" / "os.py")
+    assert not os.path.samefile(destination / "bin" / "pip", source / "bin" / "pip")
+    assert (destination / "bin" / "pip").read_text() == "#!/bin/sh\n"
+    assert os.access(destination / "bin" / "pip", os.X_OK)
+    assert os.readlink(destination / "bin" / "pip3") == "pip"
+    assert os.readlink(destination / "lib64") == "lib"
+
+
+def test_populate_tree_without_hardlinks(tmp_path: Path) -> None:
+    """Ensures that nothing is hardlinked unless asked for."""
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "foo.py").write_text("print('hello')\n")
+
+    destination = tmp_path / "destination"
+    stats = populate_tree(str(source), str(destination))
+
+    assert stats.hardlinked == 0
+    assert not os.path.samefile(destination / "foo.py", source / "foo.py")
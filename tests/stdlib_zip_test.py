@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from pathlib import Path
+import subprocess
+import sys
+import zipfile
+
+from packaged.stdlib_zip import zip_modules
+
+
+def create_python(prefix: Path) -> Path:
+    """Creates a fake Python install, with a few modules and packages."""
+    python_path = prefix / "bin" / "python3"
+    python_path.parent.mkdir(parents=True)
+    python_path.symlink_to(sys.executable)
+
+    stdlib = prefix / "lib" / "python3.12"
+    (stdlib / "json").mkdir(parents=True)
+    (stdlib / "os.py").write_text("")
+    (stdlib / "shlex.py").write_text("VALUE = 'shlex'\n")
+    (stdlib / "json" / "__init__.py").write_text("VALUE = 'json'\n")
+    (stdlib / "venv").mkdir()
+    (stdlib / "venv" / "__init__.py").write_text("")
+    (stdlib / "lib-dynload").mkdir()
+    (stdlib / "lib-dynload" / "_json.so").write_text("")
+
+    site_packages = stdlib / "site-packages"
+    (site_packages / "pure").mkdir(parents=True)
+    (site_packages / "pure" / "__init__.py").write_text("VALUE = 'pure'\n")
+    (site_packages / "native").mkdir()
+    (site_packages / "native" / "__init__.py").write_text("")
+    (site_packages / "native" / "_speedups.so").write_text("")
+    return python_path
+
+
+def test_zip_modules(tmp_path: Path) -> None:
+    """Ensures that only pure Python modules are moved into the zip."""
+    python_path = create_python(tmp_path)
+
+    stats = zip_modules(str(python_path), site_packages=True)
+
+    assert stats.zip_path == str(tmp_path / "lib" / "python312.zip")
+    with zipfile.ZipFile(stats.zip_path) as zip_file:
+        assert sorted(zip_file.namelist()) == [
+            "json/__init__.pyc",
+            "pure/__init__.pyc",
+            "shlex.pyc",
+        ]
+    assert stats.modules == 3
+
+    stdlib = tmp_path / "lib" / "python3.12"
+    assert (stdlib / "os.py").exists()
+    assert (stdlib / "venv" / "__init__.py").exists()
+    assert (stdlib / "lib-dynload" / "_json.so").exists()
+    assert not (stdlib / "json").exists()
+    assert not (stdlib / "shlex.py").exists()
+    assert (stdlib / "site-packages" / "native" / "_speedups.so").exists()
+    assert not (stdlib / "site-packages" / "pure").exists()
+    # Three modules were zipped, into one zip file
+    assert stats.files_before - stats.files_after == 2
+
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.path.insert(0, sys.argv[1]);"
+            "import json, pure, shlex; print(json.VALUE, pure.VALUE, shlex.VALUE)",
+            stats.zip_path,
+        ],
+    )
+    assert output == b"json pure shlex\n"
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+import pytest
+
+from packaged.strip import ELF_SIGNATURE_MARKER, strip_command, strip_tree
+
+
+@pytest.mark.skipif(
+    shutil.which("cc") is None or shutil.which("strip") is None,
+    reason="needs a C compiler and strip",
+)
+def test_strip_tree(tmp_path: Path) -> None:
+    """Ensures that binaries are stripped, except for signed ones."""
+    source = tmp_path / "lib.c"
+    source.write_text("int add(int a, int b) { return a + b; }\n")
+    library = tmp_path / "lib.so"
+    subprocess.run(
+        ["cc", "-g", "-shared", "-fPIC", "-o", str(library), str(source)], check=True
+    )
+
+    package = tmp_path / "package"
+    site_packages = package / "python" / "lib" / "site-packages"
+    (site_packages / "mylib").mkdir(parents=True)
+    stripped_path = site_packages / "mylib" / "_native.so"
+    # Hardlinked to the original, like the files in yen's copy of Python are
+    os.link(library, stripped_path)
+    signed_path = package / "python" / "signed.so"
+    signed_path.write_bytes(library.read_bytes() + ELF_SIGNATURE_MARKER)
+    (site_packages / "mylib" / "__init__.py").write_text("from ._native import *\n")
+
+    report = strip_tree(str(package), strip_command())
+
+    assert report.files == {"mylib": 1}
+    assert (
+        report.bytes["mylib"] == library.stat().st_size - stripped_path.stat().st_size
+    )
+    assert report.bytes["mylib"] > 0
+    assert report.signed == [os.path.join("python", "signed.so")]
+    assert report.failed == []
+    assert not os.path.samefile(library, stripped_path)
+    assert signed_path.read_bytes() == library.read_bytes() + ELF_SIGNATURE_MARKER
+    assert os.access(stripped_path, os.X_OK) == os.access(library, os.X_OK)
+
+    # There's nothing left to strip the second time
+    assert strip_tree(str(package), strip_command()).total_files == 0
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import threading
+
+from packaged.trace import Tracer
+
+
+def test_span() -> None:
+    """Ensures that spans are recorded with their details, even on errors."""
+    tracer = Tracer()
+    with tracer.span("populate", source="src") as details:
+        details["files"] = 3
+
+    try:
+        with tracer.span("build"):
+            raise ValueError
+    except ValueError:
+        pass
+
+    assert [span.name for span in tracer.spans] == ["populate", "build"]
+    assert tracer.spans[0].args == {"source": "src", "files": 3}
+    assert tracer.spans[1].start >= tracer.spans[0].start + tracer.spans[0].duration
+
+
+def test_durations() -> None:
+    """Ensures that only the thread's spans since the given time are counted."""
+    tracer = Tracer()
+    with tracer.span("before"):
+        pass
+
+    since = tracer.elapsed()
+    for _ in range(2):
+        with tracer.span("build"):
+            pass
+
+    def other_build() -> None:
+        with tracer.span("other"):
+            pass
+
+    thread = threading.Thread(target=other_build)
+    thread.start()
+    thread.join()
+
+    durations = tracer.durations(threading.current_thread().name, since)
+    assert list(durations) == ["build"]
+    assert durations["build"] == sum(span.duration for span in tracer.spans[1:3])
+
+
+def test_chrome_trace(tmp_path: Path) -> None:
+    """Ensures that the trace is written as complete events, one row per thread."""
+    tracer = Tracer()
+    with tracer.span("main phase"):
+        pass
+
+    def run_in_thread() -> None:
+        with tracer.span("other phase"):
+            pass
+
+    thread = threading.Thread(target=run_in_thread)
+    thread.start()
+    thread.join()
+    with tracer.span("write", bytes=1024):
+        pass
+
+    trace_path = tmp_path / "trace.json"
+    tracer.write(str(trace_path))
+    events = json.loads(trace_path.read_text())["traceEvents"]
+
+    metadata = [event for event in events if event["ph"] == "M"]
+    spans = [event for event in events if event["ph"] == "X"]
+    assert [event["args"]["name"] for event in metadata] == [
+        "MainThread",
+        thread.name,
+    ]
+    assert [span["name"] for span in spans] == ["main phase", "other phase", "write"]
+    assert [span["tid"] for span in spans] == [1, 2, 1]
+    assert spans[2]["args"] == {"bytes": 1024}
+
+
+def test_summary() -> None:
+    """Ensures that the summary adds up spans of the same phase."""
+    tracer = Tracer()
+    for files in (2, 3):
+        with tracer.span("copy", files=files, bytes=1024):
+            pass
+
+    lines = tracer.summary().splitlines()
+    assert lines[0].split() == ["Phase", "Time", "Details"]
+    assert lines[1].startswith("copy")
+    assert lines[1].endswith("files=5, bytes=2.0 KB")
+    assert lines[2].startswith("Total")
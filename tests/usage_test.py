@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import sys
+
+from packaged.build_log import BuildLog
+from packaged.usage import record_usage
+
+
+def test_record_usage(tmp_path: Path) -> None:
+    """
+    Ensures that the modules and data files used by every command are
+    recorded, including those of commands that time out.
+    """
+    (tmp_path / "app.py").write_text(
+        "import helper\nprint(open('data/config.txt').read())\n"
+    )
+    (tmp_path / "helper.py").write_text("")
+    (tmp_path / "server.py").write_text("import time\ntime.sleep(30)\n")
+    (tmp_path / "unused.py").write_text("")
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "config.txt").write_text("debug = false\n")
+
+    used = record_usage(
+        str(tmp_path),
+        ["python app.py", "python server.py"],
+        os.path.dirname(sys.executable),
+        BuildLog(),
+        timeout=1,
+    )
+
+    assert set(used) == {
+        "app.py",
+        "helper.py",
+        "server.py",
+        os.path.join("data", "config.txt"),
+    }
+    # In the order they were first used, across the commands
+    assert used.index("app.py") < used.index("helper.py")
+    assert used.index("helper.py") < used.index(os.path.join("data", "config.txt"))
+    assert used.index("app.py") < used.index("server.py")
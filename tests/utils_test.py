@@ -0,0 +1,11 @@
+from __future__ import annotations
+
+from packaged.utils import format_size
+
+
+def test_format_size() -> None:
+    """Ensures that sizes are shown in the largest unit that fits."""
+    assert format_size(512) == "512 B"
+    assert format_size(1536) == "1.5 KB"
+    assert format_size(25 * 1024 * 1024) == "25.0 MB"
+    assert format_size(3 * 1024**4) == "3072.0 GB"
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from packaged.watch import changed_files, snapshot, watch
+
+
+class StopWatching(Exception):
+    """Raised by the test's build to stop the watch loop."""
+
+
+def test_snapshot(tmp_path: Path) -> None:
+    """Ensures that changes are found, and ignored folders are skipped."""
+    (tmp_path / "app.py").write_text("print('hello')\n")
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "app.cpython-312.pyc").write_bytes(b"")
+    (tmp_path / "out.sh").write_text("")
+
+    old = snapshot(str(tmp_path), exclude=[str(tmp_path / "out.sh")])
+    assert list(old) == ["app.py"]
+
+    (tmp_path / "app.py").write_text("print('hello again')\n")
+    (tmp_path / "new.py").write_text("")
+    (tmp_path / "out.sh").write_text("changed")
+    new = snapshot(str(tmp_path), exclude=[str(tmp_path / "out.sh")])
+    assert changed_files(old, new) == ["app.py", "new.py"]
+    assert changed_files(new, new) == []
+
+
+def test_watch(tmp_path: Path) -> None:
+    """Ensures that a change made after the first build triggers another one."""
+    builds: list[int] = []
+    changes: list[list[str]] = []
+
+    def build() -> None:
+        builds.append(len(builds))
+        if len(builds) == 1:
+            (tmp_path / "app.py").write_text("print('changed')\n")
+        else:
+            raise StopWatching
+
+    with pytest.raises(StopWatching):
+        watch(str(tmp_path), build, on_change=changes.append, interval=0.01)
+
+    assert builds == [0, 1]
+    assert changes == [["app.py"]]
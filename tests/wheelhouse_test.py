@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import csv
+import os
+from pathlib import Path
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from packaged.wheelhouse import (
+    compiles_bytecode,
+    install_wheel,
+    pip_install_arguments,
+)
+
+
+@pytest.mark.parametrize(
+    ("build_command", "expected"),
+    (
+        ("pip install .", ["."]),
+        ("pip3 install -r requirements.txt", ["-r", "requirements.txt"]),
+        ("python3.12 -m pip install 'numpy<2' pandas", ["numpy<2", "pandas"]),
+        ("pip install -U pip", ["-U", "pip"]),
+        ("pip install -e .", None),
+        ("pip install --target=lib requests", None),
+        ("pip install . && python setup.py build_ext", None),
+        ("pip download requests", None),
+        ("python setup.py install", None),
+        ("", None),
+    ),
+)
+def test_pip_install_arguments(build_command: str, expected: list[str] | None) -> None:
+    """Ensures that only a single `pip install` is installed from a wheelhouse."""
+    assert pip_install_arguments(build_command) == expected
+
+
+def test_install_wheel(tmp_path: Path) -> None:
+    """Ensures that wheels are unpacked like pip would."""
+    wheel_path = tmp_path / "demo_pkg-1.0-py3-none-any.whl"
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        wheel.writestr("demo_pkg/__init__.py", "def main():\n    print('hello')\n")
+        script = zipfile.ZipInfo("demo_pkg-1.0.data/scripts/demo-tool")
+        wheel.writestr(script, "#!python\nimport demo_pkg\ndemo_pkg.main()\n")
+        wheel.writestr("demo_pkg-1.0.data/data/share/demo.txt", "data\n")
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/WHEEL",
+            "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/METADATA",
+            "Metadata-Version: 2.1\nName: demo-pkg\nVersion: 1.0\n",
+        )
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/entry_points.txt",
+            "[console_scripts]\ndemo = demo_pkg:main\n",
+        )
+        wheel.writestr("demo_pkg-1.0.dist-info/RECORD", "")
+
+    prefix = tmp_path / "python"
+    site_packages = prefix / "lib" / "site-packages"
+    paths = {
+        "purelib": str(site_packages),
+        "platlib": str(site_packages),
+        "scripts": str(prefix / "bin"),
+        "data": str(prefix),
+        "include": str(prefix / "include"),
+    }
+    # An older version, which is replaced
+    old_dist_info = site_packages / "demo_pkg-0.9.dist-info"
+    old_dist_info.mkdir(parents=True)
+    (site_packages / "demo_old.py").write_text("")
+    (old_dist_info / "RECORD").write_text(
+        "demo_old.py,,\ndemo_pkg-0.9.dist-info/RECORD,,\n"
+    )
+
+    install_wheel(str(wheel_path), paths)
+
+    assert not old_dist_info.exists()
+    assert not (site_packages / "demo_old.py").exists()
+    assert (prefix / "share" / "demo.txt").read_text() == "data\n"
+    assert (
+        (prefix / "bin" / "demo-tool").read_text().startswith("#!/usr/bin/env python\n")
+    )
+    dist_info = site_packages / "demo_pkg-1.0.dist-info"
+    assert (dist_info / "INSTALLER").read_text() == "packaged\n"
+    with open(dist_info / "RECORD", newline="") as record_file:
+        recorded = {row[0] for row in csv.reader(record_file)}
+    assert recorded == {
+        "demo_pkg/__init__.py",
+        os.path.join("..", "..", "share", "demo.txt"),
+        os.path.join("..", "..", "bin", "demo-tool"),
+        os.path.join("..", "..", "bin", "demo"),
+        "demo_pkg-1.0.dist-info/WHEEL",
+        "demo_pkg-1.0.dist-info/METADATA",
+        "demo_pkg-1.0.dist-info/entry_points.txt",
+        "demo_pkg-1.0.dist-info/INSTALLER",
+        "demo_pkg-1.0.dist-info/RECORD",
+    }
+
+    for script_name in ("demo", "demo-tool"):
+        script_path = prefix / "bin" / script_name
+        assert os.access(script_path, os.X_OK)
+        output = subprocess.run(
+            [sys.executable, str(script_path)],
+            env={"PYTHONPATH": str(site_packages)},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        assert output == "hello\n"
+
+
+@pytest.mark.parametrize(
+    ("arguments", "expected"),
+    (
+        (["."], True),
+        (["--no-compile", "."], False),
+        (["--no-compile", "--compile", "."], True),
+        (["--compile", ".", "--no-compile"], False),
+    ),
+)
+def test_compiles_bytecode(arguments: list[str], expected: bool) -> None:
+    """Ensures that modules are compiled unless `--no-compile` is given last."""
+    assert compiles_bytecode(arguments) is expected
+
+
+def test_install_wheel_compiles(tmp_path: Path) -> None:
+    """Ensures that the installed modules are compiled, and listed in RECORD."""
+    wheel_path = tmp_path / "demo_pkg-1.0-py3-none-any.whl"
+    with zipfile.ZipFile(wheel_path, "w") as wheel:
+        wheel.writestr("demo_pkg/__init__.py", "print('hello')\n")
+        wheel.writestr("demo_pkg/broken.py", "def (\n")
+        wheel.writestr(
+            "demo_pkg-1.0.dist-info/WHEEL",
+            "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        wheel.writestr("demo_pkg-1.0.dist-info/RECORD", "")
+
+    prefix = tmp_path / "python"
+    site_packages = prefix / "lib" / "site-packages"
+    paths = {
+        "purelib": str(site_packages),
+        "platlib": str(site_packages),
+        "scripts": str(prefix / "bin"),
+        "data": str(prefix),
+        "include": str(prefix / "include"),
+    }
+    install_wheel(str(wheel_path), paths, sys.executable)
+
+    # Modules that don't compile are left as they are, like pip does
+    pyc_name = f"__init__.{sys.implementation.cache_tag}.pyc"
+    assert os.listdir(site_packages / "demo_pkg" / "__pycache__") == [pyc_name]
+    with open(
+        site_packages / "demo_pkg-1.0.dist-info" / "RECORD", newline=""
+    ) as record_file:
+        records = {row[0]: row for row in csv.reader(record_file)}
+    pyc_record = records[f"demo_pkg/__pycache__/{pyc_name}"]
+    assert pyc_record[1].startswith("sha256=")
+    assert pyc_record[2] == str(
+        os.path.getsize(site_packages / "demo_pkg" / "__pycache__" / pyc_name)
+    )